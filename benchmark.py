@@ -0,0 +1,638 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import argparse
+import contextlib
+import json
+import math
+import random
+import socket
+import struct
+import sys
+import time
+import timeit
+
+import constants
+import physics
+import player
+import playertable
+import pysockets
+import recording
+import server
+
+## =================================================================================================
+MICRO_TOLERANCE = 0.2           # Fraction of the baseline throughput a microbenchmark may lose
+MICRO_MIN_TIME  = 0.2           # Seconds per timing run
+MICRO_REPEAT    = 5             # Timing runs per microbenchmark
+MICRO_PLAYERS   = (10, 100, 1000, 10000)    # Players in the snapshots of the microbenchmarks
+
+## =================================================================================================
+def main():
+    parser = argparse.ArgumentParser(description='Server benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    fanout = subparsers.add_parser('fanout', help='snapshot encode cost vs number of recipients')
+    fanout.add_argument('--recipients', type=int, nargs='+', default=[10, 100, 1000])
+    fanout.add_argument('--moving', type=int, default=10, help='players moving per tick')
+    fanout.add_argument('--ticks', type=int, default=10)
+    fanout.set_defaults(func=benchmark_fanout)
+
+    compression = subparsers.add_parser('compression',
+                                        help='bytes saved vs CPU of the compression modes')
+    compression.add_argument('--players', type=int, nargs='+', default=[10, 100, 1000])
+    compression.add_argument('--moving', type=int, default=10, help='players moving per tick')
+    compression.add_argument('--ticks', type=int, default=100)
+    compression.add_argument('--threshold', type=int, default=pysockets.COMPRESS_THRESHOLD,
+                             help=f'smallest frame compressed '
+                                  f'(default: {pysockets.COMPRESS_THRESHOLD})')
+    compression.set_defaults(func=benchmark_compression)
+
+    collisions = subparsers.add_parser('collisions',
+                                       help='collision detection cost vs number of players')
+    collisions.add_argument('--players', type=int, nargs='+', default=[100, 1000, 3000, 10000])
+    collisions.add_argument('--ticks', type=int, default=20)
+    collisions.set_defaults(func=benchmark_collisions)
+
+    replay = subparsers.add_parser('replay', help='push recorded traffic through the server')
+    replay.add_argument('log', help='log recorded with server.py --record')
+    replay.add_argument('--speed', type=float, default=0,
+                        help='1 replays in real time, 0 as fast as possible (default: 0)')
+    replay.add_argument('--aoi-radius', type=float, default=server.AOI_RADIUS,
+                        help=f'area of interest radius (default: {server.AOI_RADIUS})')
+    replay.add_argument('--repeat', type=int, default=1, help='times to replay the log')
+    replay.set_defaults(func=benchmark_replay)
+
+    micro = subparsers.add_parser('micro', help='throughput of the framing, player & snapshot '
+                                                'functions, compared with a stored baseline')
+    micro.add_argument('--baseline', metavar='PATH',
+                       help='compare with the results stored in this file & exit with status 1 '
+                            'if a benchmark regressed')
+    micro.add_argument('--save', metavar='PATH', help='store the results as a baseline')
+    micro.add_argument('--tolerance', type=float, default=MICRO_TOLERANCE,
+                       help=f'fraction of the baseline throughput a benchmark may lose before it '
+                            f'counts as regressed (default: {MICRO_TOLERANCE})')
+    micro.add_argument('--min-time', type=float, default=MICRO_MIN_TIME,
+                       help=f'seconds per timing run (default: {MICRO_MIN_TIME})')
+    micro.add_argument('--repeat', type=int, default=MICRO_REPEAT,
+                       help=f'timing runs per benchmark, the fastest counts '
+                            f'(default: {MICRO_REPEAT})')
+    micro.add_argument('--filter', help='only run the benchmarks whose name contains this')
+    micro.set_defaults(func=benchmark_micro)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+## -------------------------------------------------------------------------------------------------
+def benchmark_fanout(args):
+    '''
+    Broadcast snapshots to a growing number of recipients, each of them a player. Sends go to
+    connections that discard the data, so only the server side cost is measured. The encode cost
+    of the shared frame should stay constant, while encoding the full JSON message for every
+    recipient like the original broadcast grows with the square of the number of players.
+
+    :param args: parsed arguments
+    :return: None
+    '''
+    print(f'{"recipients":>10} {"codec":>10} {"encodes":>8} {"encode ms":>10} {"tick ms":>8} '
+          f'{"per-recipient encode ms":>24}')
+
+    for n in args.recipients:
+        for codec in (pysockets.BINARY_CODEC, pysockets.JSON_CODEC):
+            game_server = create_benchmark_server(n, codec)
+            timed_codec = game_server.timed_codec
+
+            ## Every client acknowledges the previous snapshot, so all share one baseline. The
+            ## first tick sends the keyframe & isn't measured.
+            start = time.perf_counter()
+            for tick in range(args.ticks + 1):
+                move_players(tick, args.moving)
+                game_server.broadcast_player_info(game_server.default_room)
+                for op in server.PLAYERS.values():
+                    op.ack = game_server.default_room.snapshot_seq
+
+                if tick == 0:
+                    timed_codec.calls = 0
+                    timed_codec.seconds = 0.0
+                    start = time.perf_counter()
+            tick_time = (time.perf_counter() - start) / args.ticks
+
+            encode_time = timed_codec.seconds / args.ticks
+            print(f'{n:>10} {codec.name:>10} {timed_codec.calls / args.ticks:>8.1f} '
+                  f'{encode_time * 1000:>10.3f} {tick_time * 1000:>8.3f} '
+                  f'{encode_time / n * 1000:>24.4f}')
+
+            game_server.close()
+
+        ## Original broadcast: encode & frame the full JSON message for every recipient
+        encode_time = 0.0
+        start = time.perf_counter()
+        for tick in range(args.ticks):
+            move_players(tick, args.moving)
+            for op in server.PLAYERS.values():
+                encode_start = time.perf_counter()
+                frame = pysockets.frame_text(server.json_dumps_players())
+                encode_time += time.perf_counter() - encode_start
+                op.c.send(frame)
+        tick_time = (time.perf_counter() - start) / args.ticks
+        encode_time /= args.ticks
+
+        print(f'{n:>10} {"legacy":>10} {n:>8.1f} {encode_time * 1000:>10.3f} '
+              f'{tick_time * 1000:>8.3f} {encode_time / n * 1000:>24.4f}')
+
+
+## -------------------------------------------------------------------------------------------------
+def benchmark_compression(args):
+    '''
+    Compress the snapshots a client receives over a number of ticks, keyframes & deltas of each
+    codec, with every compression mode. Players have random IDs & positions & a few of them move
+    every tick. Shows the bytes sent per frame against the time to compress & decompress it.
+    zlib-stream compresses every frame once per client, zlib-dict once per broadcast.
+
+    :param args: parsed arguments
+    :return: None
+    '''
+    print(f'{"players":>8} {"codec":>9} {"message":>9} {"mode":>12} {"raw B":>8} {"sent B":>8} '
+          f'{"ratio":>6} {"compress us":>12} {"decompress us":>14}')
+
+    for n in args.players:
+        frames = snapshot_frames(n, args.moving, args.ticks)
+        for (codec, message), raw in frames.items():
+            raw_bytes = sum(len(frame) for frame in raw) / len(raw)
+            print(f'{n:>8} {codec:>9} {message:>9} {"none":>12} {raw_bytes:>8.0f} '
+                  f'{raw_bytes:>8.0f} {1:>6.2f} {"":>12} {"":>14}')
+
+            for mode in pysockets.COMPRESSION_MODES:
+                compressor = pysockets.Compressor(mode, args.threshold)
+                start = time.perf_counter()
+                compressed = [compressor.compress(frame) for frame in raw]
+                compress_time = time.perf_counter() - start
+
+                decoder = pysockets.FrameDecoder(decompress=True)
+                start = time.perf_counter()
+                for frame in compressed:
+                    decoder.recv_buffer()[:len(frame)] = frame
+                    decoder.received(len(frame))
+                decompress_time = time.perf_counter() - start
+
+                sent_bytes = sum(len(frame) for frame in compressed) / len(raw)
+                print(f'{n:>8} {codec:>9} {message:>9} {mode:>12} {raw_bytes:>8.0f} '
+                      f'{sent_bytes:>8.0f} {raw_bytes / sent_bytes:>6.2f} '
+                      f'{compress_time / len(raw) * 1e6:>12.1f} '
+                      f'{decompress_time / len(raw) * 1e6:>14.1f}')
+
+
+## -------------------------------------------------------------------------------------------------
+def snapshot_frames(n, moving, ticks):
+    '''
+    Encode the snapshots of a game with n players over a number of ticks
+
+    :param n: number of players
+    :param moving: players moving per tick
+    :param ticks: number of ticks
+    :return: dict of (codec name, 'keyframe'/'delta') -> list of frames
+    '''
+    rng = random.Random(0)
+    snapshot = random_snapshot(rng, n)
+
+    frames = {}
+    ids = list(snapshot)
+    for seq in range(1, ticks + 1):
+        previous = dict(snapshot)
+        for pid in rng.sample(ids, min(moving, n)):
+            _, x, y, in_game = snapshot[pid]
+            snapshot[pid] = (pid, *player.clamp_position(x + rng.randint(-5, 5),
+                                                         y + rng.randint(-5, 5)), in_game)
+
+        for codec in (pysockets.JSON_CODEC, pysockets.BINARY_CODEC):
+            frames.setdefault((codec.name, 'keyframe'), []).append(
+                codec.encode(server.snapshot_msg(snapshot, seq)))
+            frames.setdefault((codec.name, 'delta'), []).append(
+                codec.encode(server.snapshot_msg(snapshot, seq, seq - 1, previous)))
+
+    return frames
+
+
+## -------------------------------------------------------------------------------------------------
+def benchmark_collisions(args):
+    '''
+    Resolve the collisions of players spread over the world at random, every player moving a
+    step every tick, with each backend of physics.resolve_collisions(). The growth exponent is
+    log(time ratio) / log(players ratio) against the previous row: about 1 when the cost grows
+    linearly with the players, 2 when it grows with the number of pairs.
+
+    :param args: parsed arguments
+    :return: None
+    '''
+    backends = [('python', False)]
+    if physics.numpy is not None:
+        backends.append(('numpy', True))
+    else:
+        print('NumPy is not installed, only the pure Python backend is measured')
+
+    print(f'{"players":>8} {"backend":>8} {"tick ms":>9} {"per-player us":>14} {"pushed":>8} '
+          f'{"growth":>7}')
+
+    previous = {}
+    for n in args.players:
+        for name, vectorized in backends:
+            rng = random.Random(0)
+            table = playertable.PlayerTable()
+            for pid in range(n):
+                table.add((pid, *player.clamp_position(rng.randrange(constants.WORLD_SIZE_X),
+                                                       rng.randrange(constants.WORLD_SIZE_Y)), 1))
+
+            elapsed = 0
+            pushed = 0
+            for tick in range(args.ticks):
+                for slot in range(n):
+                    x, y = table.position(slot)
+                    table.set_position(slot, *player.clamp_position(x + rng.randint(-3, 3),
+                                                                    y + rng.randint(-3, 3)))
+
+                start = time.perf_counter()
+                pushed += len(physics.resolve_collisions(table, vectorized=vectorized))
+                elapsed += time.perf_counter() - start
+
+            tick_time = elapsed / args.ticks
+            growth = ''
+            if name in previous:
+                previous_n, previous_time = previous[name]
+                growth = f'{math.log(tick_time / previous_time) / math.log(n / previous_n):.2f}'
+            previous[name] = (n, tick_time)
+
+            print(f'{n:>8} {name:>8} {tick_time * 1000:>9.3f} {tick_time / n * 1e6:>14.2f} '
+                  f'{pushed / args.ticks:>8.1f} {growth:>7}')
+
+
+## -------------------------------------------------------------------------------------------------
+def random_snapshot(rng, n):
+    '''
+    Create a snapshot of n players with random IDs & positions
+
+    :param rng: random.Random
+    :param n: number of players
+    :return: dict of player ID -> player record
+    '''
+    snapshot = {}
+    for _ in range(n):
+        pid = rng.getrandbits(48)
+        snapshot[pid] = (pid, *player.clamp_position(rng.randrange(constants.WORLD_SIZE_X),
+                                                     rng.randrange(constants.WORLD_SIZE_Y)), 1)
+    return snapshot
+
+
+## -------------------------------------------------------------------------------------------------
+def benchmark_micro(args):
+    '''
+    Measure the throughput of the functions called for every message & snapshot, each on its
+    own: framing over a socket pair & in memory, the player conversions and snapshot encoding.
+    Results can be stored as a baseline & later runs compared with it, a benchmark slower than
+    the baseline by more than the tolerance fails the run.
+
+    Throughput depends on the machine & Python version, compare with baselines stored on the
+    same machine.
+
+    :param args: parsed arguments
+    :return: None
+    '''
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        if stored.get('python') != sys.version.split()[0]:
+            print(f'Baseline is from Python {stored.get("python")}, results may not compare')
+
+    print(f'{"benchmark":<34} {"ops/s":>12} {"baseline":>12} {"change":>8}')
+
+    results = {}
+    regressed = []
+    with contextlib.ExitStack() as stack:
+        for name, function in micro_benchmarks(stack):
+            if args.filter and args.filter not in name:
+                continue
+
+            ops = measure_throughput(function, args.min_time, args.repeat)
+            results[name] = ops
+            if name not in baseline:
+                print(f'{name:<34} {ops:>12.0f} {"":>12} {"new":>8}')
+                continue
+
+            change = ops / baseline[name] - 1
+            status = ''
+            if change < -args.tolerance:
+                regressed.append(name)
+                status = '  REGRESSED'
+            print(f'{name:<34} {ops:>12.0f} {baseline[name]:>12.0f} {change:>+8.1%}{status}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': time.time(), 'python': sys.version.split()[0],
+                       'results': results}, f, indent=2)
+        print(f'Results stored in {args.save}')
+
+    if regressed:
+        print(f'{len(regressed)} benchmarks lost more than {args.tolerance:.0%} of their '
+              f'throughput: {", ".join(regressed)}')
+        sys.exit(1)
+
+
+## -------------------------------------------------------------------------------------------------
+def micro_benchmarks(stack):
+    '''
+    Set up the microbenchmarks
+
+    :param stack: contextlib.ExitStack closing the sockets afterwards
+    :return: list of (name, function doing one operation)
+    '''
+    rng = random.Random(0)
+    p = player.Player(id=rng.getrandbits(48), in_game=True)
+    player_json = p.as_json()
+    player_dict = json.loads(player_json)
+
+    ## One message sent & received per call. The pair is connected locally, so this measures the
+    ## framing & system calls, not the network.
+    a, b = socket.socketpair()
+    stack.enter_context(a)
+    stack.enter_context(b)
+
+    def send_receive():
+        pysockets.send_msg(a, player_json)
+        pysockets.receive_msg(b)
+
+    ## 100 frames decoded from memory per call
+    frames = pysockets.frame_text(player_json) * 100
+    decoder = pysockets.FrameDecoder()
+
+    def decode_frames():
+        decoder.recv_buffer()[:len(frames)] = frames
+        decoder.received(len(frames))
+
+    benchmarks = [
+        ('send_msg+receive_msg socketpair', send_receive),
+        ('FrameDecoder 100 frames', decode_frames),
+        ('player_from_json', lambda: player.player_from_json(player_json)),
+        ('player_from_dict', lambda: player.player_from_dict(player_dict)),
+        ('Player.as_json', p.as_json),
+        ('get_color', lambda: player.get_color(p.id)),
+        ('get_color uncached', lambda: player.get_color.__wrapped__(p.id)),
+    ]
+
+    for n in MICRO_PLAYERS:
+        snapshot = random_snapshot(rng, n)
+        binary = pysockets.BINARY_CODEC.encode(server.snapshot_msg(snapshot, 1))
+        benchmarks += [
+            (f'json_dumps_players {n}',
+             lambda snapshot=snapshot: server.json_dumps_players(snapshot, 1)),
+            (f'binary snapshot encode {n}',
+             lambda snapshot=snapshot: pysockets.BINARY_CODEC.encode(
+                 server.snapshot_msg(snapshot, 1))),
+            (f'binary snapshot decode {n}',
+             lambda binary=binary: pysockets.decode_frame(
+                 True, binary[pysockets.BINARY_HEADER.size:])),
+        ]
+
+    return benchmarks
+
+
+## -------------------------------------------------------------------------------------------------
+def measure_throughput(function, min_time, repeat):
+    '''
+    Time a function, calling it often enough that a timing run takes at least min_time
+
+    :param function: function without arguments
+    :param min_time: seconds per timing run
+    :param repeat: timing runs, the fastest counts
+    :return: calls per second
+    '''
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+
+    return number / min(timer.repeat(repeat, number))
+
+
+## -------------------------------------------------------------------------------------------------
+def benchmark_replay(args):
+    '''
+    Replay a recorded log through the server: every recorded frame is decoded & handled like
+    read_data() does & every recorded tick broadcasts, to connections that discard the data. The
+    recording decides the timing, so runs are repeatable. Prints the throughput & compares what
+    was sent with the recording.
+
+    :param args: parsed arguments
+    :return: None
+    '''
+    print(f'{"run":>4} {"seconds":>8} {"frames/s":>10} {"ticks/s":>9} {"ms/tick":>8} '
+          f'{"sent frames":>12} {"recorded":>9} {"sent MB":>8} {"recorded":>9}')
+
+    for run in range(args.repeat):
+        with recording.LogReader(args.log) as log:
+            result = replay_log(log, args.speed, args.aoi_radius)
+
+        seconds = result['seconds']
+        print(f'{run + 1:>4} {seconds:>8.3f} {result["frames"] / seconds:>10.0f} '
+              f'{result["ticks"] / seconds:>9.0f} '
+              f'{result["tick_seconds"] / max(result["ticks"], 1) * 1000:>8.3f} '
+              f'{result["sent_frames"]:>12} {result["recorded_frames"]:>9} '
+              f'{result["sent_bytes"] / 1e6:>8.2f} {result["recorded_bytes"] / 1e6:>9.2f}')
+
+
+## -------------------------------------------------------------------------------------------------
+def replay_log(log, speed=0, aoi_radius=server.AOI_RADIUS):
+    '''
+    Replay a recorded log through a GameServer
+
+    :param log: recording.LogReader
+    :param speed: replay speed relative to the recording, 0 for as fast as possible
+    :param aoi_radius: area of interest radius
+    :return: dict of results
+    '''
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    s.listen()
+    game_server = server.GameServer(s, aoi_radius=aoi_radius)
+    game_server.selector.close()
+    game_server.selector = NullSelector()
+
+    server.PLAYERS.clear()
+    server.PLAYER_TABLE.clear()
+
+    ## Connection number -> OnlinePlayer
+    connections = {}
+    ## Session token issued by the recorded server -> token issued by the replaying one
+    sessions = {}
+    result = dict.fromkeys(('frames', 'ticks', 'tick_seconds', 'sent_frames', 'recorded_frames',
+                            'sent_bytes', 'recorded_bytes'), 0)
+
+    start = time.perf_counter()
+    for t, event, connection, flags, payload in log:
+        if speed:
+            delay = start + t / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        if event == recording.RECEIVED:
+            op = connections.get(connection)
+            if op is None or op.closed:
+                continue
+            result['frames'] += 1
+            try:
+                msg = pysockets.decode_frame(flags & recording.FLAG_BINARY, payload)
+            except (ValueError, KeyError, TypeError, struct.error):
+                continue
+            if flags & recording.FLAG_UDP and 'input' not in msg and 'ack' not in msg:
+                continue
+            if 'hello' in msg and isinstance(msg['hello'], dict) and 'session' in msg['hello']:
+                msg['hello']['session'] = sessions.get(msg['hello']['session'])
+            game_server.handle_msg(op, msg)
+
+        elif event == recording.TICK:
+            tick_start = time.perf_counter()
+            game_server.tick()
+            result['tick_seconds'] += time.perf_counter() - tick_start
+            result['ticks'] += 1
+
+        elif event == recording.SENT:
+            result['recorded_frames'] += 1
+            result['recorded_bytes'] += len(payload)
+
+            ## Hello replies are JSON, the tokens in them are needed to resume sessions
+            op = connections.get(connection)
+            message = payload[pysockets.HEADER_SIZE:]
+            if op is not None and op.session is not None and message[:8] == b'{"hello"':
+                recorded = pysockets.decode_frame(False, message)
+                sessions[recorded['hello'].get('session')] = op.session
+
+        elif event == recording.OPENED:
+            ip, _, port = bytes(payload).decode('utf-8').rpartition(':')
+            connections[connection] = server.OnlinePlayer(NullConnection(), (ip, int(port)))
+
+        elif event == recording.CLOSED:
+            op = connections.pop(connection, None)
+            if op is not None:
+                game_server.disconnect(op, resumable=bool(flags & recording.FLAG_RESUMABLE))
+    result['seconds'] = time.perf_counter() - start
+
+    ## Frames queued on the null connections are sent right away
+    result['sent_frames'] = sum(game_server.messages_sent.values.values())
+    result['sent_bytes'] = sum(game_server.bytes_sent.values.values())
+
+    for op in connections.values():
+        game_server.disconnect(op)
+    game_server.close()
+    return result
+
+
+## -------------------------------------------------------------------------------------------------
+def create_benchmark_server(n, codec):
+    '''
+    Create a server with n connected players that don't send anything
+
+    :param n: number of players
+    :param codec: codec used by every connection
+    :return: GameServer
+    '''
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    s.listen()
+    game_server = server.GameServer(s, aoi_radius=0)
+    game_server.timed_codec = TimedCodec(codec)
+
+    server.PLAYERS.clear()
+    server.PLAYER_TABLE.clear()
+    for pid in range(n):
+        op = server.OnlinePlayer(NullConnection(), ('127.0.0.1', pid))
+        op.pid = pid
+        op.room = game_server.default_room
+        op.room.members.add(op)
+        op.slot = server.PLAYER_TABLE.add(player.Player(id=pid, in_game=True).as_record())
+        op.codec = game_server.timed_codec
+        server.PLAYERS.add(pid, op)
+
+    return game_server
+
+
+## -------------------------------------------------------------------------------------------------
+def move_players(tick, n):
+    '''
+    Move n players of server.PLAYERS
+
+    :param tick: tick number, picks the players to move
+    :param n: number of players
+    :return: None
+    '''
+    players = list(server.PLAYERS.values())
+    for i in range(n):
+        slot = players[(tick * n + i) % len(players)].slot
+        x, y = server.PLAYER_TABLE.position(slot)
+        server.PLAYER_TABLE.set_position(slot, (x + 1) % 500, y)
+
+
+## -------------------------------------------------------------------------------------------------
+class NullConnection:
+    '''
+    Connection that discards everything sent to it
+    '''
+    def send(self, data):
+        return len(data)
+
+
+    def close(self):
+        pass
+
+
+## -------------------------------------------------------------------------------------------------
+class NullSelector:
+    '''
+    Selector for servers whose connections are NullConnections, which are never waited for
+    '''
+    def register(self, fileobj, events, data=None):
+        pass
+
+
+    def unregister(self, fileobj):
+        pass
+
+
+    def modify(self, fileobj, events, data=None):
+        pass
+
+
+    def get_map(self):
+        return {}
+
+
+    def close(self):
+        pass
+
+
+## -------------------------------------------------------------------------------------------------
+class TimedCodec:
+    def __init__(self, codec):
+        '''
+        Codec wrapper that counts & times encode calls
+
+        :param codec: wrapped codec
+        '''
+        self.codec = codec
+        self.name = codec.name
+        self.calls = 0
+        self.seconds = 0.0
+
+
+    def encode(self, msg):
+        start = time.perf_counter()
+        frame = self.codec.encode(msg)
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+        return frame
+
+
+## =================================================================================================
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 6)
+    main()
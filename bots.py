@@ -0,0 +1,669 @@
+## =================================================================================================
+## Python 3.7+
+## =================================================================================================
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import constants
+import player
+import pysockets
+import server
+
+## =================================================================================================
+MOVE_RATE       = 10            # Moves per second per bot
+MOVE_STEPS      = 10            # The bots are moved in this many groups per move period
+CONNECT_BATCH   = 100           # Connections opened concurrently
+JOIN_TIMEOUT    = 30.0          # Seconds to wait for every bot to join
+SETTLE_TIME     = 1.0           # Seconds to wait for the last moves before checking positions
+
+## =================================================================================================
+def main():
+    parser = argparse.ArgumentParser(description='Headless bots & end to end server benchmark. '
+                                                 'Prints the results as JSON.')
+    parser.add_argument('--server', default=f'{pysockets.get_ip()}:{pysockets.PORT}',
+                        help='server address IP:PORT (default: %(default)s)')
+    parser.add_argument('--spawn-server', action='store_true',
+                        help='start server.py for the benchmark & measure its CPU & memory use')
+    parser.add_argument('--server-args', default='',
+                        help='arguments for the spawned server, e.g. "--tick-rate 30"')
+    parser.add_argument('--server-pid', type=int,
+                        help='measure the CPU & memory use of an already running server')
+    parser.add_argument('--bots', type=int, default=100, help='number of bots (default: 100)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to measure after every bot joined (default: 10)')
+    parser.add_argument('--move-rate', type=float, default=MOVE_RATE,
+                        help=f'moves per second per bot (default: {MOVE_RATE})')
+    parser.add_argument('--codec', choices=list(pysockets.CODECS),
+                        help='codec offered to the server, default offers all')
+    parser.add_argument('--compression', choices=list(pysockets.COMPRESSION_MODES) + ['off'],
+                        help='compression mode offered to the server, default offers all')
+    parser.add_argument('--room', help='room joined by every bot, default lets the server pick')
+    parser.add_argument('--udp', action='store_true',
+                        help='ask for the UDP channel, the server needs --udp as well')
+    parser.add_argument('--udp-loss', type=float, default=0.0,
+                        help='fraction of datagrams dropped by the bots in both directions, '
+                             'simulates packet loss (default: 0)')
+    parser.add_argument('--tcp', action='store_true',
+                        help='connect over TCP even if the server runs on this host, by default '
+                             'its Unix socket is used')
+    parser.add_argument('--reconnect-storm', action='store_true',
+                        help='after measuring, drop every connection at once & reconnect with '
+                             'the session tokens, measuring how long until every bot is back')
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    server.raise_open_file_limit()
+
+    server_process = None
+    if args.spawn_server:
+        server_process, args.server = spawn_server(args.server_args.split())
+        args.server_pid = server_process.pid
+
+    try:
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+## -------------------------------------------------------------------------------------------------
+def spawn_server(server_args):
+    '''
+    Start server.py & wait until it is listening
+
+    :param server_args: list of command line arguments
+    :return: (subprocess.Popen, server address IP:PORT)
+    '''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    process = subprocess.Popen([sys.executable, '-u', path] + server_args,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True)
+
+    ## The Unix socket is opened after the TCP socket, wait for it unless it's turned off
+    wait_for_unix = pysockets.unix_sockets_supported() and '--no-unix-socket' not in server_args
+    address = None
+    for line in process.stdout:
+        match = re.match(r'Server socket bound to (\S+)', line)
+        if match:
+            address = match.group(1)
+        if address is not None and (not wait_for_unix or line.startswith('Unix socket')):
+            ## Keep reading the output so the server never blocks on a full pipe
+            threading.Thread(target=collections.deque, args=(process.stdout, 0),
+                             daemon=True).start()
+            return process, address
+
+    raise RuntimeError('server.py exited before listening')
+
+
+## -------------------------------------------------------------------------------------------------
+def process_usage(pid):
+    '''
+    Get the CPU time & resident memory of a process and its children (worker processes) from
+    /proc. Only available on Linux.
+
+    :param pid: process ID
+    :return: (CPU seconds, RSS bytes), None if unavailable
+    '''
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+
+    cpu = 0.0
+    rss = 0
+    try:
+        for p in pids:
+            with open(f'/proc/{p}/stat') as f:
+                ## Fields after the command name, which may contain spaces
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+            rss += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return cpu, rss
+
+
+## -------------------------------------------------------------------------------------------------
+def percentile(samples, q):
+    '''
+    Get a percentile of sorted samples
+
+    :param samples: sorted list
+    :param q: percentile in [0, 1]
+    :return: sample, None without samples
+    '''
+    if not samples:
+        return None
+
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+## -------------------------------------------------------------------------------------------------
+async def run_benchmark(args):
+    '''
+    Connect the bots, wait until every bot joined, then move them for the duration of the
+    benchmark
+
+    :param args: parsed arguments
+    :return: results dict
+    '''
+    ip, port = args.server.split(':')
+    hello = {'codecs': [args.codec] if args.codec else list(pysockets.CODECS), 'udp': args.udp}
+    if args.room:
+        hello['room'] = args.room
+    if args.compression != 'off':
+        hello['compression'] = ([args.compression] if args.compression
+                                else list(pysockets.COMPRESSION_MODES))
+    stats = BotStats()
+    path = None if args.tcp else pysockets.local_socket_path(ip, int(port))
+
+    ## Join
+    bots = []
+    start = time.perf_counter()
+    for i in range(0, args.bots, CONNECT_BATCH):
+        batch = [Bot(stats, hello, args.udp_loss)
+                 for _ in range(i, min(i + CONNECT_BATCH, args.bots))]
+        await asyncio.gather(*[bot.connect(ip, int(port), path) for bot in batch])
+        bots += batch
+
+    deadline = time.perf_counter() + JOIN_TIMEOUT
+    while len(stats.join_times) < len(bots) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    join_time = max(stats.join_times, default=0.0)
+
+    ## Measure
+    stats.reset()
+    usage_start = process_usage(args.server_pid) if args.server_pid else None
+    start = time.perf_counter()
+    step = 0
+    while time.perf_counter() - start < args.duration:
+        for bot in bots[step % MOVE_STEPS::MOVE_STEPS]:
+            bot.move()
+        step += 1
+        await asyncio.sleep(1 / args.move_rate / MOVE_STEPS)
+    duration = time.perf_counter() - start
+    usage_end = process_usage(args.server_pid) if args.server_pid else None
+
+    ## Drop every connection at once, like a network outage, & reconnect with backoff
+    reconnect = None
+    if args.reconnect_storm:
+        stats.join_times = []
+        for bot in bots:
+            bot.drop()
+        attempts = await asyncio.gather(*[bot.reconnect(ip, int(port), path) for bot in bots])
+
+        deadline = time.perf_counter() + JOIN_TIMEOUT
+        while len(stats.join_times) < len(bots) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        reconnect = {
+            'rejoined': len(stats.join_times),
+            'resumed': sum(bot.resumed for bot in bots),
+            'attempts': sum(attempts),
+            'seconds': max(stats.join_times, default=None),
+            'p50_seconds': percentile(sorted(stats.join_times), 0.5),
+        }
+
+    ## Every bot should end up where it thinks it is, even with lost datagrams
+    for _ in range(pysockets.INPUT_REDUNDANCY):
+        for bot in bots:
+            bot.repeat_inputs()
+        await asyncio.sleep(1 / args.move_rate)
+    await asyncio.sleep(SETTLE_TIME)
+    mismatches = sum(bot.server_position() != (bot.player.x, bot.player.y) for bot in bots)
+
+    for bot in bots:
+        bot.close()
+
+    latencies = sorted(stats.latencies)
+    results = {
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'bots': len(bots),
+        'transport': 'unix' if path else 'tcp',
+        'joined': sum(bot.joined for bot in bots),
+        'codec': collections.Counter(bot.codec.name for bot in bots).most_common(1)[0][0],
+        'compression': collections.Counter(bot.compression for bot in bots).most_common(1)[0][0],
+        'duration': duration,
+        'join_rate': (len(bots) / join_time) if join_time else None,
+        'msgs_out_per_s': stats.msgs_out / duration,
+        'msgs_in_per_s': stats.msgs_in / duration,
+        'bytes_in_per_client_per_s': stats.bytes_in / duration / len(bots),
+        'bytes_out_per_client_per_s': stats.bytes_out / duration / len(bots),
+        'udp_bots': sum(bot.udp_ready for bot in bots),
+        'datagrams_lost': stats.datagrams_lost,
+        'datagrams_stale': sum(bot.udp_channel.stale for bot in bots if bot.udp_channel),
+        'position_mismatches': mismatches,
+        'reconnect': reconnect,
+        'latency_ms': {
+            'samples': len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'p999': percentile(latencies, 0.999),
+        },
+        'server': None,
+    }
+    if usage_start and usage_end:
+        results['server'] = {
+            'cpu_percent': 100 * (usage_end[0] - usage_start[0]) / duration,
+            'rss_mb': usage_end[1] / 2**20,
+        }
+
+    return results
+
+
+## -------------------------------------------------------------------------------------------------
+class BotStats:
+    def __init__(self):
+        '''
+        Counters shared by every bot
+        '''
+        self.join_times = []            # Seconds from connecting until the own player is received
+        self.datagrams_lost = 0         # Dropped to simulate packet loss
+        self.reset()
+
+
+    def reset(self):
+        '''
+        Start a new measurement of the message counters & latencies
+
+        :return: None
+        '''
+        self.msgs_in = 0
+        self.msgs_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = []             # Milliseconds
+
+
+## -------------------------------------------------------------------------------------------------
+class Bot(asyncio.BufferedProtocol):
+    def __init__(self, stats, hello, udp_loss=0.0):
+        '''
+        Headless client moving a player at random. Received data goes straight into the buffer of
+        a pysockets.FrameDecoder.
+
+        Update latency is the time from sending a move until a snapshot holds the new position.
+        The send time of every input is kept until the server reports it applied, see reconcile().
+
+        Over UDP the bot behaves like GuiGame: inputs are repeated in every datagram & stale
+        datagrams are dropped. A fraction of the datagrams can be dropped on purpose. Like
+        GuiGame, the bot corrects its player with the position the server has, see reconcile().
+
+        :param stats: BotStats
+        :param hello: hello message sent to the server
+        :param udp_loss: fraction of datagrams to drop
+        '''
+        self.stats = stats
+        self.hello = hello
+        self.udp_loss = udp_loss
+        self.player = player.Player(id=random.getrandbits(48), in_game=True)
+        self.decoder = pysockets.FrameDecoder(decompress=True)
+        self.codec = pysockets.JSON_CODEC
+        self.compression = None                     # Compression mode picked by the server
+        self.transport = None
+        self.joined = False
+        self.snapshots = collections.OrderedDict()  # Snapshot seq -> {player ID: record}
+        self.input_seq = 0
+        self.sent_inputs = collections.deque()      # (seq, dx, dy, send time) not applied yet
+        self.applied = None                         # Last 'applied' message
+        self.udp = None                             # Datagram transport
+        self.udp_channel = None
+        self.udp_ready = False
+        self.recent_inputs = collections.deque(maxlen=pysockets.INPUT_REDUNDANCY)
+        self.connected_at = time.perf_counter()
+        self.session = None                         # Session token from the server's hello
+        self.resumed = False                        # The server resumed the session
+        self.disconnected = asyncio.Event()
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.disconnected.clear()
+        self.send({'hello': dict(self.hello, session=self.session) if self.session else self.hello})
+
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.udp_ready = False
+        if self.udp is not None:
+            self.udp.close()
+            self.udp = None
+        self.disconnected.set()
+
+
+    def get_buffer(self, sizehint):
+        return self.decoder.recv_buffer()
+
+
+    def buffer_updated(self, nbytes):
+        self.stats.bytes_in += nbytes
+        for binary, payload in self.decoder.received(nbytes):
+            self.stats.msgs_in += 1
+            msg = pysockets.decode_frame(binary, payload)
+            if 'hello' in msg:
+                self.codec = pysockets.CODECS.get(msg['hello'].get('codec'),
+                                                  pysockets.JSON_CODEC)
+                self.compression = msg['hello'].get('compression')
+                if msg['hello'].get('udp') is not None:
+                    asyncio.ensure_future(self.open_udp(msg['hello']['udp']))
+                self.session = msg['hello'].get('session')
+                self.resumed = bool(msg['hello'].get('resumed'))
+                if self.resumed:
+                    ## Continue from the position the server has, like GuiGame
+                    _, self.player.x, self.player.y, _ = msg['hello']['player']
+                else:
+                    self.send({'player': self.player.as_record()})
+                self.sent_inputs.clear()
+            elif 'applied' in msg:
+                self.applied = msg['applied']
+            else:
+                self.apply_snapshot(msg)
+
+
+    def datagram_received(self, data):
+        '''
+        Handle a datagram from the server
+
+        :param data: datagram bytes
+        :return: None
+        '''
+        if random.random() < self.udp_loss:
+            self.stats.datagrams_lost += 1
+            return
+
+        token, seq, frames = pysockets.split_datagram(data)
+        if token != self.udp_channel.token or not self.udp_channel.accept(seq):
+            return
+
+        self.udp_ready = True
+        self.stats.bytes_in += len(data)
+        for binary, payload in frames:
+            self.stats.msgs_in += 1
+            msg = pysockets.decode_frame(binary, payload)
+            if 'applied' in msg:
+                self.applied = msg['applied']
+            else:
+                self.apply_snapshot(msg)
+
+
+    async def open_udp(self, token):
+        '''
+        Open the UDP channel offered by the server & register with it
+
+        :param token: token from the server's hello
+        :return: None
+        '''
+        loop = asyncio.get_running_loop()
+        self.udp, _ = await loop.create_datagram_endpoint(
+            lambda: BotDatagrams(self), remote_addr=self.transport.get_extra_info('peername'))
+        self.udp_channel = pysockets.DatagramChannel(token)
+        self.send_datagram([])
+
+
+    def send_datagram(self, frames):
+        '''
+        Send frames in one datagram, unless it is dropped to simulate packet loss
+
+        :param frames: list of encoded frames
+        :return: None
+        '''
+        if self.udp is None:
+            ## The connection was lost, the datagram transport with it
+            return
+
+        data = self.udp_channel.pack(frames)
+        if random.random() < self.udp_loss:
+            self.stats.datagrams_lost += 1
+            return
+
+        self.udp.sendto(data)
+        self.stats.bytes_out += len(data)
+
+
+    def repeat_inputs(self):
+        '''
+        Send the recent inputs again without moving, like GuiGame does after the player stopped
+
+        :return: None
+        '''
+        if self.udp_ready and self.recent_inputs:
+            self.send_datagram(self.recent_inputs)
+
+
+    def server_position(self):
+        '''
+        Get the own position in the newest snapshot
+
+        :return: (x, y), None if the newest snapshot doesn't hold the own player
+        '''
+        if not self.snapshots:
+            return None
+
+        record = next(reversed(self.snapshots.values())).get(self.player.id)
+        return None if record is None else (record[1], record[2])
+
+
+    def drop(self):
+        '''
+        Abort the connection without leaving the game, like a network failure. The bot keeps its
+        player & session for reconnect().
+
+        :return: None
+        '''
+        if self.transport is not None:
+            self.transport.abort()
+
+        self.decoder = pysockets.FrameDecoder(decompress=True)
+        self.codec = pysockets.JSON_CODEC
+        self.compression = None
+        self.joined = False
+        self.snapshots.clear()
+        self.applied = None
+        self.udp_channel = None
+        self.udp_ready = False
+        self.recent_inputs.clear()
+        self.connected_at = time.perf_counter()
+
+
+    async def connect(self, ip, port, path=None):
+        '''
+        Connect to the server
+
+        :param ip: server IP
+        :param port: server port
+        :param path: Unix socket of the server to connect to instead, see pysockets.connect()
+        :return: None
+        '''
+        loop = asyncio.get_running_loop()
+        if path is not None:
+            await loop.create_unix_connection(lambda: self, path)
+        else:
+            await loop.create_connection(lambda: self, ip, port)
+
+
+    async def reconnect(self, ip, port, path=None):
+        '''
+        Connect again after drop(), with jittered exponential backoff like GuiGame
+
+        :param ip: server IP
+        :param port: server port
+        :param path: Unix socket of the server to connect to instead
+        :return: number of attempts
+        '''
+        await self.disconnected.wait()
+        attempt = 0
+        while True:
+            await asyncio.sleep(pysockets.reconnect_delay(attempt))
+            attempt += 1
+            try:
+                await self.connect(ip, port, path)
+                return attempt
+            except OSError:
+                pass
+
+
+    def close(self):
+        '''
+        Leave the game & close the connection
+
+        :return: None
+        '''
+        if self.transport is not None:
+            self.player.in_game = False
+            self.send({'player': self.player.as_record()})
+            self.transport.close()
+
+
+    def send(self, msg):
+        '''
+        Send a message with the negotiated codec
+
+        :param msg: message dict, see pysockets.JsonCodec
+        :return: None
+        '''
+        if self.transport is None:
+            return
+
+        data = self.codec.encode(msg)
+        self.stats.msgs_out += 1
+        if self.udp_ready and 'input' in msg:
+            self.recent_inputs.append(data)
+            self.send_datagram(self.recent_inputs)
+        elif self.udp_ready and 'ack' in msg:
+            self.send_datagram([data])
+        else:
+            self.transport.write(data)
+            self.stats.bytes_out += len(data)
+
+
+    def move(self):
+        '''
+        Take a random step & send it as input command like GuiGame does
+
+        :return: None
+        '''
+        ## Keep registering until the server answers over UDP
+        if self.udp_channel is not None and not self.udp_ready:
+            self.send_datagram([])
+
+        if not self.joined:
+            return
+
+        x, y = self.player.x, self.player.y
+        self.player.move(random.choice((-1, 1)) * constants.MOVE_SIZE,
+                         random.choice((-1, 1)) * constants.MOVE_SIZE)
+
+        self.input_seq += 1
+        t = int(time.monotonic() * 1000) & 0xFFFFFFFF
+        self.send({'input': (self.input_seq, self.player.x - x, self.player.y - y, t)})
+        self.sent_inputs.append((self.input_seq, self.player.x - x, self.player.y - y,
+                                 time.perf_counter()))
+
+
+    def apply_snapshot(self, msg):
+        '''
+        Apply a snapshot like GuiGame.apply_snapshot() & measure the latency of the own inputs
+
+        :param msg: message dict
+        :return: None
+        '''
+        if self.snapshots and msg['seq'] <= next(reversed(self.snapshots)):
+            return
+
+        if 'base' in msg:
+            base_players = self.snapshots.get(msg['base'])
+            if base_players is None:
+                self.snapshots.clear()
+                self.send({'ack': 0})
+                return
+
+            players = dict(base_players)
+            for pid in msg['removed']:
+                players.pop(pid, None)
+        else:
+            players = {}
+
+        now = time.perf_counter()
+        for record in msg['players']:
+            players[record[0]] = record
+            if record[0] == self.player.id:
+                if not self.joined:
+                    self.joined = True
+                    self.stats.join_times.append(now - self.connected_at)
+
+        own = players.get(self.player.id)
+        if own is not None and self.applied is not None and self.applied[0] == msg.get('seq'):
+            self.reconcile(own[1], own[2], self.applied[1], now)
+
+        if 'seq' in msg:
+            self.snapshots[msg['seq']] = players
+            while len(self.snapshots) > constants.SNAPSHOT_HISTORY:
+                self.snapshots.popitem(last=False)
+
+            self.send({'ack': msg['seq']})
+
+
+    def reconcile(self, x, y, input_seq, now):
+        '''
+        Correct the player with its position in a snapshot like GuiGame.reconcile(). The inputs
+        applied to that position are shown for the first time, their latency is measured.
+
+        :param x: x position in the snapshot
+        :param y: y position in the snapshot
+        :param input_seq: last input applied to that position
+        :param now: time the snapshot was received
+        :return: None
+        '''
+        while self.sent_inputs and self.sent_inputs[0][0] <= input_seq:
+            sent_at = self.sent_inputs.popleft()[3]
+            self.stats.latencies.append((now - sent_at) * 1000)
+        for _, dx, dy, _ in self.sent_inputs:
+            x, y = player.clamp_position(x + dx, y + dy)
+        self.player.x, self.player.y = x, y
+
+
+## -------------------------------------------------------------------------------------------------
+class BotDatagrams(asyncio.DatagramProtocol):
+    def __init__(self, bot):
+        '''
+        UDP side of a bot
+
+        :param bot: Bot
+        '''
+        self.bot = bot
+
+
+    def datagram_received(self, data, addr):
+        try:
+            self.bot.datagram_received(data)
+        except (ValueError, KeyError, struct.error):
+            pass
+
+
+    def error_received(self, exc):
+        pass
+
+
+## =================================================================================================
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 7)
+    main()
@@ -3,6 +3,10 @@
 ## =================================================================================================
 DOT_SIZE        = 10            # Size of player dot
 MOVE_SIZE       = 5             # Size of each movement
+MAX_INPUT_MOVE  = 4 * MOVE_SIZE # Largest movement per axis of one input command
 WINDOW_SIZE_XY  = '550x600'     # Window size (Width x Height)
 CANVAS_SIZE_X   = 500           # Canvas width
-CANVAS_SIZE_Y   = 500           # Canvas height
\ No newline at end of file
+CANVAS_SIZE_Y   = 500           # Canvas height
+WORLD_SIZE_X    = 2000          # World width, the canvas shows the part around the player
+WORLD_SIZE_Y    = 2000          # World height
+SNAPSHOT_HISTORY = 32           # Snapshots kept as delta baselines (server & client)
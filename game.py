@@ -1,9 +1,11 @@
 ## =================================================================================================
 ## Python 3.6+
 ## =================================================================================================
-import json
+import collections
 import os
+import select
 import socket
+import struct
 import sys
 import threading
 import time
@@ -13,6 +15,10 @@ import constants
 import player
 import pysockets
 
+## =================================================================================================
+UDP_REGISTER_ATTEMPTS   = 20    # Frames to wait for the server to answer over UDP
+MAX_UNAPPLIED_INPUTS    = 256   # Inputs kept until the server applied them, see reconcile()
+
 ## =================================================================================================
 def main():
     game = GuiGame()
@@ -58,9 +64,30 @@ class GuiGame:
 
         ## Start online TCP service in daemon thread
         self.mp_connected   = False
-        self.mp_players     = []
-        self.mp_player_dots = []
+        self.mp_players     = {}                          # Player ID -> Player, see apply_snapshot
+        self.mp_player_dots = {}                          # Player ID -> (canvas item, x, y)
+        self.drawn_players  = None
+        self.input_seq      = 0                           # Input commands sent
+        self.input_dx       = 0                           # Movement not sent yet
+        self.input_dy       = 0
+        self.sent_inputs    = collections.deque(maxlen=MAX_UNAPPLIED_INPUTS)  # (seq, dx, dy)
+        self.applied        = None                        # Last input applied, see apply_snapshot
+        self.own_positions  = collections.deque()         # (x, y, input seq) from the online thread
+        self.status_updates = collections.deque()         # (widget, text) from the online thread
+        self.hello_replies  = collections.deque()         # Hello replies from the online thread
+        self.hello_pending  = False                       # Inputs wait until the reply is applied
+        self.mp_snapshots   = collections.OrderedDict()   # Snapshot seq -> {player ID: Player}
         self.server         = None
+        self.address        = None                        # Server address read from the entry box
+        self.session        = None                        # Session token from the server's hello
+        self.codec          = pysockets.JSON_CODEC
+        self.send_lock      = threading.Lock()
+        self.udp            = None                        # UDP socket, if the server offers it
+        self.udp_channel    = None
+        self.udp_ready      = False                       # The server answered over UDP
+        self.udp_attempts   = 0
+        self.recent_inputs  = collections.deque(maxlen=pysockets.INPUT_REDUNDANCY)
+        self.input_repeats  = 0                           # Frames to repeat the last inputs
         self.stop_thread    = False
         self.online_thread  = threading.Thread(target=self.online_function, daemon=True)
 
@@ -86,8 +113,10 @@ class GuiGame:
         :param event:
         :return: None
         '''
-        ## Start TCP connection
+        ## Start TCP connection. The online thread reconnects to the same address, it can't read
+        ## the entry box itself.
         if self.mp_connected == False:
+            self.address = self.server_addr.get()
             self.server_connect()
 
         if self.mp_connected == True:
@@ -103,20 +132,26 @@ class GuiGame:
                 self.player = player.Player(id=int(time.time()*1000), in_game=True)
 
                 ## Send player info to server
-                pysockets.send_msg(self.server, self.player.as_json())
+                self.send_to_server({'player': self.player.as_record()})
 
                 ## Redraw label to reflect player number and color
                 self.label.config(fg=self.player.color, text=f'You are player '
                                   f'{self.player.id + 1}. Use arrow keys to move.')
+                ## The canvas shows the part of the world around the player
                 self.canvas = tkinter.Canvas(self.root, bg='white', height=constants.CANVAS_SIZE_Y,
-                                             width=constants.CANVAS_SIZE_X)
+                                             width=constants.CANVAS_SIZE_X, highlightthickness=0,
+                                             scrollregion=(0, 0, constants.WORLD_SIZE_X,
+                                                           constants.WORLD_SIZE_Y))
                 self.canvas.pack()
+                self.canvas.create_rectangle(0, 0, constants.WORLD_SIZE_X - 1,
+                                             constants.WORLD_SIZE_Y - 1, outline='gray')
 
                 ## Draw player on canvas
                 n = constants.DOT_SIZE / 2
                 self.dot = self.canvas.create_oval((self.player.x - n), (self.player.y - n),
                                                    (self.player.x + n), (self.player.y + n),
                                                    fill=self.player.color)
+                self.follow_player()
                 self.in_game = True
                 self.update_game_loop()
         else:
@@ -132,9 +167,7 @@ class GuiGame:
         :return: None
         '''
         if self.in_game == True:
-            if self.player.x - constants.MOVE_SIZE > 0 + constants.DOT_SIZE/2:
-                self.player.x = self.player.x - constants.MOVE_SIZE
-                self.move(-constants.MOVE_SIZE, 0)
+            self.move(-constants.MOVE_SIZE, 0)
 
 
     def move_right(self, event):
@@ -145,9 +178,7 @@ class GuiGame:
         :return: None
         '''
         if self.in_game == True:
-            if self.player.x + constants.MOVE_SIZE < constants.CANVAS_SIZE_X - constants.DOT_SIZE/2:
-                self.player.x = self.player.x + constants.MOVE_SIZE
-                self.move(constants.MOVE_SIZE, 0)
+            self.move(constants.MOVE_SIZE, 0)
 
 
     def move_up(self, event):
@@ -158,9 +189,7 @@ class GuiGame:
         :return: None
         '''
         if self.in_game == True:
-            if self.player.y - constants.MOVE_SIZE > constants.DOT_SIZE/2:
-                self.player.y = self.player.y - constants.MOVE_SIZE
-                self.move(0, -constants.MOVE_SIZE)
+            self.move(0, -constants.MOVE_SIZE)
 
 
     def move_down(self, event):
@@ -171,59 +200,190 @@ class GuiGame:
         :return: None
         '''
         if self.in_game == True:
-            if self.player.y + constants.MOVE_SIZE < constants.CANVAS_SIZE_Y - constants.DOT_SIZE/2:
-                self.player.y = self.player.y + constants.MOVE_SIZE
-                self.move(0, constants.MOVE_SIZE)
+            self.move(0, constants.MOVE_SIZE)
 
 
     def move(self, dx, dy):
         '''
-        Move the player dot & send updated position to server
+        Move the player dot right away. The movement is added to the next input command, see
+        send_input().
 
         :param dx: delta x movement
         :param dy: delta y movement
         :return: None
         '''
+        ## Move the player, staying inside the world like the server does
+        x, y = self.player.x, self.player.y
+        self.player.move(dx, dy)
+        dx, dy = self.player.x - x, self.player.y - y
+
         ## Move the player dot
         self.canvas.move(self.dot, dx, dy)
+        self.follow_player()
 
-        ## Send my player info to server
-        if self.mp_connected == True:
-            try:
-                pysockets.send_msg(self.server, self.player.as_json())
-            except OSError:
-                pass
+        self.input_dx += dx
+        self.input_dy += dy
 
+        if self.mp_connected == True:
             if self.in_game:
                 self.label.config(text=f'You are player {self.player.id + 1}. Use arrow keys to '
                                        f'move.')
 
 
+    def set_position(self, x, y):
+        '''
+        Put the player dot at a position, e.g. the one the server has
+
+        :param x: x position
+        :param y: y position
+        :return: None
+        '''
+        self.player.x, self.player.y = x, y
+        n = constants.DOT_SIZE / 2
+        self.canvas.coords(self.dot, (x - n), (y - n), (x + n), (y + n))
+        self.follow_player()
+
+
+    def follow_player(self):
+        '''
+        Scroll the canvas to keep the player in the middle, without scrolling past the world edges
+
+        :return: None
+        '''
+        left = min(max(self.player.x - constants.CANVAS_SIZE_X / 2, 0),
+                   constants.WORLD_SIZE_X - constants.CANVAS_SIZE_X)
+        top = min(max(self.player.y - constants.CANVAS_SIZE_Y / 2, 0),
+                  constants.WORLD_SIZE_Y - constants.CANVAS_SIZE_Y)
+        self.canvas.xview_moveto(left / constants.WORLD_SIZE_X)
+        self.canvas.yview_moveto(top / constants.WORLD_SIZE_Y)
+
+
     def update_game_loop(self):
         '''
         Update the game window & positions of online players. This function calls itself.
 
+        Every online player keeps its canvas item. Items are only created & deleted when players
+        join or leave, moved players get new coordinates, and nothing is redrawn until a new
+        player list arrives from the server.
+
+        :return: None
+        '''
+        ## Tk isn't thread safe, the online thread leaves widget & player changes to this loop
+        while self.status_updates:
+            widget, text = self.status_updates.popleft()
+            widget.config(text=text)
+        while self.hello_replies:
+            self.apply_hello_reply(self.hello_replies.popleft())
+        if self.own_positions and not self.hello_pending:
+            self.reconcile(*self.own_positions.pop())
+            self.own_positions.clear()
+
+        self.register_udp()
+        self.send_input()
+
+        ## The online thread replaces the player list but never changes it
+        players = self.mp_players
+        if players is not self.drawn_players:
+            self.drawn_players = players
+            self.draw_online_players(players)
+
+        self.canvas.after(50, self.update_game_loop)
+
+
+    def send_input(self):
+        '''
+        Send the movement since the last input command to the server. Called once per frame, so
+        key repeats are sent as one message, split into inputs of at most
+        constants.MAX_INPUT_MOVE per axis. Over UDP the last inputs are repeated for a few
+        frames after the player stopped, in case the datagram holding them was lost.
+
+        While disconnected & until the server answered the hello, the movement is kept for the
+        first inputs after it, see apply_hello_reply().
+
         :return: None
         '''
-        ## Delete old player dots
-        for p_dot in self.mp_player_dots:
-            self.canvas.delete(p_dot)
+        if self.mp_connected == False or self.hello_pending:
+            return
+
+        if self.input_dx or self.input_dy:
+            ## The server caps the movement of one input, longer ones are split
+            t = int(time.monotonic() * 1000) & 0xFFFFFFFF
+            while self.input_dx or self.input_dy:
+                dx = max(-constants.MAX_INPUT_MOVE, min(self.input_dx, constants.MAX_INPUT_MOVE))
+                dy = max(-constants.MAX_INPUT_MOVE, min(self.input_dy, constants.MAX_INPUT_MOVE))
+                self.input_dx -= dx
+                self.input_dy -= dy
+                self.input_seq += 1
+                try:
+                    self.send_to_server({'input': (self.input_seq, dx, dy, t)})
+                except OSError:
+                    pass
+                self.sent_inputs.append((self.input_seq, dx, dy))
+            self.input_repeats = pysockets.INPUT_REDUNDANCY
+
+        elif self.input_repeats:
+            self.input_repeats -= 1
+            with self.send_lock:
+                if self.udp_ready and self.recent_inputs:
+                    try:
+                        self.udp.send(self.udp_channel.pack(self.recent_inputs))
+                    except OSError:
+                        pass
 
-        ## Update player information from server
-        self.mp_player_dots = []
+        self.input_dx = 0
+        self.input_dy = 0
+
+
+    def reconcile(self, x, y, input_seq):
+        '''
+        Correct the own player with its position in a server snapshot. The inputs the server
+        applied before the snapshot are forgotten, the ones still on the way are applied again
+        on top of the server's position. The dot only moves if that differs from the prediction,
+        e.g. because the server pushed the player out of another one or an input got lost.
+
+        :param x: x position in the snapshot
+        :param y: y position in the snapshot
+        :param input_seq: last input applied to that position
+        :return: None
+        '''
+        while self.sent_inputs and self.sent_inputs[0][0] <= input_seq:
+            self.sent_inputs.popleft()
+        for _, dx, dy in self.sent_inputs:
+            x, y = player.clamp_position(x + dx, y + dy)
+
+        new_x, new_y = player.clamp_position(x + self.input_dx, y + self.input_dy)
+        self.input_dx, self.input_dy = new_x - x, new_y - y
+        if new_x != self.player.x or new_y != self.player.y:
+            self.set_position(new_x, new_y)
+
+
+    def draw_online_players(self, players):
+        '''
+        Bring the player dots in line with a player list
+
+        :param players: dict of player ID -> Player
+        :return: None
+        '''
+        ## Delete the dots of players that left
+        for pid in list(self.mp_player_dots):
+            p = players.get(pid)
+            if p is None or not p.in_game:
+                self.canvas.delete(self.mp_player_dots.pop(pid)[0])
+
+        ## Create dots for players that joined & move the others
         n = constants.DOT_SIZE / 2
-        for p in self.mp_players:
-            if p.id == self.player.id:
+        for pid, p in players.items():
+            if pid == self.player.id or not p.in_game:
                 continue
 
-            ## Draw updated player dots
-            if p.in_game == True:
-                self.mp_player_dots.append(
-                    self.canvas.create_oval((p.x - n), (p.y - n), (p.x + n), (p.y + n),
-                        fill=p.color)
-                )
-
-        self.canvas.after(50, self.update_game_loop)
+            dot = self.mp_player_dots.get(pid)
+            if dot is None:
+                item = self.canvas.create_oval((p.x - n), (p.y - n), (p.x + n), (p.y + n),
+                                               fill=p.color)
+                self.mp_player_dots[pid] = (item, p.x, p.y)
+            elif dot[1] != p.x or dot[2] != p.y:
+                self.canvas.coords(dot[0], (p.x - n), (p.y - n), (p.x + n), (p.y + n))
+                self.mp_player_dots[pid] = (dot[0], p.x, p.y)
 
 
     def on_closing(self):
@@ -232,10 +392,14 @@ class GuiGame:
 
         :return: None
         '''
-        ## Remove player from game & update server
+        ## Remove player from game & update server. The connection may be down while the online
+        ## thread waits to reconnect.
         if self.player is not None:
             self.player.in_game = False
-            pysockets.send_msg(self.server, self.player.as_json())
+            try:
+                self.send_to_server({'player': self.player.as_record()})
+            except OSError:
+                pass
 
         ## Close TCP connection
         self.stop_thread = True
@@ -244,31 +408,170 @@ class GuiGame:
         self.root.destroy()
 
 
+    def show_status(self, widget, text):
+        '''
+        Set the text of a label from any thread. Changes made by the online thread are queued for
+        the Tk thread, see update_game_loop().
+
+        :param widget: tkinter widget
+        :param text: string
+        :return: None
+        '''
+        if threading.current_thread() is threading.main_thread():
+            widget.config(text=text)
+        else:
+            self.status_updates.append((widget, text))
+
+
+    def send_to_server(self, msg):
+        '''
+        Send a message to the server with the negotiated codec. Both the Tk and the online thread
+        send, so sends are serialized to keep messages from interleaving on the socket.
+
+        Once the UDP channel works, inputs & acknowledgements go over UDP. Inputs are movements,
+        so every datagram repeats the recent ones in case earlier datagrams were lost. The server
+        skips the ones it already applied.
+
+        :param msg: message dict, see pysockets.JsonCodec
+        :return: None
+        '''
+        with self.send_lock:
+            frame = self.codec.encode(msg)
+            if self.udp_ready and ('input' in msg or 'ack' in msg):
+                if 'input' in msg:
+                    self.recent_inputs.append(frame)
+                    frames = self.recent_inputs
+                else:
+                    frames = [frame]
+
+                try:
+                    self.udp.send(self.udp_channel.pack(frames))
+                except OSError:
+                    pass
+            else:
+                self.server.sendall(frame)
+
+
+    def open_udp(self, token):
+        '''
+        Open the UDP channel offered by the server. It is used once the server answers a
+        registration datagram, see register_udp().
+
+        :param token: token from the server's hello, None if the server doesn't offer UDP
+        :return: None
+        '''
+        self.close_udp()
+        if token is None:
+            return
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.connect(self.server.getpeername())
+        self.udp.setblocking(False)
+        self.udp_channel = pysockets.DatagramChannel(token)
+        self.register_udp()
+
+
+    def register_udp(self):
+        '''
+        Send an empty datagram, registering the client's UDP address with the server. Repeated
+        every frame until the server answers or there were too many attempts, everything stays on
+        TCP until then.
+
+        :return: None
+        '''
+        with self.send_lock:
+            if (self.udp_channel is None or self.udp_ready or
+                    self.udp_attempts > UDP_REGISTER_ATTEMPTS):
+                return
+
+            self.udp_attempts += 1
+            if self.udp_attempts > UDP_REGISTER_ATTEMPTS:
+                print('No answer over UDP, using TCP only')
+                return
+
+            try:
+                self.udp.send(self.udp_channel.pack([]))
+            except OSError:
+                pass
+
+
+    def close_udp(self):
+        '''
+        Close the UDP channel & go back to TCP only
+
+        :return: None
+        '''
+        with self.send_lock:
+            self.udp_ready = False
+            if self.udp is not None:
+                self.udp.close()
+            self.udp = None
+            self.udp_channel = None
+            self.udp_attempts = 0
+            self.recent_inputs.clear()
+
+
+    def recv_datagrams(self):
+        '''
+        Receive every waiting datagram. Stale, duplicate & reordered datagrams are dropped.
+
+        :return: list of (True if binary, message memoryview)
+        '''
+        frames = []
+        channel = self.udp_channel
+        while channel is not None:
+            try:
+                data = self.udp.recv(65535)
+            except OSError:
+                ## Nothing left, or e.g. ICMP port unreachable for an earlier datagram
+                break
+
+            try:
+                token, seq, datagram_frames = pysockets.split_datagram(data)
+            except (ValueError, struct.error):
+                continue
+
+            if token == channel.token and channel.accept(seq):
+                self.udp_ready = True
+                frames += datagram_frames
+
+        return frames
+
+
     def server_connect(self):
         '''
         Connect to multiplayer server
 
         :return: None
         '''
-        ## Create socket
-        self.server = socket.socket()
-
-        ## Connect to server
+        ## Connect to server, over its Unix socket if it runs on this host
         try:
-            if pysockets.is_valid_address(self.server_addr.get()) == True:
-                ip, port = self.server_addr.get().split(':')
+            ## IP:PORT, optionally followed by /ROOM to join a named room
+            address, _, room = self.address.partition('/')
+            if pysockets.is_valid_address(address) == True:
+                ip, port = address.split(':')
                 try:
-                    self.server.connect((ip, int(port)))
+                    self.server = pysockets.connect(ip, int(port))
                 except OSError:
-                    self.entry_label.config(text='Could not connect to server address:')
+                    self.show_status(self.entry_label, 'Could not connect to server address:')
                     return
 
-                print(f'Connected to server: {ip}:{port}')
-                self.entry_label.config(text='Connected to:')
-                self.entry_addr.config(state=tkinter.DISABLED)
+                local = ' (Unix socket)' if self.server.family != socket.AF_INET else ''
+                print(f'Connected to server: {ip}:{port}{local}')
+                self.show_status(self.entry_label, 'Connected to:')
+                if threading.current_thread() is threading.main_thread():
+                    self.entry_addr.config(state=tkinter.DISABLED)
                 self.mp_connected = True
+
+                ## Offer every codec & compression mode, the server picks one. JSON is used
+                ## until it replies. After a reconnect the session token asks for the player back.
+                self.codec = pysockets.JSON_CODEC
+                self.hello_pending = True
+                self.send_to_server({'hello': {'codecs': list(pysockets.CODECS), 'udp': True,
+                                               'compression': list(pysockets.COMPRESSION_MODES),
+                                               'room': room or None, 'session': self.session}})
             else:
-                self.entry_label.config(text='Invalid server address:')
+                self.show_status(self.entry_label, 'Invalid server address:')
 
         except ConnectionRefusedError:
             pass
@@ -276,46 +579,191 @@ class GuiGame:
 
     def online_function(self):
         '''
-        Sync player with online players (Run in its own thread)
+        Sync player with online players (Run in its own thread). Reconnects whenever the
+        connection drops, until the game is closed.
 
         :return: None
         '''
-        ## Receive messages
-        try:
-            while self.stop_thread == False and self.mp_connected == True:
-                try:
-                    msg = json.loads(pysockets.receive_msg(self.server))
+        while self.stop_thread == False:
+            try:
+                self.receive_messages()
+            except ValueError:
+                self.show_status(self.label, 'Disconnected from server (invalid message header)')
+            except ConnectionResetError:
+                self.show_status(self.label, 'Disconnected from server (ConnectionResetError)')
+            except OSError:
+                self.show_status(self.label, 'Disconnected from server (OSError)')
+
+            if self.stop_thread == False:
+                self.reconnect()
+
+
+    def receive_messages(self):
+        '''
+        Receive & apply messages until the connection drops or the game is closed
 
-                    ## Update player list
-                    temp_player_list = []
-                    for p in msg['players']:
-                        temp_player_list.append(player.player_from_dict(p))
+        Only the newest snapshot of every batch of received frames is applied, older ones would
+        be replaced before they are drawn. Binary snapshots aren't even decoded. Skipped
+        snapshots aren't acknowledged, so the server keeps building deltas on applied ones.
 
-                    self.mp_players = temp_player_list
+        :return: None
+        '''
+        decoder = pysockets.FrameDecoder(decompress=True)
+        while self.stop_thread == False and self.mp_connected == True:
+            udp = self.udp
+            readable = select.select([self.server] + ([udp] if udp else []), [], [])[0]
+            frames = []
+            if self.server in readable:
+                frames += decoder.recv_from(self.server)
+            if udp in readable:
+                frames += self.recv_datagrams()
+
+            latest = None
+            for binary, payload in frames:
+                if pysockets.is_binary_snapshot(binary, payload):
+                    latest = (binary, payload)
+                    continue
+
+                try:
+                    msg = pysockets.decode_frame(binary, payload)
+                    if 'hello' in msg:
+                        self.apply_hello(msg['hello'])
+                    elif 'applied' in msg:
+                        self.applied = msg['applied']
+                    else:
+                        latest = msg
+
+                except (ValueError, KeyError, struct.error):
+                    pass
 
-                except json.JSONDecodeError:
+            if latest is not None:
+                try:
+                    if isinstance(latest, tuple):
+                        latest = pysockets.decode_frame(*latest)
+                    self.apply_snapshot(latest)
+
+                except (ValueError, KeyError, struct.error):
                     pass
 
-        except ConnectionResetError:
-            self.label.config(text='Disconnected from server (ConnectionResetError)')
-            self.restart_online_service()
 
-        except OSError:
-            self.label.config(text='Disconnected from server (OSError)')
-            self.restart_online_service()
+    def apply_hello(self, hello):
+        '''
+        Switch to the codec & channels picked by the server. The player is left to the Tk thread,
+        see apply_hello_reply().
 
-        if self.mp_connected == False:
-            self.server_connect()
-            self.online_function()
+        :param hello: hello reply dict
+        :return: None
+        '''
+        if hello.get('error'):
+            print(f'Server refused to join: {hello["error"]}')
+        self.codec = pysockets.CODECS.get(hello.get('codec'), pysockets.JSON_CODEC)
+        self.open_udp(hello.get('udp'))
+        self.session = hello.get('session')
+        self.hello_replies.append(hello)
 
 
-    def restart_online_service(self):
-        self.entry_label.config(text='Disconnected from:')
+    def apply_hello_reply(self, hello):
+        '''
+        Update the player once the server answered the hello (Run in the Tk thread). If the
+        server resumed the session, the player continues from the position the server has & the
+        movement the server didn't get yet is sent as the next input. Otherwise a player that was
+        in the game before the connection dropped joins again where it is, movement included.
+
+        :param hello: hello reply dict
+        :return: None
+        '''
+        self.hello_pending = False
+        self.sent_inputs.clear()
+        self.own_positions.clear()
+        if self.player is None or not self.player.in_game:
+            return
+
+        if hello.get('resumed'):
+            _, x, y, _ = hello['player']
+            self.set_position(*player.clamp_position(x + self.input_dx, y + self.input_dy))
+            self.input_dx, self.input_dy = self.player.x - x, self.player.y - y
+        else:
+            self.input_dx = self.input_dy = 0
+            try:
+                self.send_to_server({'player': self.player.as_record()})
+            except OSError:
+                pass
+        self.label.config(text=f'You are player {self.player.id + 1}. Use arrow keys to move.')
+
+
+    def apply_snapshot(self, msg):
+        '''
+        Update the player list from a server snapshot & acknowledge it. A keyframe holds every
+        player, a delta holds the players added or moved since its base snapshot and the IDs of
+        removed players.
+
+        The Tk thread reads mp_players, so every snapshot gets a new player dict that is swapped
+        in whole & isn't changed afterwards.
+
+        :param msg: dict
+        :return: None
+        '''
+        ## Snapshots may arrive out of order over UDP, or overtake a snapshot sent over TCP
+        if self.mp_snapshots and msg.get('seq', 0) <= next(reversed(self.mp_snapshots)):
+            return
+
+        if 'base' in msg:
+            base_players = self.mp_snapshots.get(msg['base'])
+            if base_players is None:
+                ## Baseline is unknown, acknowledging nothing makes the server send a keyframe
+                self.mp_snapshots.clear()
+                self.send_to_server({'ack': 0})
+                return
+
+            players = dict(base_players)
+            for pid in msg['removed']:
+                players.pop(pid, None)
+        else:
+            players = {}
+
+        for record in msg['players']:
+            players[record[0]] = player.player_from_record(record)
+
+        self.mp_players = players
+
+        ## The own position, with the last input in it, for the Tk thread to correct the player
+        own = players.get(self.player.id) if self.player is not None else None
+        if own is not None and self.applied is not None and self.applied[0] == msg.get('seq'):
+            self.own_positions.append((own.x, own.y, self.applied[1]))
+
+        ## Keep recent snapshots as baselines for upcoming deltas
+        if 'seq' in msg:
+            self.mp_snapshots[msg['seq']] = players
+            while len(self.mp_snapshots) > constants.SNAPSHOT_HISTORY:
+                self.mp_snapshots.popitem(last=False)
+
+            self.send_to_server({'ack': msg['seq']})
+
+
+    def reconnect(self):
+        '''
+        Close the dropped connection & connect again until it works or the game is closed. The
+        attempts are spread out with jittered exponential backoff, see pysockets.reconnect_delay(),
+        so clients dropped by a server restart don't all come back at the same moment.
+
+        :return: None
+        '''
+        self.show_status(self.entry_label, 'Disconnected from:')
         self.server.close()
+        self.close_udp()
         self.mp_connected = False
-        self.mp_players = []
-        self.server_connect()
-        self.online_function()
+        self.mp_players = {}
+        self.mp_snapshots.clear()
+        self.applied = None
+
+        attempt = 0
+        while self.stop_thread == False and self.mp_connected == False:
+            delay = pysockets.reconnect_delay(attempt)
+            self.show_status(self.label, f'Reconnecting in {delay:.1f} s (attempt {attempt + 1})')
+            time.sleep(delay)
+            if self.stop_thread == False:
+                self.server_connect()
+            attempt += 1
 
 
 ## =================================================================================================
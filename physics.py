@@ -0,0 +1,226 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import collections
+import math
+
+import constants
+import player
+
+try:
+    import numpy
+except ImportError:
+    ## Optional, collisions are detected in pure Python without it
+    numpy = None
+
+## =================================================================================================
+## Cells searched around the cell of a dot, besides its own. Half of the neighbours, so every pair
+## of neighbouring cells is searched once.
+NEIGHBOUR_CELLS = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+## =================================================================================================
+def backend():
+    '''
+    :return: 'numpy' if the vectorized collision detection is available, else 'python'
+    '''
+    return 'numpy' if numpy is not None else 'python'
+
+
+## -------------------------------------------------------------------------------------------------
+def resolve_collisions(table, size=constants.DOT_SIZE, vectorized=None):
+    '''
+    Push overlapping player dots apart, each by half of the overlap along the line between their
+    centers. Dots are circles with a diameter of size, two overlap when their centers are closer
+    than size. The pushes of all pairs are added up & applied at once, rounded away from zero so
+    every overlap shrinks, and the dots are kept inside the world. A dot pushed by several others
+    or against the edge of the world may still overlap afterwards & is pushed further next tick.
+
+    The broad phase is a uniform grid with cells of size, so only dots in neighbouring cells are
+    tested & the cost grows with the number of dots, not the number of pairs. Only players in the
+    game collide.
+
+    :param table: playertable.PlayerTable, positions are updated in place
+    :param size: dot diameter
+    :param vectorized: True to use NumPy, False for pure Python, None to use NumPy if available
+    :return: list of the slots of the players that moved
+    '''
+    if len(table) < 2:
+        return []
+
+    if vectorized is None:
+        vectorized = numpy is not None
+    if vectorized:
+        return resolve_vectorized(table, size)
+    return resolve_python(table, size)
+
+
+## -------------------------------------------------------------------------------------------------
+def push_apart(a, b, dx, dy, distance_squared, size):
+    '''
+    Get the push of two overlapping dots
+
+    :param a: slot of the first dot
+    :param b: slot of the second dot
+    :param dx: x of b - x of a
+    :param dy: y of b - y of a
+    :param distance_squared: dx * dx + dy * dy
+    :param size: dot diameter
+    :return: (push x, push y) of b, a is pushed the opposite way
+    '''
+    distance = math.sqrt(distance_squared)
+    if distance == 0:
+        ## Same position, push the dot with the lower slot left
+        return (size / 2, 0.0) if a < b else (-size / 2, 0.0)
+
+    push = (size - distance) / 2 / distance
+    return dx * push, dy * push
+
+
+## -------------------------------------------------------------------------------------------------
+def resolve_python(table, size):
+    '''
+    Pure Python resolve_collisions(), with a dict of cell -> slots as the grid
+
+    :param table: playertable.PlayerTable
+    :param size: dot diameter
+    :return: list of moved slots
+    '''
+    xs, ys, in_game = table.xs, table.ys, table.in_game
+    cells = collections.defaultdict(list)
+    for slot, playing in enumerate(in_game):
+        if playing:
+            cells[(xs[slot] // size, ys[slot] // size)].append(slot)
+
+    limit = size * size
+    pushes = collections.defaultdict(lambda: [0.0, 0.0])
+    for (cx, cy), slots in cells.items():
+        for i, a in enumerate(slots):
+            ax, ay = xs[a], ys[a]
+            candidates = slots[i + 1:]
+            for ncx, ncy in NEIGHBOUR_CELLS:
+                neighbours = cells.get((cx + ncx, cy + ncy))
+                if neighbours:
+                    candidates = candidates + neighbours
+
+            for b in candidates:
+                dx, dy = xs[b] - ax, ys[b] - ay
+                distance_squared = dx * dx + dy * dy
+                if distance_squared >= limit:
+                    continue
+
+                push_x, push_y = push_apart(a, b, dx, dy, distance_squared, size)
+                pushes[a][0] -= push_x
+                pushes[a][1] -= push_y
+                pushes[b][0] += push_x
+                pushes[b][1] += push_y
+
+    moved = []
+    for slot, (push_x, push_y) in pushes.items():
+        x, y = xs[slot], ys[slot]
+        new_x, new_y = player.clamp_position(x + round_away(push_x), y + round_away(push_y))
+        if new_x != x or new_y != y:
+            table.set_position(slot, new_x, new_y)
+            moved.append(slot)
+
+    return sorted(moved)
+
+
+## -------------------------------------------------------------------------------------------------
+def resolve_vectorized(table, size):
+    '''
+    NumPy resolve_collisions(). The dots are sorted by cell, and the dots of a neighbouring cell
+    are found for every dot at once with a binary search of the sorted cells. Only the candidate
+    pairs found that way get the exact circle test.
+
+    :param table: playertable.PlayerTable
+    :param size: dot diameter
+    :return: list of moved slots
+    '''
+    ## Views of the columns, not copies. They must not outlive this call, the columns can't grow
+    ## while they exist.
+    xs = numpy.frombuffer(table.xs, dtype=numpy.uint16)
+    ys = numpy.frombuffer(table.ys, dtype=numpy.uint16)
+    slots = numpy.flatnonzero(numpy.frombuffer(table.in_game, dtype=numpy.uint8))
+    n = len(slots)
+    if n < 2:
+        return []
+
+    ## Cells are numbered column by column. Cell coordinates start at 1 & a column has an empty
+    ## cell above & below, so a neighbour of a dot at the edge never wraps to another column.
+    x = xs[slots].astype(numpy.float64)
+    y = ys[slots].astype(numpy.float64)
+    cx = (xs[slots] // size).astype(numpy.int64) + 1
+    cy = (ys[slots] // size).astype(numpy.int64) + 1
+    column = int(cy.max()) + 2
+    cells = cx * column + cy
+
+    order = numpy.argsort(cells, kind='stable')
+    cells, x, y, slots = cells[order], x[order], y[order], slots[order]
+    index = numpy.arange(n)
+
+    first, second = [], []
+    for ncx, ncy in ((0, 0),) + NEIGHBOUR_CELLS:
+        neighbour = cells + (ncx * column + ncy)
+        start = numpy.searchsorted(cells, neighbour, side='left')
+        end = numpy.searchsorted(cells, neighbour, side='right')
+        if ncx == 0 and ncy == 0:
+            ## Own cell, only the dots after this one so every pair is found once
+            start = numpy.maximum(start, index + 1)
+        counts = numpy.maximum(end - start, 0)
+        total = int(counts.sum())
+        if not total:
+            continue
+
+        ## Expand the ranges: dot i is paired with start[i], ..., end[i] - 1
+        a = numpy.repeat(index, counts)
+        offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        first.append(a)
+        second.append(numpy.repeat(start, counts) + offsets)
+
+    if not first:
+        return []
+    a, b = numpy.concatenate(first), numpy.concatenate(second)
+
+    ## Exact circle test
+    dx = x[b] - x[a]
+    dy = y[b] - y[a]
+    distance_squared = dx * dx + dy * dy
+    overlapping = distance_squared < size * size
+    if not overlapping.any():
+        return []
+    a, b = a[overlapping], b[overlapping]
+    dx, dy, distance_squared = dx[overlapping], dy[overlapping], distance_squared[overlapping]
+
+    ## Same pushes as push_apart()
+    distance = numpy.sqrt(distance_squared)
+    same = distance == 0
+    push = (size - distance) / 2 / numpy.where(same, 1.0, distance)
+    push_x = numpy.where(same, numpy.where(slots[a] < slots[b], size / 2, -size / 2), dx * push)
+    push_y = numpy.where(same, 0.0, dy * push)
+
+    total_x = numpy.bincount(b, push_x, n) - numpy.bincount(a, push_x, n)
+    total_y = numpy.bincount(b, push_y, n) - numpy.bincount(a, push_y, n)
+    total_x = numpy.copysign(numpy.ceil(numpy.abs(total_x)), total_x)
+    total_y = numpy.copysign(numpy.ceil(numpy.abs(total_y)), total_y)
+
+    ## Same bounds as player.clamp_position()
+    half = constants.DOT_SIZE // 2
+    new_x = numpy.clip(x + total_x, half + 1, constants.WORLD_SIZE_X - half - 1)
+    new_y = numpy.clip(y + total_y, half + 1, constants.WORLD_SIZE_Y - half - 1)
+    changed = (new_x != x) | (new_y != y)
+    moved = slots[changed]
+    xs[moved] = new_x[changed]
+    ys[moved] = new_y[changed]
+
+    return sorted(moved.tolist())
+
+
+## -------------------------------------------------------------------------------------------------
+def round_away(value):
+    '''
+    Round away from zero, so a push of a fraction of a pixel still moves a dot
+
+    :param value: float
+    :return: int
+    '''
+    return int(math.copysign(math.ceil(abs(value)), value))
@@ -1,8 +1,10 @@
 ## =================================================================================================
 ## Python 3.6+
 ## =================================================================================================
+import functools
 import json
 import random
+import struct
 
 import constants
 
@@ -12,17 +14,34 @@ COLORS = ['#C62828', '#AD1457', '#6A1B9A', '#4527A0', '#283593', '#1565C0', '#02
           '#00838F', '#00695C', '#2E7D32', '#558B2F', '#9E9D24', '#F9A825', '#FF8F00',
           '#EF6C00', '#D84315', '#4E342E', '#616161', '#546E7A', '#000000']
 
+## Binary player record: ID, x, y, in_game (13 bytes)
+RECORD = struct.Struct('<qHHB')
+
 ## =================================================================================================
+@functools.lru_cache(maxsize=4096)
 def get_color(n):
     '''
     Picks a color from the pre-defined color array. This function will always return the same
-    color for a particular n.
+    color for a particular n. Uses its own generator, so the global one isn't reseeded.
 
     :param n: int
     :return: color code
     '''
-    random.seed(n)
-    return COLORS[random.randint(0, len(COLORS) - 1)]
+    return COLORS[random.Random(n).randint(0, len(COLORS) - 1)]
+
+
+## -------------------------------------------------------------------------------------------------
+def clamp_position(x, y):
+    '''
+    Keep a position inside the world, players can't leave it
+
+    :param x: x position
+    :param y: y position
+    :return: (x, y)
+    '''
+    n = constants.DOT_SIZE // 2
+    return (min(max(x, n + 1), constants.WORLD_SIZE_X - n - 1),
+            min(max(y, n + 1), constants.WORLD_SIZE_Y - n - 1))
 
 
 ## -------------------------------------------------------------------------------------------------
@@ -48,8 +67,21 @@ def player_from_dict(player_dict):
         in_game=player_dict['in_game'])
 
 
+## -------------------------------------------------------------------------------------------------
+def player_from_record(record):
+    '''
+    Create player object from a player record
+
+    :param record: (id, x, y, in_game)
+    :return: Player
+    '''
+    return Player(id=record[0], x=record[1], y=record[2], in_game=bool(record[3]))
+
+
 ## -------------------------------------------------------------------------------------------------
 class Player:
+    __slots__ = ('id', 'x', 'y', 'color', 'in_game')
+
     def __init__(self, id=0, x=None, y=None, in_game=False):
         '''
         Hold player information
@@ -60,12 +92,12 @@ class Player:
         '''
         if x is None:
             self.x = random.randint(constants.DOT_SIZE,
-                constants.CANVAS_SIZE_X - constants.DOT_SIZE)
+                constants.WORLD_SIZE_X - constants.DOT_SIZE)
         else:
             self.x = x
         if y is None:
             self.y = random.randint(constants.DOT_SIZE,
-                constants.CANVAS_SIZE_Y - constants.DOT_SIZE)
+                constants.WORLD_SIZE_Y - constants.DOT_SIZE)
         else:
             self.y = y
 
@@ -74,6 +106,18 @@ class Player:
         self.in_game = in_game
 
 
+    def move(self, dx, dy):
+        '''
+        Move the player, staying inside the world. The client & server both move players with
+        this, so they agree on where a player ends up.
+
+        :param dx: delta x movement
+        :param dy: delta y movement
+        :return: None
+        '''
+        self.x, self.y = clamp_position(self.x + dx, self.y + dy)
+
+
     def __repr__(self):
         return (f'Player: ID={self.id}, x={self.x}, y={self.y}, color={self.color}, in_game='
                 f'{self.in_game}')
@@ -94,6 +138,15 @@ class Player:
         }
 
 
+    def as_record(self):
+        '''
+        Return class as a player record tuple, the layout of RECORD
+
+        :return: (id, x, y, in_game)
+        '''
+        return (self.id, self.x, self.y, self.in_game)
+
+
     def as_json(self):
         '''
         Dump the dictionary into json string
@@ -0,0 +1,121 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import array
+
+## =================================================================================================
+class PlayerTable:
+    def __init__(self):
+        '''
+        Server side player store with one typed array per field (struct of arrays). A player
+        takes 13 bytes in the columns instead of a Player object with its __dict__, updates are
+        written in place and the slots of players that left are reused.
+
+        Rows are addressed by slot, the connection of a player keeps its slot. Rows of free slots
+        have in_game = 0.
+        '''
+        self.ids = array.array('q')
+        self.xs = array.array('H')
+        self.ys = array.array('H')
+        self.in_game = array.array('B')
+        self.free_slots = []
+
+
+    def __len__(self):
+        return len(self.ids) - len(self.free_slots)
+
+
+    def add(self, record):
+        '''
+        Store a player in a free slot, growing the columns if there is none
+
+        :param record: (id, x, y, in_game)
+        :return: slot number
+        '''
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.set(slot, record)
+            return slot
+
+        self.ids.append(record[0])
+        self.xs.append(record[1])
+        self.ys.append(record[2])
+        self.in_game.append(record[3])
+        return len(self.ids) - 1
+
+
+    def remove(self, slot):
+        '''
+        Free a slot
+
+        :param slot: slot number
+        :return: None
+        '''
+        self.in_game[slot] = 0
+        self.free_slots.append(slot)
+
+
+    def clear(self):
+        '''
+        Remove every player
+
+        :return: None
+        '''
+        self.__init__()
+
+
+    def set(self, slot, record):
+        '''
+        Overwrite the player in a slot
+
+        :param slot: slot number
+        :param record: (id, x, y, in_game)
+        :return: None
+        '''
+        self.ids[slot] = record[0]
+        self.xs[slot] = record[1]
+        self.ys[slot] = record[2]
+        self.in_game[slot] = record[3]
+
+
+    def set_position(self, slot, x, y):
+        '''
+        Move the player in a slot
+
+        :param slot: slot number
+        :param x: x position
+        :param y: y position
+        :return: None
+        '''
+        self.xs[slot] = x
+        self.ys[slot] = y
+
+
+    def position(self, slot):
+        '''
+        Get the position of the player in a slot
+
+        :param slot: slot number
+        :return: (x, y)
+        '''
+        return self.xs[slot], self.ys[slot]
+
+
+    def record(self, slot):
+        '''
+        Get the player in a slot
+
+        :param slot: slot number
+        :return: (id, x, y, in_game)
+        '''
+        return (self.ids[slot], self.xs[slot], self.ys[slot], self.in_game[slot])
+
+
+    def snapshot(self):
+        '''
+        Get every player, read column by column
+
+        :return: dict of player ID -> player record
+        '''
+        return {record[0]: record
+                for record in zip(self.ids, self.xs, self.ys, self.in_game) if record[3]}
@@ -1,12 +1,78 @@
 ## =================================================================================================
 ## Python 3.6+
 ## =================================================================================================
+import json
+import os
+import random
 import socket
+import stat
+import struct
+import tempfile
+import zlib
+
+import player
 
 ## =================================================================================================
 PORT        = 10002
 STARTBYTE   = '\n'
 ENCODING    = 'utf-8'
+HEADER_SIZE = 9                 # STARTBYTE + 8 digit message length
+RECV_BUFFER_SIZE = 65536        # Default FrameDecoder buffer size
+MAX_FRAME_SIZE  = 1 << 24       # Largest frame accepted, checked before allocating a buffer for it
+
+## Binary frames: BINARY_STARTBYTE + 4 byte message length + message. The message starts with the
+## codec version and message type.
+BINARY_STARTBYTE    = b'\x00'
+BINARY_HEADER       = struct.Struct('<cI')
+BINARY_VERSION      = 1
+
+TEXT_STARTBYTE_VALUE    = ord(STARTBYTE)
+BINARY_STARTBYTE_VALUE  = BINARY_STARTBYTE[0]
+BINARY_MSG_HEADER   = struct.Struct('<BB')
+
+## Binary message types
+MSG_PLAYER          = 1
+MSG_SNAPSHOT        = 2
+MSG_ACK             = 3
+MSG_INPUT           = 4
+MSG_APPLIED         = 5
+
+SNAPSHOT_HEADER     = struct.Struct('<III')     # seq, base (0 for keyframes), number of players
+COUNT               = struct.Struct('<I')
+SEQ                 = struct.Struct('<I')
+INPUT               = struct.Struct('<IhhI')    # seq, dx, dy, client time in ms (wraps)
+APPLIED             = struct.Struct('<III')     # snapshot seq, last input seq applied, its time
+
+## UDP datagrams: DATAGRAM_HEADER + any number of frames. The token ties datagrams to a TCP
+## connection, the sequence number lets the receiver drop stale & reordered datagrams.
+DATAGRAM_HEADER     = struct.Struct('<QI')      # token, seq
+MAX_DATAGRAM_SIZE   = 1200                      # Larger frames are sent over TCP
+INPUT_REDUNDANCY    = 8                         # Recent inputs repeated in every datagram
+
+## Reconnecting: the delay before every attempt is picked at random up to a limit that doubles with
+## every failed attempt, so clients dropped at once don't come back at once
+RECONNECT_BASE_DELAY    = 0.5   # Seconds, limit of the first attempt
+RECONNECT_MAX_DELAY     = 30.0  # Seconds, largest limit
+
+## Compressed frames: COMPRESSED_STARTBYTE + 4 byte length + compression mode + deflate data of a
+## complete text or binary frame
+COMPRESSED_STARTBYTE        = b'\x01'
+COMPRESSED_STARTBYTE_VALUE  = COMPRESSED_STARTBYTE[0]
+COMPRESSED_HEADER   = struct.Struct('<cIB')
+COMPRESS_THRESHOLD  = 256                       # Smaller frames are sent uncompressed
+COMPRESSION_LEVEL   = 1                         # zlib level, snapshots compress well even at 1
+
+## Compression modes, in order of preference
+COMPRESSION_MODES   = {
+    'zlib-stream':  1,  # One deflate stream per connection, frames reference earlier frames
+    'zlib-dict':    2,  # Frames compressed alone with ZLIB_DICTIONARY, can be shared by clients
+}
+SYNC_FLUSH_TAIL     = b'\x00\x00\xff\xff'        # Ends every Z_SYNC_FLUSH, not sent
+
+## Preset dictionary with the strings of JSON snapshots, the most common ones last
+ZLIB_DICTIONARY     = (b'"removed": [], "base": {"seq": , "players": [' +
+                       b'{"x": 0, "y": 0, "id": 0, "in_game": false}, ' +
+                       b'{"x": 1000, "y": 1000, "id": 1000000000, "in_game": true}, ' * 4)
 
 ## =================================================================================================
 def send_msg(socket, message):
@@ -17,24 +83,818 @@ def send_msg(socket, message):
     :param message: string
     :return: None
     '''
-    ## Message is: STARTBYTE + 8 digit message length + message
-    msg = f'{STARTBYTE}{len(message):08d}{message}'
-    socket.sendall(msg.encode(ENCODING))
+    socket.sendall(frame_text(message))
 
 
 ## -------------------------------------------------------------------------------------------------
-def receive_msg(socket):
+def receive_msg(socket, max_size=MAX_FRAME_SIZE):
     '''
     Receives message over TCP
 
     :param socket: Either connection or socket obj
+    :param max_size: largest message accepted
     :return: string
     '''
-    startbyte = socket.recv(1).decode(ENCODING)
+    startbyte = recv_exact(socket, 1).decode(ENCODING)
     while startbyte != STARTBYTE:
-        startbyte = socket.recv(1).decode(ENCODING)
+        startbyte = recv_exact(socket, 1).decode(ENCODING)
+
+    length = parse_text_length(recv_exact(socket, HEADER_SIZE - 1))
+    if length > max_size:
+        raise ValueError(f'Message of {length} bytes too large')
+    return recv_exact(socket, length).decode(ENCODING)
+
+
+## -------------------------------------------------------------------------------------------------
+def parse_text_length(digits):
+    '''
+    Parse the length of a text frame. int() alone would accept signs, spaces & underscores.
+
+    :param digits: the 8 length bytes of the header
+    :return: length
+    '''
+    if not digits.isdigit():
+        raise ValueError('Invalid message length')
+
+    return int(digits)
+
+
+## -------------------------------------------------------------------------------------------------
+def frame_text(message):
+    '''
+    Frame a text message
+
+    :param message: string
+    :return: bytes
+    '''
+    ## Message is: STARTBYTE + 8 digit message length + message
+    payload = message.encode(ENCODING)
+    return f'{STARTBYTE}{len(payload):08d}'.encode(ENCODING) + payload
+
+
+## -------------------------------------------------------------------------------------------------
+def frame_binary(payload):
+    '''
+    Frame a binary message
+
+    :param payload: bytes
+    :return: bytes
+    '''
+    return BINARY_HEADER.pack(BINARY_STARTBYTE, len(payload)) + payload
+
+
+## -------------------------------------------------------------------------------------------------
+def recv_exact(socket, n):
+    '''
+    Receive exactly n bytes
+
+    :param socket: Either connection or socket obj
+    :param n: number of bytes
+    :return: bytes
+    '''
+    data = bytearray()
+    while len(data) < n:
+        chunk = socket.recv(n - len(data))
+        if not chunk:
+            raise ConnectionResetError('Connection closed by peer')
+        data += chunk
+
+    return bytes(data)
+
+
+## -------------------------------------------------------------------------------------------------
+class FrameDecoder:
+    def __init__(self, size=RECV_BUFFER_SIZE, decompress=False, max_frame_size=MAX_FRAME_SIZE):
+        '''
+        Incremental decoder for a stream of text & binary frames. Data is received straight into a
+        preallocated buffer and every complete frame is returned per recv() call, so frames split
+        over several TCP segments and several frames in one segment are both handled.
+
+        Frames are returned as memoryview slices of the buffer without copying. They are only
+        valid until the next call to recv_from().
+
+        Compressed frames are decompressed in order & returned as the frame they hold, so a
+        compressed stream stays intact even if the caller skips frames.
+
+        :param size: initial buffer size, grown when a frame doesn't fit
+        :param decompress: accept compressed frames, only clients should as they can expand a lot
+        :param max_frame_size: largest frame accepted, including the header. Larger frames raise
+                               ValueError before any memory is allocated for them. Also limits the
+                               size of decompressed frames.
+        '''
+        self.size = size
+        self.max_frame_size = max_frame_size
+        self.decompress = decompress
+        self.decompressors = {}         # Compression mode -> zlib.Decompress of the stream
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0                  # Start of the data not decoded yet
+        self.end = 0                    # End of the received data
+        self.pending = 0                # Size of the partially received frame
+        self.bytes_received = 0
+
+
+    def recv_from(self, socket):
+        '''
+        Receive the available data from a socket
+
+        :param socket: Either connection or socket obj
+        :return: list of (True if binary, message memoryview)
+        '''
+        n = socket.recv_into(self.recv_buffer())
+        if n == 0:
+            raise ConnectionResetError('Connection closed by peer')
+
+        return self.received(n)
+
+
+    def recv_buffer(self):
+        '''
+        Get the free part of the buffer to receive into, for callers doing the receive themselves
+        (e.g. asyncio.BufferedProtocol.get_buffer). Invalidates the frames returned before.
+
+        :return: memoryview
+        '''
+        self.compact()
+        return self.view[self.end:]
+
+
+    def received(self, n):
+        '''
+        Decode the frames completed by n bytes received into recv_buffer()
+
+        :param n: number of bytes received
+        :return: list of (True if binary, message memoryview)
+        '''
+        self.end += n
+        self.bytes_received += n
+        return self.frames()
+
+
+    def frames(self):
+        '''
+        Decode every complete frame in the buffer
+
+        :return: list of (True if binary, message memoryview)
+        '''
+        frames = []
+        while self.start < self.end:
+            startbyte = self.buffer[self.start]
+            if startbyte == TEXT_STARTBYTE_VALUE:
+                if self.end - self.start < HEADER_SIZE:
+                    break
+                header_size = HEADER_SIZE
+                length = parse_text_length(self.buffer[self.start + 1:self.start + HEADER_SIZE])
+            elif (startbyte == BINARY_STARTBYTE_VALUE or
+                    startbyte == COMPRESSED_STARTBYTE_VALUE and self.decompress):
+                if self.end - self.start < BINARY_HEADER.size:
+                    break
+                header_size = BINARY_HEADER.size
+                length = COUNT.unpack_from(self.buffer, self.start + 1)[0]
+            else:
+                self.resync()
+                continue
+
+            if header_size + length > self.max_frame_size:
+                raise ValueError(f'Frame of {header_size + length} bytes too large')
+
+            frame_end = self.start + header_size + length
+            if frame_end > self.end:
+                self.pending = header_size + length
+                self.reserve(self.pending)
+                break
+            self.pending = 0
+
+            if startbyte == COMPRESSED_STARTBYTE_VALUE:
+                frames.append(self.decompress_frame(self.view[self.start + header_size:frame_end]))
+            else:
+                frames.append((startbyte == BINARY_STARTBYTE_VALUE,
+                               self.view[self.start + header_size:frame_end]))
+            self.start = frame_end
+
+        return frames
+
+
+    def decompress_frame(self, payload):
+        '''
+        Decompress the payload of a compressed frame
 
-    return socket.recv(int(socket.recv(8).decode(ENCODING))).decode(ENCODING)
+        :param payload: compression mode + deflate data
+        :return: (True if binary, message memoryview)
+        '''
+        if not payload:
+            raise ValueError('Empty compressed frame')
+
+        mode = payload[0]
+        if mode == COMPRESSION_MODES['zlib-stream']:
+            decompressor = self.decompressors.get(mode)
+            if decompressor is None:
+                decompressor = self.decompressors[mode] = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = payload[1:].tobytes() + SYNC_FLUSH_TAIL
+        elif mode == COMPRESSION_MODES['zlib-dict']:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=ZLIB_DICTIONARY)
+            data = payload[1:]
+        else:
+            raise ValueError(f'Unknown compression mode {mode}')
+
+        try:
+            frame = decompressor.decompress(data, self.max_frame_size)
+        except zlib.error as e:
+            raise ValueError(f'Invalid compressed frame: {e}')
+        if decompressor.unconsumed_tail:
+            raise ValueError('Compressed frame too large')
+
+        return split_frame(frame)
+
+
+    def resync(self):
+        '''
+        Skip data up to the next start byte
+
+        :return: None
+        '''
+        starts = [i for i in (self.buffer.find(STARTBYTE.encode(ENCODING), self.start, self.end),
+                              self.buffer.find(BINARY_STARTBYTE, self.start, self.end)) if i >= 0]
+        self.start = min(starts) if starts else self.end
+
+
+    def compact(self):
+        '''
+        Move the data not decoded yet to the start of the buffer. Only a partial frame is left over
+        after frames(), so this copies at most one frame.
+
+        :return: None
+        '''
+        remaining = self.end - self.start
+        if len(self.buffer) > self.size and self.pending <= self.size:
+            ## Drop the buffer grown for a large frame
+            self.reserve(self.size, shrink=True)
+        elif remaining and self.start:
+            self.view[:remaining] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = remaining
+
+
+    def reserve(self, size, shrink=False):
+        '''
+        Make sure a frame of size bytes fits in the buffer
+
+        :param size: frame size including header
+        :param shrink: allow a smaller buffer than the current one
+        :return: None
+        '''
+        if size <= len(self.buffer) and not shrink:
+            return
+
+        ## Frames handed out earlier keep the old buffer alive, so allocate a new one
+        buffer = bytearray(max(size, self.size) if shrink else max(size, 2 * len(self.buffer)))
+        remaining = self.end - self.start
+        buffer[:remaining] = self.view[self.start:self.end]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.start = 0
+        self.end = remaining
+
+
+## -------------------------------------------------------------------------------------------------
+def decode_frame(binary, payload):
+    '''
+    Decode a received message. Binary and text frames can be mixed on one connection, the frame
+    type picks the codec.
+
+    :param binary: True for binary frames
+    :param payload: message bytes or memoryview
+    :return: message dict
+    '''
+    if binary:
+        return BINARY_CODEC.decode(payload)
+    else:
+        return JSON_CODEC.decode(payload)
+
+
+## -------------------------------------------------------------------------------------------------
+def is_binary_snapshot(binary, payload):
+    '''
+    Check if a received frame is a binary snapshot, without decoding it
+
+    :param binary: True for binary frames
+    :param payload: message bytes or memoryview
+    :return: True/False
+    '''
+    return (binary and len(payload) >= BINARY_MSG_HEADER.size
+            and BINARY_MSG_HEADER.unpack_from(payload) == (BINARY_VERSION, MSG_SNAPSHOT))
+
+
+## -------------------------------------------------------------------------------------------------
+def split_frame(frame):
+    '''
+    Split one complete text or binary frame into its type & payload
+
+    :param frame: framed message bytes
+    :return: (True if binary, message memoryview)
+    '''
+    if frame[:1] == STARTBYTE.encode(ENCODING):
+        header_size = HEADER_SIZE
+        length = parse_text_length(frame[1:HEADER_SIZE])
+    elif frame[:1] == BINARY_STARTBYTE and len(frame) >= BINARY_HEADER.size:
+        header_size = BINARY_HEADER.size
+        length = COUNT.unpack_from(frame, 1)[0]
+    else:
+        raise ValueError('Invalid frame start byte')
+
+    if header_size + length != len(frame):
+        raise ValueError('Invalid frame length')
+    return frame[:1] == BINARY_STARTBYTE, memoryview(frame)[header_size:]
+
+
+## -------------------------------------------------------------------------------------------------
+class Compressor:
+    def __init__(self, mode, threshold=COMPRESS_THRESHOLD, level=COMPRESSION_LEVEL):
+        '''
+        Compress the frames sent on one connection. Frames smaller than the threshold are sent
+        as they are.
+
+        zlib-stream keeps one deflate stream per connection, so snapshots are compressed against
+        the snapshots sent before them. Every compressed frame must then be delivered in order.
+        zlib-dict compresses every frame alone against a preset dictionary, so the result only
+        depends on the frame & can be shared by every connection sent the same frame (shared is
+        True).
+
+        :param mode: name in COMPRESSION_MODES
+        :param threshold: smallest frame size compressed
+        :param level: zlib compression level
+        '''
+        self.mode = mode
+        self.mode_value = COMPRESSION_MODES[mode]
+        self.threshold = threshold
+        self.shared = mode == 'zlib-dict'
+
+        if self.shared:
+            self.template = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                             zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY,
+                                             ZLIB_DICTIONARY)
+        else:
+            self.stream = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+
+    def compress(self, frame):
+        '''
+        Compress a frame
+
+        :param frame: framed message bytes
+        :return: compressed frame, or the frame itself
+        '''
+        if len(frame) < self.threshold:
+            return frame
+
+        if self.shared:
+            compressor = self.template.copy()
+            data = compressor.compress(frame) + compressor.flush()
+            if len(data) + COMPRESSED_HEADER.size >= len(frame):
+                return frame
+        else:
+            ## The stream already holds the frame, it must be sent compressed even if it grew
+            data = self.stream.compress(frame) + self.stream.flush(zlib.Z_SYNC_FLUSH)
+            data = data[:-len(SYNC_FLUSH_TAIL)]
+
+        return COMPRESSED_HEADER.pack(COMPRESSED_STARTBYTE, len(data) + 1, self.mode_value) + data
+
+
+## -------------------------------------------------------------------------------------------------
+def negotiate_compression(offered):
+    '''
+    Pick the compression mode for a connection from the modes offered by the client, in order
+    of the client's preference
+
+    :param offered: list of mode names
+    :return: mode name, None for no compression
+    '''
+    if not isinstance(offered, list):
+        return None
+
+    for name in offered:
+        if isinstance(name, str) and name in COMPRESSION_MODES:
+            return name
+
+    return None
+
+
+## -------------------------------------------------------------------------------------------------
+def split_datagram(data):
+    '''
+    Split a received datagram into its header & frames
+
+    :param data: datagram bytes
+    :return: (token, seq, list of (True if binary, message memoryview))
+    '''
+    if len(data) < DATAGRAM_HEADER.size:
+        raise ValueError('Datagram too short')
+    token, seq = DATAGRAM_HEADER.unpack_from(data)
+
+    frames = []
+    view = memoryview(data)
+    start = DATAGRAM_HEADER.size
+    while start < len(data):
+        if data[start] == TEXT_STARTBYTE_VALUE:
+            header_size = HEADER_SIZE
+            length = parse_text_length(data[start + 1:start + HEADER_SIZE])
+        elif data[start] == BINARY_STARTBYTE_VALUE:
+            header_size = BINARY_HEADER.size
+            length = COUNT.unpack_from(data, start + 1)[0]
+        else:
+            raise ValueError('Invalid frame start byte')
+
+        frame_end = start + header_size + length
+        if frame_end > len(data):
+            raise ValueError('Truncated frame')
+        frames.append((data[start] == BINARY_STARTBYTE_VALUE, view[start + header_size:frame_end]))
+        start = frame_end
+
+    return token, seq, frames
+
+
+## -------------------------------------------------------------------------------------------------
+class DatagramChannel:
+    def __init__(self, token):
+        '''
+        Sequence numbers of the UDP traffic of one connection. Datagrams may be lost, duplicated
+        or reordered. Only datagrams newer than the last one received are accepted, everything
+        they carry is made stale by newer datagrams.
+
+        :param token: identifies the connection, handed to the client over TCP
+        '''
+        self.token = token
+        self.send_seq = 0
+        self.recv_seq = 0
+        self.stale = 0                  # Datagrams dropped as duplicate or out of order
+
+
+    def pack(self, frames):
+        '''
+        Build the next datagram
+
+        :param frames: list of encoded frames, may be empty
+        :return: bytes
+        '''
+        self.send_seq += 1
+        return DATAGRAM_HEADER.pack(self.token, self.send_seq) + b''.join(frames)
+
+
+    def accept(self, seq):
+        '''
+        Check if a received datagram is newer than every datagram received before
+
+        :param seq: datagram sequence number
+        :return: True/False
+        '''
+        if seq <= self.recv_seq:
+            self.stale += 1
+            return False
+
+        self.recv_seq = seq
+        return True
+
+
+## -------------------------------------------------------------------------------------------------
+def negotiate_codec(offered):
+    '''
+    Pick the codec for a connection from the codec names offered by the client, in order of the
+    client's preference. JSON is the fallback, every peer supports it.
+
+    :param offered: list of codec names
+    :return: codec
+    '''
+    if not isinstance(offered, list):
+        return JSON_CODEC
+
+    for name in offered:
+        if isinstance(name, str) and name in CODECS:
+            return CODECS[name]
+
+    return JSON_CODEC
+
+
+## -------------------------------------------------------------------------------------------------
+class JsonCodec:
+    '''
+    Text codec. Player records are sent as player dictionaries, so the messages stay compatible
+    with clients & servers that don't negotiate a codec. Slow, but readable when debugging.
+
+    Messages are dictionaries:
+        {'player': record}                              player update
+        {'seq': n, 'players': [record, ...]}            keyframe snapshot
+        {'seq': n, 'base': b, 'players': [record, ...], 'removed': [id, ...]}    delta snapshot
+        {'ack': n}                                      snapshot acknowledgement
+        {'input': (seq, dx, dy, t)}                     movement since the previous input
+        {'applied': (n, seq, t)}                        last input in the player's position of
+                                                        snapshot n, sent before the snapshot
+        {'hello': {...}}                                codec negotiation
+
+    where a record is a tuple (id, x, y, in_game), see player.Player.as_record()
+    '''
+    name = 'json'
+
+    def encode(self, msg):
+        '''
+        Encode & frame a message
+
+        :param msg: message dict
+        :return: bytes
+        '''
+        return frame_text(self.dumps(msg))
+
+
+    def dumps(self, msg):
+        '''
+        Encode a message as JSON string
+
+        :param msg: message dict
+        :return: string
+        '''
+        if 'player' in msg:
+            return json.dumps(record_as_dict(msg['player']))
+
+        if 'players' in msg:
+            msg = dict(msg, players=[record_as_dict(r) for r in msg['players']])
+
+        return json.dumps(msg)
+
+
+    def decode(self, payload):
+        '''
+        Decode a JSON message
+
+        :param payload: message bytes
+        :return: message dict
+        '''
+        msg = json.loads(str(payload, ENCODING))
+        if not isinstance(msg, dict):
+            raise ValueError(f'Not a message: {type(msg).__name__}')
+
+        if 'id' in msg:
+            return {'player': record_from_dict(msg)}
+
+        if 'players' in msg:
+            msg['players'] = [record_from_dict(p) for p in msg['players']]
+
+        if 'input' in msg:
+            msg['input'] = input_from_list(msg['input'])
+
+        if 'applied' in msg:
+            msg['applied'] = input_from_list(msg['applied'], APPLIED)
+
+        return msg
+
+
+## -------------------------------------------------------------------------------------------------
+class BinaryCodec:
+    '''
+    Compact codec. Player records are packed with player.RECORD, snapshots are a header followed
+    by the records and the removed player IDs. Handshake messages are always sent as JSON.
+    '''
+    name = f'binary/{BINARY_VERSION}'
+
+    def encode(self, msg):
+        '''
+        Encode & frame a message
+
+        :param msg: message dict
+        :return: bytes
+        '''
+        if 'player' in msg:
+            payload = (BINARY_MSG_HEADER.pack(BINARY_VERSION, MSG_PLAYER) +
+                       player.RECORD.pack(*msg['player']))
+
+        elif 'players' in msg:
+            removed = msg.get('removed', ())
+            payload = b''.join((
+                BINARY_MSG_HEADER.pack(BINARY_VERSION, MSG_SNAPSHOT),
+                SNAPSHOT_HEADER.pack(msg['seq'], msg.get('base', 0), len(msg['players'])),
+                b''.join([player.RECORD.pack(*r) for r in msg['players']]),
+                COUNT.pack(len(removed)),
+                struct.pack(f'<{len(removed)}q', *removed),
+            ))
+
+        elif 'ack' in msg:
+            payload = BINARY_MSG_HEADER.pack(BINARY_VERSION, MSG_ACK) + SEQ.pack(msg['ack'])
+
+        elif 'input' in msg:
+            payload = BINARY_MSG_HEADER.pack(BINARY_VERSION, MSG_INPUT) + INPUT.pack(*msg['input'])
+
+        elif 'applied' in msg:
+            payload = (BINARY_MSG_HEADER.pack(BINARY_VERSION, MSG_APPLIED) +
+                       APPLIED.pack(*msg['applied']))
+
+        else:
+            return JSON_CODEC.encode(msg)
+
+        return frame_binary(payload)
+
+
+    def decode(self, payload):
+        '''
+        Decode a binary message
+
+        :param payload: message bytes
+        :return: message dict
+        '''
+        version, msg_type = BINARY_MSG_HEADER.unpack_from(payload)
+        if version != BINARY_VERSION:
+            raise ValueError(f'Unsupported binary codec version {version}')
+        offset = BINARY_MSG_HEADER.size
+
+        if msg_type == MSG_PLAYER:
+            return {'player': player.RECORD.unpack_from(payload, offset)}
+
+        if msg_type == MSG_SNAPSHOT:
+            seq, base, n = SNAPSHOT_HEADER.unpack_from(payload, offset)
+            offset += SNAPSHOT_HEADER.size
+            end = offset + n * player.RECORD.size
+            msg = {'seq': seq, 'players': list(player.RECORD.iter_unpack(payload[offset:end]))}
+
+            n_removed = COUNT.unpack_from(payload, end)[0]
+            if base:
+                msg['base'] = base
+                msg['removed'] = list(struct.unpack_from(f'<{n_removed}q', payload,
+                                                         end + COUNT.size))
+            return msg
+
+        if msg_type == MSG_ACK:
+            return {'ack': SEQ.unpack_from(payload, offset)[0]}
+
+        if msg_type == MSG_INPUT:
+            return {'input': INPUT.unpack_from(payload, offset)}
+
+        if msg_type == MSG_APPLIED:
+            return {'applied': APPLIED.unpack_from(payload, offset)}
+
+        raise ValueError(f'Unknown binary message type {msg_type}')
+
+
+## -------------------------------------------------------------------------------------------------
+def record_as_dict(record):
+    '''
+    Player record as the dictionary used by the JSON codec, see player.Player.as_dict()
+
+    :param record: (id, x, y, in_game)
+    :return: dict
+    '''
+    return {'x': record[1], 'y': record[2], 'id': record[0], 'in_game': bool(record[3])}
+
+
+## -------------------------------------------------------------------------------------------------
+def record_from_dict(player_dict):
+    '''
+    Player record from the dictionary used by the JSON codec
+
+    :param player_dict: dict
+    :return: (id, x, y, in_game)
+    '''
+    record = (int(player_dict['id']), int(player_dict['x']), int(player_dict['y']),
+              bool(player_dict['in_game']))
+
+    ## Reject records that don't fit the binary layout, they could not be sent to binary clients
+    player.RECORD.pack(*record)
+    return record
+
+
+## -------------------------------------------------------------------------------------------------
+def input_from_list(values, layout=INPUT):
+    '''
+    Input command, or another tuple of integers, from the list used by the JSON codec
+
+    :param values: [seq, dx, dy, t]
+    :param layout: binary layout of the tuple, e.g. APPLIED
+    :return: (seq, dx, dy, t)
+    '''
+    command = tuple(int(v) for v in values)
+
+    ## Same limits as the binary layout
+    layout.pack(*command)
+    return command
+
+
+## -------------------------------------------------------------------------------------------------
+def reconnect_delay(attempt, base=RECONNECT_BASE_DELAY, limit=RECONNECT_MAX_DELAY):
+    '''
+    Get the delay before a reconnect attempt: exponential backoff with full jitter
+
+    :param attempt: number of failed attempts since the connection was lost
+    :param base: limit of the first attempt in seconds
+    :param limit: largest limit in seconds
+    :return: seconds
+    '''
+    return random.uniform(0, min(limit, base * 2 ** min(attempt, 32)))
+
+
+## -------------------------------------------------------------------------------------------------
+def unix_sockets_supported():
+    '''
+    Check if the OS has Unix sockets & user IDs, which tell whose a socket is
+
+    :return: True/False
+    '''
+    return hasattr(socket, 'AF_UNIX') and hasattr(os, 'getuid')
+
+
+## -------------------------------------------------------------------------------------------------
+def unix_socket_path(port, create=False):
+    '''
+    Get the path of the Unix socket a server listens on besides its TCP port. It's in the per-user
+    runtime directory if there is one, otherwise in a directory of the temp directory that only
+    the user can access, so other users can't put a socket in its place. A directory that isn't
+    the user's or that others can access is not used.
+
+    :param port: TCP port of the server
+    :param create: create the directory in the temp directory if it doesn't exist
+    :return: path, None if there is no private directory
+    '''
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not directory:
+        directory = os.path.join(tempfile.gettempdir(), f'soe-game-{os.getuid()}')
+        if create:
+            try:
+                os.mkdir(directory, 0o700)
+            except FileExistsError:
+                pass
+            except OSError:
+                return None
+
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None
+
+    return os.path.join(directory, f'soe-game-{port}.sock')
+
+
+## -------------------------------------------------------------------------------------------------
+def is_local_address(ip):
+    '''
+    Check if an IP address belongs to this host: a loopback address or the address get_ip()
+    finds. Host names aren't looked up, that could block on DNS.
+
+    :param ip: IP
+    :return: True/False
+    '''
+    return ip.startswith('127.') or ip == get_ip()
+
+
+## -------------------------------------------------------------------------------------------------
+def local_socket_path(ip, port):
+    '''
+    Get the Unix socket of a server running on this host
+
+    :param ip: server IP
+    :param port: server TCP port
+    :return: path, None if the server is on another host or has no Unix socket
+    '''
+    if not unix_sockets_supported() or not is_local_address(ip):
+        return None
+
+    ## Only connect to a socket of this user, not one another user put there
+    path = unix_socket_path(port)
+    if path is None:
+        return None
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        return None
+
+    return path
+
+
+## -------------------------------------------------------------------------------------------------
+def connect(ip, port):
+    '''
+    Connect to a server. A server on this host is connected to over its Unix socket, which skips
+    the TCP stack & carries the same frames, so send_msg(), receive_msg() & FrameDecoder work
+    the same on either. Falls back to TCP if the Unix socket doesn't accept the connection.
+
+    :param ip: server IP
+    :param port: server TCP port
+    :return: connected socket
+    '''
+    path = local_socket_path(ip, port)
+    if path is not None:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(path)
+            return s
+        except OSError:
+            s.close()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.connect((ip, port))
+    except OSError:
+        s.close()
+        raise
+    return s
 
 
 ## -------------------------------------------------------------------------------------------------
@@ -93,3 +953,8 @@ def get_ip():
 
     return ip
 
+
+## =================================================================================================
+JSON_CODEC      = JsonCodec()
+BINARY_CODEC    = BinaryCodec()
+CODECS          = {codec.name: codec for codec in (BINARY_CODEC, JSON_CODEC)}
@@ -0,0 +1,61 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import time
+
+## =================================================================================================
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst):
+        '''
+        Token bucket rate limit: tokens are added at a fixed rate up to the burst size & every unit
+        of work takes tokens. Allows short bursts while limiting the average rate.
+
+        :param rate: tokens added per second
+        :param burst: most tokens held, the bucket starts full
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+
+    def refill(self, now):
+        '''
+        Add the tokens earned since the last update
+
+        :param now: time.monotonic()
+        :return: None
+        '''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+    def take(self, amount, now):
+        '''
+        Take tokens if there are enough
+
+        :param amount: tokens needed
+        :param now: time.monotonic()
+        :return: True if the tokens were taken
+        '''
+        self.refill(now)
+        if self.tokens < amount:
+            return False
+
+        self.tokens -= amount
+        return True
+
+
+    def charge(self, amount, now):
+        '''
+        Take tokens for work already done, the bucket may go into debt
+
+        :param amount: tokens used
+        :param now: time.monotonic()
+        :return: True if the bucket is not in debt
+        '''
+        self.refill(now)
+        self.tokens -= amount
+        return self.tokens >= 0
@@ -0,0 +1,184 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import mmap
+import struct
+import time
+
+## =================================================================================================
+## Log header: magic, format version, wall clock time the recording started
+LOG_HEADER      = struct.Struct('<4sBd')
+LOG_MAGIC       = b'PMGR'
+LOG_VERSION     = 1
+
+## Record header: seconds since the recording started, event, connection number, flags, payload
+## length
+RECORD_HEADER   = struct.Struct('<dBIBI')
+
+## Events
+OPENED      = 1         # Connection accepted, payload is the 'ip:port' of the client
+RECEIVED    = 2         # Frame received from a client, payload is the frame payload
+SENT        = 3         # Frame sent or queued for a client, payload is the framed message
+TICK        = 4         # Server tick, no payload
+CLOSED      = 5         # Connection closed, no payload
+
+## Flags
+FLAG_BINARY = 1         # Binary frame
+FLAG_UDP    = 2         # Frame received or sent over UDP
+FLAG_RESUMABLE  = 4     # Connection dropped, its player is kept for the session to be resumed
+
+RECORD_BUFFER_SIZE  = 1 << 20   # Bytes buffered before writing to the log
+
+## =================================================================================================
+class Recorder:
+    def __init__(self, path):
+        '''
+        Record the traffic of a server to an append-only binary log: connections, every frame
+        received & sent and the ticks, each with a timestamp. Writes are buffered & flushed every
+        tick, so a killed server loses at most one tick. Recording stops if writing fails.
+
+        :param path: log file, overwritten
+        '''
+        self.path = path
+        self.f = open(path, 'wb', buffering=RECORD_BUFFER_SIZE)
+        self.f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, time.time()))
+        self.start = time.monotonic()
+
+        ## OnlinePlayer -> connection number
+        self.connections = {}
+        self.next_connection = 1
+
+
+    def write(self, event, connection=0, flags=0, payload=b''):
+        '''
+        Append a record
+
+        :param event: event number
+        :param connection: connection number, 0 for server events
+        :param flags: event flags
+        :param payload: bytes or memoryview
+        :return: None
+        '''
+        if self.f is None:
+            return
+
+        try:
+            self.f.write(RECORD_HEADER.pack(time.monotonic() - self.start, event, connection,
+                                            flags, len(payload)))
+            if payload:
+                self.f.write(payload)
+        except OSError as e:
+            print(f'Recording to {self.path} stopped: {e!r}')
+            self.close()
+
+
+    def opened(self, online_player):
+        connection = self.next_connection
+        self.next_connection += 1
+        self.connections[online_player] = connection
+
+        addr = online_player.addr
+        self.write(OPENED, connection, payload=f'{addr[0]}:{addr[1]}'.encode('utf-8'))
+
+
+    def received(self, online_player, binary, payload, udp=False):
+        self.write(RECEIVED, self.connections.get(online_player, 0),
+                   (FLAG_BINARY if binary else 0) | (FLAG_UDP if udp else 0), payload)
+
+
+    def sent(self, online_player, frame, udp=False):
+        self.write(SENT, self.connections.get(online_player, 0), FLAG_UDP if udp else 0, frame)
+
+
+    def ticked(self):
+        self.write(TICK)
+        if self.f is not None:
+            try:
+                self.f.flush()
+            except OSError as e:
+                print(f'Recording to {self.path} stopped: {e!r}')
+                self.close()
+
+
+    def closed(self, online_player, resumable=False):
+        self.write(CLOSED, self.connections.pop(online_player, 0),
+                   FLAG_RESUMABLE if resumable else 0)
+
+
+    def close(self):
+        '''
+        Flush & close the log
+
+        :return: None
+        '''
+        f, self.f = self.f, None
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+
+
+## -------------------------------------------------------------------------------------------------
+class LogReader:
+    def __init__(self, path):
+        '''
+        Read a log written by Recorder. The file is memory mapped & payloads are returned as
+        memoryviews of the mapping, so reading a log copies nothing. A record cut off at the end,
+        e.g. by killing the server, is ignored.
+
+        :param path: log file
+        '''
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < LOG_HEADER.size:
+            self.mm.close()
+            raise ValueError(f'{path} is not a recording')
+        magic, version, self.started = LOG_HEADER.unpack_from(self.mm)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            self.mm.close()
+            raise ValueError(f'{path} is not a version {LOG_VERSION} recording')
+
+        self.view = memoryview(self.mm)
+
+
+    def __iter__(self):
+        '''
+        Iterate over the records
+
+        :return: iterator of (seconds, event, connection, flags, payload memoryview)
+        '''
+        view = self.view
+        size = len(view)
+        offset = LOG_HEADER.size
+        while offset + RECORD_HEADER.size <= size:
+            t, event, connection, flags, length = RECORD_HEADER.unpack_from(view, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > size:
+                return
+
+            yield t, event, connection, flags, view[offset:offset + length]
+            offset += length
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''
+        Unmap the log. Payloads returned before must not be used afterwards.
+
+        :return: None
+        '''
+        self.view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            ## A payload is still referenced, the mapping is closed once it's garbage collected
+            pass
@@ -0,0 +1,89 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import types
+
+## =================================================================================================
+class PlayerRegistry:
+    def __init__(self):
+        '''
+        Player ID -> connection registry with a version number. Every join & leave increases the
+        version. Readers iterate immutable snapshots, so a player leaving while the broadcaster
+        walks the players can't break the iteration, and can compare versions to skip work when
+        nothing changed.
+
+        Writers update a private dict & never copy it. A snapshot is copied from it at most once
+        per version, on the first snapshot() after a change, & shared by every reader until the
+        next change. The server runs one event loop, so nothing is locked.
+        '''
+        self.players = {}
+        self.version = 0
+        self.cached = types.MappingProxyType({})
+        self.cached_version = 0
+
+
+    def __len__(self):
+        return len(self.players)
+
+
+    def __contains__(self, pid):
+        return pid in self.players
+
+
+    def get(self, pid, default=None):
+        return self.players.get(pid, default)
+
+
+    def add(self, pid, online_player):
+        '''
+        Register the connection of a player, replacing the connection registered before
+
+        :param pid: player ID
+        :param online_player: OnlinePlayer
+        :return: None
+        '''
+        if self.players.get(pid) is online_player:
+            return
+        self.players[pid] = online_player
+        self.version += 1
+
+
+    def remove(self, pid, online_player=None):
+        '''
+        Unregister a player
+
+        :param pid: player ID
+        :param online_player: only remove the player if it's registered with this connection
+        :return: True if the player was removed
+        '''
+        registered = self.players.get(pid)
+        if registered is None or online_player is not None and registered is not online_player:
+            return False
+        del self.players[pid]
+        self.version += 1
+        return True
+
+
+    def clear(self):
+        self.players.clear()
+        self.version += 1
+
+
+    def snapshot(self):
+        '''
+        Get the players of the current version
+
+        :return: read-only mapping of player ID -> OnlinePlayer
+        '''
+        if self.cached_version != self.version:
+            self.cached = types.MappingProxyType(dict(self.players))
+            self.cached_version = self.version
+        return self.cached
+
+
+    def items(self):
+        return self.snapshot().items()
+
+
+    def values(self):
+        return self.snapshot().values()
@@ -1,21 +1,125 @@
 ## =================================================================================================
 ## Python 3.6+
 ## =================================================================================================
-import json
+import argparse
+import collections
+import os
+import secrets
+import selectors
+import signal
 import socket
+import stat
+import struct
 import sys
-import threading
 import time
 
+import constants
 import player
+import playertable
+import physics
 import pysockets
+import ratelimit
+import recording
+import registry
+import sharding
+import spatial
+import stats
+
+try:
+    import resource
+except ImportError:
+    ## Not available on Windows
+    resource = None
 
 ## =================================================================================================
+RECV_SIZE   = 4096              # Receive buffer size per connection, grown for larger messages
+TICK_RATE   = 20                # Snapshots broadcast per second
+AOI_RADIUS  = 500               # Clients only receive the players within this distance
+MAX_QUEUED_FRAMES   = 8         # Outbound frames per connection before stale snapshots are dropped
+SLOW_CLIENT_TIMEOUT = 5.0       # Seconds a connection may go without draining its queue
+ACCEPT_BATCH = 256              # Connections accepted per pass of the event loop
+SESSION_GRACE = 10.0            # Seconds a dropped player is kept for its client to resume
+
+## Flood protection per connection
+MAX_CLIENT_FRAME_SIZE = RECV_SIZE   # Largest frame accepted from clients, including the header
+MSG_RATE    = 100               # Messages per second handled, excess updates are coalesced
+MSG_BURST   = 200
+BYTE_RATE   = 16384             # Bytes per second read, reading pauses when exceeded
+BYTE_BURST  = 65536
+FLOOD_TIMEOUT = 3.0             # Seconds over a limit, net of seconds under it, before kicking
+
+DEFAULT_ROOM    = 'default'     # Room of clients that don't ask for one, never torn down
+MAX_ROOM_NAME   = 32            # Characters of a room name
 
-PLAYERS = {}
+PLAYERS = registry.PlayerRegistry()     # Player ID -> OnlinePlayer of the default room
+PLAYER_TABLE = playertable.PlayerTable()  # Player records of the default room
 
 ## =================================================================================================
 def main():
+    parser = argparse.ArgumentParser(description='Multiplayer game server')
+    parser.add_argument('--tick-rate', type=float, default=TICK_RATE,
+                        help=f'snapshots broadcast per second (default: {TICK_RATE})')
+    parser.add_argument('--json', action='store_true',
+                        help='always use the JSON codec, for debugging')
+    parser.add_argument('--aoi-radius', type=float, default=AOI_RADIUS,
+                        help=f'area of interest radius, clients only receive the players within '
+                             f'this distance. 0 sends every player (default: {AOI_RADIUS})')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes accepting on the same port with SO_REUSEPORT, '
+                             'sharing player state in shared memory (default: 1)')
+    parser.add_argument('--udp', action='store_true',
+                        help='offer clients a UDP channel on the same port for inputs & snapshots')
+    parser.add_argument('--stats-port', type=int, default=0,
+                        help='serve metrics & the profiler over HTTP on 127.0.0.1:PORT, worker '
+                             'processes use the following ports (default: off)')
+    parser.add_argument('--room-size', type=int, default=0,
+                        help='most players per room. Clients not naming a room fill the '
+                             'auto-assigned rooms one by one (default: 0, no limit)')
+    parser.add_argument('--no-unix-socket', action='store_true',
+                        help='only accept TCP connections, by default clients on the same host '
+                             'connect over a Unix socket')
+    parser.add_argument('--no-compression', action='store_true',
+                        help='ignore the compression modes offered by clients')
+    parser.add_argument('--compress-threshold', type=int, default=pysockets.COMPRESS_THRESHOLD,
+                        help=f'smallest frame compressed, in bytes '
+                             f'(default: {pysockets.COMPRESS_THRESHOLD})')
+    parser.add_argument('--record', metavar='PATH',
+                        help='record the traffic to a binary log for benchmark.py replay, worker '
+                             'processes append their number to the path')
+    parser.add_argument('--session-grace', type=float,
+                        help=f'seconds a player whose connection dropped stays in the game, so its '
+                             f'client can reconnect & resume. 0 removes it right away '
+                             f'(default: {SESSION_GRACE}, 0 with --workers)')
+    parser.add_argument('--collisions', action='store_true',
+                        help=f'push overlapping players apart every tick, vectorized with NumPy if '
+                             f'it is installed (using: {physics.backend()})')
+    args = parser.parse_args()
+    if args.tick_rate <= 0:
+        parser.error('--tick-rate must be positive')
+    if args.workers < 1:
+        parser.error('--workers must be positive')
+    if args.workers > 1 and not sharding.reuseport_supported():
+        parser.error('--workers needs SO_REUSEPORT and fork(), which this OS does not support')
+    if args.session_grace is not None and args.session_grace < 0:
+        parser.error('--session-grace can not be negative')
+    if args.room_size < 0:
+        parser.error('--room-size can not be negative')
+    if args.workers > 1 and args.room_size:
+        ## Worker processes share one player table
+        parser.error('--room-size can not be combined with --workers')
+    if args.workers > 1 and args.udp:
+        ## Datagrams would reach workers that don't hold the connection
+        parser.error('--udp can not be combined with --workers')
+    if args.workers > 1 and args.collisions:
+        ## Each worker only holds the positions of its own connections
+        parser.error('--collisions can not be combined with --workers')
+    if args.workers > 1 and args.session_grace:
+        ## Sessions are kept by the worker that held the connection, the reconnect usually
+        ## reaches another one
+        parser.error('--session-grace can not be combined with --workers')
+    if args.session_grace is None:
+        args.session_grace = 0 if args.workers > 1 else SESSION_GRACE
+
     ## Get device local IP
     ip = pysockets.get_ip()
 
@@ -34,114 +138,1521 @@ def main():
             if port > 65535:
                 port = 0
 
-    ## Put the socket into listening mode
-    s.listen(5)
+    ## The port is free, bind it again for every worker. The kernel spreads connections over
+    ## sockets sharing a port with SO_REUSEPORT.
+    listen_sockets = [s]
+    if args.workers > 1:
+        s.close()
+        listen_sockets = []
+        for worker in range(args.workers):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            s.bind((ip, port))
+            listen_sockets.append(s)
+
+    ## Put the sockets into listening mode. Use the largest backlog the OS allows so bursts of
+    ## joins are queued by the kernel instead of refused.
+    for s in listen_sockets:
+        s.listen(socket.SOMAXCONN)
+    raise_open_file_limit()
+
+    ## Clients on this host find the Unix socket by the port & skip the TCP stack, see
+    ## pysockets.connect()
+    unix_socket = None
+    if not args.no_unix_socket and pysockets.unix_sockets_supported():
+        unix_socket = open_unix_socket(port)
 
-    ## Accept connections
     try:
-        while True:
-            ## Establish connection with client
-            c, addr = s.accept()
-            print(f'Got connection from {addr[0]}:{addr[1]}')
+        run_server(args, ip, port, listen_sockets, unix_socket)
+    finally:
+        if unix_socket is not None:
+            close_unix_socket(unix_socket, port)
+
+
+## -------------------------------------------------------------------------------------------------
+def run_server(args, ip, port, listen_sockets, unix_socket=None):
+    '''
+    Serve the listening sockets in this process or in worker processes
+
+    :param args: parsed command line arguments
+    :param ip: IP the sockets are bound to
+    :param port: port the sockets are bound to
+    :param listen_sockets: listening TCP sockets, one per worker
+    :param unix_socket: listening Unix socket shared by the workers, None to only use TCP
+    :return: None
+    '''
+    ## Stop on SIGTERM like on Ctrl+C, so the Unix socket is removed. Worker processes inherit
+    ## the handler & the parent passes SIGTERM on to them.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    if args.workers > 1:
+        table = sharding.SharedPlayerTable(args.workers)
+        sharding.run_workers(listen_sockets, table,
+                             lambda s: serve(s, args, table, unix_socket=unix_socket))
+        return
 
-            ## Host the connection in its own thread
-            thr = threading.Thread(target=read_data_thread_function, args=(OnlinePlayer(c, addr),))
-            thr.start()
-            time.sleep(0.2)
+    udp_socket = None
+    if args.udp:
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            udp_socket.bind((ip, port))
+            print(f'UDP socket bound to {ip}:{port}')
+        except OSError as e:
+            print(f'UDP disabled, could not bind {ip}:{port}: {e!r}')
+            udp_socket.close()
+            udp_socket = None
+
+    serve(listen_sockets[0], args, udp_socket=udp_socket, unix_socket=unix_socket)
+
+
+## -------------------------------------------------------------------------------------------------
+def serve(s, args, table=None, udp_socket=None, unix_socket=None):
+    '''
+    Serve every connection of a listening socket from a single event loop
+
+    :param s: listening socket
+    :param args: parsed command line arguments
+    :param table: sharding.SharedPlayerTable when running in a worker process
+    :param udp_socket: bound UDP socket, None to only use TCP
+    :param unix_socket: listening Unix socket, None to only use TCP
+    :return: None
+    '''
+    server = GameServer(s, tick_rate=args.tick_rate, json_only=args.json,
+                        aoi_radius=args.aoi_radius, table=table, udp_socket=udp_socket,
+                        unix_socket=unix_socket,
+                        compression=not args.no_compression,
+                        compress_threshold=args.compress_threshold, room_size=args.room_size,
+                        collisions=args.collisions, session_grace=args.session_grace)
+
+    if args.stats_port:
+        port = args.stats_port + (table.worker if table is not None else 0)
+        server.serve_stats(('127.0.0.1', port))
+        print(f'Stats served on http://127.0.0.1:{port}/metrics')
+
+    if args.record:
+        path = args.record + (f'.{table.worker}' if table is not None else '')
+        server.record(path)
+        print(f'Recording traffic to {path}')
+    try:
+        server.run()
 
     except KeyboardInterrupt:
-        for op in PLAYERS.values():
-            op.c.close()
+        server.close()
+
+
+## -------------------------------------------------------------------------------------------------
+def open_unix_socket(port):
+    '''
+    Listen on the Unix socket of a port, see pysockets.unix_socket_path(). A socket left behind
+    by a server that was killed is replaced, the TCP port being free means it's unused.
+
+    :param port: TCP port of the server
+    :return: listening socket, None if it could not be bound
+    '''
+    path = pysockets.unix_socket_path(port, create=True)
+    if path is None:
+        print('Unix socket disabled, no directory only this user can access')
+        return None
 
-        s.shutdown(socket.SHUT_RDWR)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        s.bind(path)
+        s.listen(socket.SOMAXCONN)
+    except OSError as e:
+        print(f'Unix socket disabled, could not bind {path}: {e!r}')
         s.close()
+        return None
+
+    print(f'Unix socket bound to {path}')
+    return s
 
 
 ## -------------------------------------------------------------------------------------------------
-def json_dumps_players():
+def close_unix_socket(s, port):
     '''
-    Get PLAYERS as JSON string
+    Close a socket from open_unix_socket() & remove its file
 
-    :return: string
+    :param s: listening Unix socket
+    :param port: TCP port of the server
+    :return: None
     '''
-    json_data = {'players': []}
-    for op in PLAYERS.values():
-        if op.player_data is not None:
-            json_data['players'].append(op.as_dict())
-
-    return json.dumps(json_data)
+    s.close()
+    path = pysockets.unix_socket_path(port)
+    if path is None:
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
 
 
 ## -------------------------------------------------------------------------------------------------
-def read_data_thread_function(online_player):
+def raise_open_file_limit():
     '''
-    Reads data from a particular connection. Each connection will have its own instance of this
-    function in a unique thread.
+    Raise the soft limit on open file descriptors to the hard limit, each connection uses one
 
-    :param online_player: OnlinePlayer
     :return: None
     '''
-    while True:
-        ## Read player data
+    if resource is None:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
         try:
-            msg = pysockets.receive_msg(online_player.c)
-            online_player.player_data = player.player_from_json(msg)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+## -------------------------------------------------------------------------------------------------
+def get_snapshot():
+    '''
+    Get the current state of PLAYER_TABLE, the players of the default room
+
+    :return: dict of player ID -> player record
+    '''
+    return PLAYER_TABLE.snapshot()
+
+
+## -------------------------------------------------------------------------------------------------
+def snapshot_msg(snapshot, seq, base=None, base_snapshot=None, visible=None, base_visible=None):
+    '''
+    Build a snapshot message. Without a base this is a keyframe holding every visible player. With
+    a base it is a delta holding only the players that were added, moved or came into view since
+    base_snapshot, plus the IDs of the players that were removed or went out of view.
+
+    :param snapshot: dict from get_snapshot()
+    :param seq: snapshot sequence number
+    :param base: sequence number of the snapshot the delta is relative to
+    :param base_snapshot: dict from get_snapshot() for the base sequence number
+    :param visible: IDs of the players the client can see, defaults to every player
+    :param base_visible: IDs of the players the client could see in the base snapshot
+    :return: message dict, see pysockets.JsonCodec
+    '''
+    if visible is None:
+        visible = snapshot
+    if base is None:
+        return {'seq': seq, 'players': [snapshot[pid] for pid in visible]}
+
+    if base_visible is None:
+        base_visible = base_snapshot
+    return {
+        'seq': seq,
+        'base': base,
+        'players': [snapshot[pid] for pid in visible
+                    if pid not in base_visible or base_snapshot.get(pid) != snapshot[pid]],
+        'removed': [pid for pid in base_visible if pid not in visible],
+    }
+
+
+## -------------------------------------------------------------------------------------------------
+def json_dumps_players(snapshot=None, seq=0, base=None, base_snapshot=None):
+    '''
+    Get the players of the default room as JSON string, see snapshot_msg()
+
+    :param snapshot: dict from get_snapshot(), defaults to the current players
+    :param seq: snapshot sequence number
+    :param base: sequence number of the snapshot the delta is relative to
+    :param base_snapshot: dict from get_snapshot() for the base sequence number
+    :return: string
+    '''
+    if snapshot is None:
+        snapshot = get_snapshot()
+
+    return pysockets.JSON_CODEC.dumps(snapshot_msg(snapshot, seq, base, base_snapshot))
+
+
+## -------------------------------------------------------------------------------------------------
+class GameServer:
+    def __init__(self, listen_socket, tick_rate=TICK_RATE, json_only=False,
+                 aoi_radius=AOI_RADIUS, table=None, udp_socket=None, unix_socket=None,
+                 compression=True,
+                 compress_threshold=pysockets.COMPRESS_THRESHOLD, room_size=0, collisions=False,
+                 session_grace=SESSION_GRACE):
+        '''
+        Single threaded server. All connections are multiplexed on one selector, so an idle
+        connection costs a socket and a small receive buffer instead of an OS thread.
+
+        Received updates only mark the game state of their room dirty. At most one snapshot is
+        built and sent to every member of a room per tick, so the cost grows linearly with the
+        number of players in the room, whatever else runs on the server.
+
+        :param listen_socket: bound & listening TCP socket
+        :param tick_rate: snapshots broadcast per second
+        :param json_only: ignore the codecs offered by clients & always use JSON
+        :param aoi_radius: only send clients the players within this distance, 0 sends everyone
+        :param table: sharding.SharedPlayerTable shared with the other worker processes. Player
+                      positions are written to it & snapshots are read from it, PLAYERS only holds
+                      the connections of this process. Every client is in the default room.
+        :param udp_socket: bound UDP socket offered to clients for inputs & snapshots. Over UDP a
+                           lost datagram doesn't hold up the ones after it. Joining & leaving
+                           always go over TCP.
+        :param unix_socket: listening Unix socket for clients on the same host. Connections
+                            accepted on it work like TCP connections, but aren't offered UDP or
+                            compression, which cost more than they save locally.
+        :param compression: compress the frames sent over TCP with the mode offered by clients,
+                            see pysockets.Compressor
+        :param compress_threshold: smallest frame compressed, in bytes
+        :param room_size: most players per room, 0 for no limit
+        :param collisions: push overlapping players of a room apart before its snapshot is built,
+                           see physics.resolve_collisions(). Not supported with a shared table.
+        :param session_grace: seconds a player stays in the game after its connection dropped.
+                              Clients get a session token in the hello reply & a client that
+                              reconnects with it within that time takes its player back.
+        '''
+        self.s = listen_socket
+        self.s.setblocking(False)
+        self.json_only = json_only
+
+        self.tick_interval = 1 / tick_rate
+        self.aoi_radius = aoi_radius
+        self.table = table
+
+        ## Rooms by name. The default room holds PLAYERS & PLAYER_TABLE, others are created when
+        ## their first client arrives & torn down when their last one leaves.
+        self.room_size = room_size
+        self.default_room = Room(DEFAULT_ROOM, aoi_radius, PLAYERS, PLAYER_TABLE)
+        self.rooms = {DEFAULT_ROOM: self.default_room}
+        self.next_room = 1
+        self.collisions = collisions
+
+        ## Joined connections of every room & the room registry versions they were listed at,
+        ## see all_players(). Reset when a connection closes.
+        self.joined = []
+        self.joined_versions = None
+
+        ## Session token -> OnlinePlayer, and the dropped ones in the order they dropped
+        self.session_grace = session_grace
+        self.sessions = {}
+        self.suspended = collections.OrderedDict()
+
+        ## Frames are compressed when they are sent, zlib-dict results are shared until the next
+        ## broadcast
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.compressed_frames = {}
+
+        ## Connections over a rate limit, checked every tick
+        self.limited = set()
+        self.max_strikes = max(1, round(FLOOD_TIMEOUT * tick_rate))
+
+        ## Outbound queue statistics
+        self.dropped_frames = 0
+        self.evicted_clients = 0
+
+        self.metrics = stats.Registry()
+        self.create_metrics()
+        self.stats_server = None
+        self.recorder = None
+
+        ## UDP channels by token
+        self.udp = udp_socket
+        self.udp_peers = {}
+        self.unix = unix_socket
+
+        ## Listening & UDP sockets are registered without data, connections carry their
+        ## OnlinePlayer & stats server sockets their event handler
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.s, selectors.EVENT_READ)
+        for s in (self.udp, self.unix):
+            if s is not None:
+                s.setblocking(False)
+                self.selector.register(s, selectors.EVENT_READ)
+
+
+    def run(self):
+        '''
+        Run the event loop forever
+
+        :return: None
+        '''
+        next_tick = time.monotonic()
+        while True:
+            for key, mask in self.selector.select(max(0, next_tick - time.monotonic())):
+                if key.data is None:
+                    if key.fileobj is self.s or key.fileobj is self.unix:
+                        self.accept_connections(key.fileobj)
+                    else:
+                        self.read_datagrams()
+                    continue
+                if callable(key.data):
+                    key.data(key.fileobj, mask)
+                    continue
+
+                ## Skip connections closed while handling earlier events
+                if mask & selectors.EVENT_WRITE and not key.data.closed:
+                    self.flush(key.data)
+                if mask & selectors.EVENT_READ and not key.data.closed:
+                    self.read_data(key.data)
+
+            now = time.monotonic()
+            if now >= next_tick:
+                self.tick()
+                self.ticks.inc()
+
+                ## Don't try to catch up on ticks missed while busy, just skip them
+                next_tick += self.tick_interval
+                if next_tick < now:
+                    self.skipped_ticks.inc(int((now - next_tick) / self.tick_interval) + 1)
+                    next_tick = now + self.tick_interval
+
+
+    def tick(self):
+        '''
+        Broadcast one snapshot if anything changed since the last tick & disconnect clients that
+        stopped reading
+
+        :return: None
+        '''
+        if self.recorder is not None:
+            self.recorder.ticked()
+
+        if self.limited:
+            self.check_limits()
+
+        if self.suspended:
+            self.expire_sessions()
+
+        if self.table is not None and self.table.changed():
+            self.default_room.dirty = True
+
+        ## A lost datagram may have held the last change. Resend the latest snapshot to each UDP
+        ## client that hasn't acknowledged a snapshot with it yet, rooms that broadcast this tick
+        ## send it anyway. A failed send disconnects the client & removes it from the peers.
+        for op in list(self.udp_peers.values()):
+            room = op.room
+            if (not op.closed and op.udp_addr is not None and op.pid is not None
+                    and room is not None and not room.dirty and op.ack < room.changed_seq):
+                self.send_room_snapshot(room, op, {})
+
+        for room in list(self.rooms.values()):
+            if room.dirty:
+                room.dirty = False
+                pushed = self.collisions and self.resolve_collisions(room)
+                start = time.perf_counter()
+                self.broadcast_player_info(room)
+                self.broadcast_seconds.observe(time.perf_counter() - start)
+
+                ## Players pushed into others are pushed again next tick, until nobody overlaps
+                if pushed:
+                    room.dirty = True
+
+        now = time.monotonic()
+        for op in self.all_players():
+            self.queue_depths.observe(op.queue_depth)
+            if op.outq and now - op.drained_at > SLOW_CLIENT_TIMEOUT:
+                self.evicted_clients += 1
+                self.disconnect(op, f'(not reading, {op.queued_bytes} bytes queued)',
+                                resumable=True)
+
+
+    def resolve_collisions(self, room):
+        '''
+        Push the overlapping players of a room apart
+
+        :param room: Room
+        :return: True if a player was pushed
+        '''
+        start = time.perf_counter()
+        moved = physics.resolve_collisions(room.table)
+        self.collision_seconds.observe(time.perf_counter() - start)
+        self.collision_moves.inc(len(moved))
+        return bool(moved)
+
+
+    def all_players(self):
+        '''
+        Get the joined players of every room, without the dropped ones waiting to be resumed
+
+        :return: list of OnlinePlayer, not to be modified
+        '''
+        versions = [(room, room.players.version) for room in self.rooms.values()]
+        if versions != self.joined_versions:
+            self.joined = [op for room in self.rooms.values() for op in room.players.values()
+                           if not op.closed]
+            self.joined_versions = versions
+        return self.joined
+
+
+    def join_room(self, online_player, name=None):
+        '''
+        Put a connection in a room. A named room is created if it doesn't exist. Without a name,
+        the fullest auto-assigned room with space left is picked, so rooms fill up one by one,
+        and a new one is created when they are all full. Named rooms are never auto-assigned.
+
+        :param online_player: OnlinePlayer
+        :param name: room name, None to be assigned one
+        :return: Room, None if the named room is full
+        '''
+        if self.table is not None or not isinstance(name, str) or not name:
+            name = None
+        elif len(name) > MAX_ROOM_NAME:
+            name = name[:MAX_ROOM_NAME]
+
+        if name is None and not self.room_size:
+            room = self.default_room
+        elif name is None:
+            rooms = [room for room in self.rooms.values()
+                     if room.auto and len(room.members) < self.room_size]
+            room = max(rooms, key=lambda room: len(room.members), default=None)
+            if room is None:
+                while f'room-{self.next_room}' in self.rooms:
+                    self.next_room += 1
+                room = self.create_room(f'room-{self.next_room}', auto=True)
+        else:
+            room = self.rooms.get(name)
+            if room is None:
+                room = self.create_room(name)
+            elif self.room_size and len(room.members) >= self.room_size:
+                return None
+
+        room.members.add(online_player)
+        online_player.room = room
+        return room
+
+
+    def create_room(self, name, auto=False):
+        '''
+        Create a room
+
+        :param name: room name
+        :param auto: clients that don't name a room may be assigned to it
+        :return: Room
+        '''
+        room = Room(name, self.aoi_radius, auto=auto)
+        self.rooms[name] = room
+        print(f'Room {name} created')
+        return room
+
+
+    def leave_room(self, online_player):
+        '''
+        Take a connection out of its room & tear the room down if it's empty
+
+        :param online_player: OnlinePlayer
+        :return: None
+        '''
+        room = online_player.room
+        room.members.discard(online_player)
+        if online_player.pid is not None:
+            room.players.remove(online_player.pid, online_player)
+            room.table.remove(online_player.slot)
+            room.dirty = True
+
+        if not room.members and room is not self.default_room:
+            del self.rooms[room.name]
+            print(f'Room {room.name} closed')
+
+
+    def start_session(self, online_player):
+        '''
+        Give a connection a session token
+
+        :param online_player: OnlinePlayer
+        :return: token
+        '''
+        online_player.session = secrets.token_hex(16)
+        self.sessions[online_player.session] = online_player
+        return online_player.session
+
+
+    def resume(self, online_player, dropped):
+        '''
+        Hand the player of a session over to a new connection. The player keeps its slot,
+        position & room, so the other clients see no change. The new connection is sent a
+        keyframe with the next broadcast.
 
-        except json.JSONDecodeError:
-            continue
+        :param online_player: OnlinePlayer of the new connection
+        :param dropped: OnlinePlayer holding the session, closed or not
+        :return: None
+        '''
+        if not dropped.closed:
+            ## The client lost the old connection before the server noticed
+            self.disconnect(dropped, '(resumed on a new connection)', resumable=True)
+        self.suspended.pop(dropped.session, None)
+
+        op = online_player
+        op.pid, op.slot, op.room, op.shared_slot = (dropped.pid, dropped.slot, dropped.room,
+                                                    dropped.shared_slot)
+        op.input_seq, op.input_time, op.session = (dropped.input_seq, dropped.input_time,
+                                                   dropped.session)
+        dropped.pid = dropped.slot = dropped.room = dropped.shared_slot = dropped.session = None
+
+        op.room.members.discard(dropped)
+        op.room.members.add(op)
+        op.room.players.add(op.pid, op)
+        op.room.dirty = True
+        self.sessions[op.session] = op
+        self.sessions_resumed.inc()
+        print(f'Player #{op.pid} resumed')
+
+
+    def expire_sessions(self):
+        '''
+        Remove the dropped players whose client didn't resume within the grace period
+
+        :return: None
+        '''
+        now = time.monotonic()
+        while self.suspended:
+            op = next(iter(self.suspended.values()))
+            if now - op.dropped_at < self.session_grace:
+                return
+
+            self.suspended.popitem(last=False)
+            self.sessions_expired.inc()
+            print(f'Player #{op.pid} left (session expired)')
+            self.end_session(op)
+
+
+    def end_session(self, online_player):
+        '''
+        Remove the player of a closed connection from the game
+
+        :param online_player: OnlinePlayer
+        :return: None
+        '''
+        op = online_player
+        if op.session is not None:
+            if self.sessions.get(op.session) is op:
+                del self.sessions[op.session]
+            self.suspended.pop(op.session, None)
+            op.session = None
+
+        if op.shared_slot is not None:
+            self.table.release(op.shared_slot)
+            op.shared_slot = None
+        if op.room is not None:
+            self.leave_room(op)
+
+
+    def check_limits(self):
+        '''
+        Handle the connections that went over a rate limit: apply their coalesced updates, resume
+        reading once their byte budget refilled & disconnect the ones that keep flooding. Every
+        tick over a limit or with reading paused is a strike, every tick under the limits takes
+        one away.
+
+        :return: None
+        '''
+        now = time.monotonic()
+        for op in list(self.limited):
+            if op.closed:
+                self.limited.discard(op)
+                continue
+
+            if op.flooding or op.throttled:
+                op.flooding = False
+                op.strikes += 1
+                if op.strikes >= self.max_strikes:
+                    self.flood_disconnects.inc()
+                    self.disconnect(op, '(flooding)')
+                    continue
+            elif op.strikes:
+                op.strikes -= 1
+
+            if op.coalesced:
+                coalesced, op.coalesced = op.coalesced, None
+                for kind in ('hello', 'player', 'input', 'ack'):
+                    if kind in coalesced and not self.handle_client_msg(op, coalesced[kind]):
+                        break
+                if op.closed:
+                    continue
+
+            if op.throttled and op.byte_bucket.take(0, now):
+                op.throttled = False
+                self.update_events(op)
+
+            if not op.throttled and not op.strikes:
+                self.limited.discard(op)
+
+
+    def flag(self, online_player, limit):
+        '''
+        Record that a connection went over a limit, see check_limits()
+
+        :param online_player: OnlinePlayer
+        :param limit: metric label
+        :return: None
+        '''
+        online_player.flooding = True
+        self.limited.add(online_player)
+        self.rate_limited.inc(1, limit)
+
+
+    def coalesce(self, online_player, msg):
+        '''
+        Keep a message of a connection over its message rate for the next tick, merged with the
+        messages of the same kind received before it. Only the last hello, player update &
+        acknowledgement are kept, input commands are added up.
+
+        :param online_player: OnlinePlayer
+        :param msg: message dict
+        :return: None
+        '''
+        op = online_player
+        if op.coalesced is None:
+            op.coalesced = {}
+
+        if 'input' in msg:
+            pending = op.coalesced.get('input')
+            if pending is not None:
+                seq, dx, dy, t = msg['input']
+                _, pending_dx, pending_dy, _ = pending['input']
+                msg = {'input': (seq, pending_dx + dx, pending_dy + dy, t)}
+            op.coalesced['input'] = msg
+            return
+
+        for kind in ('hello', 'player', 'ack'):
+            if kind in msg:
+                op.coalesced[kind] = msg
+                return
+
+
+    def broadcast_player_info(self, room):
+        '''
+        Broadcast player data to the players of a room. Each client gets a delta against the last
+        snapshot it acknowledged, or a keyframe if it never acknowledged one or that snapshot is no
+        longer in the history. Each message is encoded & framed once, clients with the same codec &
+        baseline are all sent the same bytes.
+
+        :param room: Room
+        :return: None
+        '''
+        snapshot = room.table.snapshot() if self.table is None else self.table.snapshot()
+        self.compressed_frames.clear()
+        if room.grid is not None:
+            self.update_grid(room.grid, snapshot, room.snapshots.get(room.snapshot_seq, {}))
+
+        if snapshot != room.snapshots.get(room.snapshot_seq):
+            room.changed_seq = room.snapshot_seq + 1
+        room.snapshot_seq += 1
+        room.snapshots[room.snapshot_seq] = snapshot
+        while len(room.snapshots) > constants.SNAPSHOT_HISTORY:
+            room.snapshots.popitem(last=False)
+
+        msgs = {}
+        for op in room.players.values():
+            if op.closed:
+                ## Dropped, waiting for its client to resume
+                continue
+            self.send_room_snapshot(room, op, msgs)
+
+
+    def send_room_snapshot(self, room, online_player, msgs):
+        '''
+        Send the latest snapshot of a room to one of its players, as a delta against the last
+        snapshot the client acknowledged. It is preceded by the last input applied to the player,
+        so the client can tell its own position in the snapshot from the inputs still on the way
+        & correct its prediction, e.g. after a collision pushed the player. That is only sent when
+        the input or the player changed since it was last sent, or the client didn't acknowledge
+        a snapshot that came with it yet.
+
+        :param room: Room
+        :param online_player: OnlinePlayer
+        :param msgs: (codec, base) -> frame of the snapshot, shared by the clients of a broadcast
+                     that see the whole room
+        :return: None
+        '''
+        op = online_player
+        snapshot = room.snapshots[room.snapshot_seq]
+        applied = b''
+        state = (op.input_seq, snapshot.get(op.pid))
+        if state != op.applied_state or op.ack < op.applied_seq:
+            applied = op.codec.encode({'applied': (room.snapshot_seq, op.input_seq, op.input_time)})
+            op.applied_state, op.applied_seq = state, room.snapshot_seq
+        if room.grid is None:
+            base = op.ack if op.ack in room.snapshots else None
+            if (op.codec, base) not in msgs:
+                msgs[op.codec, base] = self.encode(op.codec, snapshot_msg(
+                    snapshot, room.snapshot_seq, base, room.snapshots.get(base)))
+
+            self.send_snapshot(op, msgs[op.codec, base], applied)
+            return
+
+        ## Every client sees a different part of the world, so its message is its own. The
+        ## players it could see are kept per snapshot for the next delta.
+        _, x, y, _ = snapshot[op.pid]
+        visible = room.grid.query(x, y, self.aoi_radius)
+        ## The history is trimmed after the send, it may still hold a snapshot that was dropped
+        base = op.ack if op.ack in op.visible_history and op.ack in room.snapshots else None
+        self.send_snapshot(op, self.encode(op.codec, snapshot_msg(
+            snapshot, room.snapshot_seq, base, room.snapshots.get(base), visible,
+            op.visible_history.get(base))), applied)
+
+        op.visible_history[room.snapshot_seq] = visible
+        while next(iter(op.visible_history)) not in room.snapshots:
+            op.visible_history.popitem(last=False)
+
+
+    def compress(self, compressor, frame):
+        '''
+        Compress a frame & record the time & bytes saved
+
+        :param compressor: pysockets.Compressor
+        :param frame: bytes
+        :return: bytes
+        '''
+        if len(frame) < compressor.threshold:
+            return frame
+        if compressor.shared:
+            compressed = self.compressed_frames.get(frame)
+            if compressed is not None:
+                self.compression_saved_bytes.inc(len(frame) - len(compressed), compressor.mode)
+                return compressed
+
+        start = time.perf_counter()
+        compressed = compressor.compress(frame)
+        self.compress_seconds.observe(time.perf_counter() - start, compressor.mode)
+        self.compression_saved_bytes.inc(len(frame) - len(compressed), compressor.mode)
+        if compressor.shared:
+            self.compressed_frames[frame] = compressed
+        return compressed
+
+
+    def encode(self, codec, msg):
+        '''
+        Encode a message & record the encode time
+
+        :param codec: codec
+        :param msg: message dict
+        :return: bytes
+        '''
+        start = time.perf_counter()
+        frame = codec.encode(msg)
+        self.encode_seconds.observe(time.perf_counter() - start, codec.name)
+        return frame
+
+
+    def update_grid(self, grid, snapshot, previous):
+        '''
+        Update the positions of the players that moved, joined or left since the previous snapshot
+
+        :param grid: spatial.SpatialGrid of the room
+        :param snapshot: dict from get_snapshot()
+        :param previous: dict from get_snapshot() for the previous snapshot
+        :return: None
+        '''
+        for pid, record in snapshot.items():
+            if previous.get(pid) != record:
+                grid.update(pid, record[1], record[2])
+
+        for pid in previous:
+            if pid not in snapshot:
+                grid.remove(pid)
+
+
+    def send_snapshot(self, online_player, frame, applied=b''):
+        '''
+        Send a snapshot over UDP if the client registered a UDP address & the frames fit in a
+        datagram, otherwise queue them on the TCP connection
+
+        :param online_player: OnlinePlayer
+        :param frame: bytes
+        :param applied: frame of the last input applied, sent before the snapshot in the same
+                        datagram. Empty for none.
+        :return: None
+        '''
+        op = online_player
+        frames = [applied, frame] if applied else [frame]
+        if (op.udp_addr is not None and pysockets.DATAGRAM_HEADER.size + len(applied) + len(frame)
+                <= pysockets.MAX_DATAGRAM_SIZE):
+            try:
+                n = self.udp.sendto(op.udp.pack(frames), op.udp_addr)
+                self.messages_sent.inc(len(frames), 'udp')
+                self.bytes_sent.inc(n, 'udp')
+                if self.recorder is not None:
+                    for f in frames:
+                        self.recorder.sent(op, f, udp=True)
+                return
+            except (BlockingIOError, InterruptedError):
+                ## Like a lost datagram, the client keeps acknowledging older snapshots
+                self.dropped_frames += 1
+                return
+            except OSError:
+                pass
+
+        ## The input is dropped with its snapshot, it's sent again until a snapshot after it is
+        ## acknowledged
+        self.queue_frames(op, frames, droppable=True)
+
+
+    def queue_frame(self, online_player, frame, droppable=False):
+        '''
+        Queue a frame for a connection & send as much as the socket accepts without blocking. When
+        the queue is full, queued snapshots are replaced by the new one. Clients only apply deltas
+        to snapshots they acknowledged, so any snapshot can be dropped.
+
+        :param online_player: OnlinePlayer
+        :param frame: bytes
+        :param droppable: True for snapshots, which are made stale by newer ones
+        :return: None
+        '''
+        self.queue_frames(online_player, [frame], droppable)
+
+
+    def queue_frames(self, online_player, frames, droppable=False):
+        '''
+        Queue frames that belong together, like queue_frame(). Droppable frames queued before are
+        dropped before any of them, so none is dropped without the others.
+
+        :param online_player: OnlinePlayer
+        :param frames: list of bytes
+        :param droppable: True for snapshots & the frames sent with them
+        :return: None
+        '''
+        op = online_player
+        if op.closed:
+            return
+        if self.recorder is not None:
+            for frame in frames:
+                self.recorder.sent(op, frame)
+
+        if droppable and len(op.outq) + len(frames) > MAX_QUEUED_FRAMES:
+            ## Keep frames that must be delivered & the frame that is partially sent
+            kept = collections.deque()
+            for i, (queued_frame, queued_droppable) in enumerate(op.outq):
+                if not queued_droppable or (i == 0 and op.out_offset):
+                    kept.append((queued_frame, queued_droppable))
+                else:
+                    op.queued_bytes -= len(queued_frame)
+                    op.dropped += 1
+                    self.dropped_frames += 1
+            op.outq = kept
+
+        for frame in frames:
+            op.outq.append((frame, droppable))
+            op.queued_bytes += len(frame)
+        self.messages_sent.inc(len(frames), op.transport)
+        self.flush(op)
+
+
+    def flush(self, online_player):
+        '''
+        Send queued frames until the queue is empty or the socket would block. The connection is
+        watched for writability while frames are left.
+
+        Frames are compressed once they are next in line, so frames dropped from the queue never
+        reach the compression stream. A compressed frame can't be dropped anymore.
+
+        :param online_player: OnlinePlayer
+        :return: None
+        '''
+        op = online_player
+        while op.outq:
+            frame = op.outq[0][0]
+            if op.compressor is not None and not op.head_compressed:
+                compressed = self.compress(op.compressor, frame)
+                op.outq[0] = (compressed, False)
+                op.queued_bytes += len(compressed) - len(frame)
+                op.head_compressed = True
+                frame = compressed
 
-        except ConnectionResetError:
             try:
-                print(f'Player #{online_player.player_data.id} disconnected (ConnectionResetError)')
-                del PLAYERS[online_player.player_data.id]
-            except AttributeError:
-                print(f'{online_player.addr[0]}:{online_player.addr[1]} disconnected '
-                      f'(ConnectionResetError)')
+                n = op.c.send(memoryview(frame)[op.out_offset:])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.disconnect(op, '(send failed)', resumable=True)
+                return
+
+            op.out_offset += n
+            op.queued_bytes -= n
+            self.bytes_sent.inc(n, op.transport)
+            if op.out_offset == len(frame):
+                op.outq.popleft()
+                op.out_offset = 0
+                op.head_compressed = False
+
+        if not op.outq:
+            op.drained_at = time.monotonic()
+
+        if op.writable != bool(op.outq):
+            op.writable = bool(op.outq)
+            self.update_events(op)
+
 
-            broadcast_player_info()
+    def update_events(self, online_player):
+        '''
+        Watch a connection for readability unless reading is paused by the rate limit & for
+        writability while frames are queued. A connection with neither is taken off the selector.
+
+        :param online_player: OnlinePlayer
+        :return: None
+        '''
+        op = online_player
+        if op.closed:
             return
 
-        ## Update player info if its in-game, otherwise delete the player
-        if online_player.player_data.in_game == True:
-            PLAYERS[online_player.player_data.id] = online_player
-            broadcast_player_info()
+        events = ((0 if op.throttled else selectors.EVENT_READ) |
+                  (selectors.EVENT_WRITE if op.writable else 0))
+        if events == op.events:
+            return
+
+        if not events:
+            self.selector.unregister(op.c)
+        elif not op.events:
+            self.selector.register(op.c, events, op)
         else:
-            print(f'Player #{online_player.player_data.id} disconnected')
-            del PLAYERS[online_player.player_data.id]
-            broadcast_player_info()
+            self.selector.modify(op.c, events, op)
+        op.events = events
+
+
+    def stats(self):
+        '''
+        Outbound queue statistics
+
+        :return: dict
+        '''
+        players = self.all_players()
+        depths = [op.queue_depth for op in players]
+        return {
+            'connections': self.connection_count(),
+            'rooms': len(self.rooms),
+            'suspended': len(self.suspended),
+            'queued_frames': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'queued_bytes': sum(op.queued_bytes for op in players),
+            'dropped_frames': self.dropped_frames,
+            'evicted_clients': self.evicted_clients,
+        }
+
+
+    def connection_count(self):
+        '''
+        :return: number of game connections
+        '''
+        return sum(isinstance(key.data, OnlinePlayer) for key in self.selector.get_map().values())
+
+
+    def create_metrics(self):
+        '''
+        Create the metrics of the server, rendered by the stats server
+
+        :return: None
+        '''
+        m = self.metrics
+        self.messages_received = m.counter('game_messages_received_total',
+                                           'Messages received from clients', 'transport')
+        self.messages_sent = m.counter('game_messages_sent_total',
+                                       'Frames sent or queued for clients', 'transport')
+        self.bytes_received = m.counter('game_bytes_received_total',
+                                        'Bytes received from clients', 'transport')
+        self.bytes_sent = m.counter('game_bytes_sent_total', 'Bytes sent to clients', 'transport')
+        self.encode_seconds = m.histogram('game_encode_seconds',
+                                          'Time to encode a snapshot message', label='codec')
+        self.compress_seconds = m.histogram('game_compress_seconds',
+                                            'Time to compress a frame', label='mode')
+        self.compression_saved_bytes = m.counter('game_compression_saved_bytes_total',
+                                                 'Bytes saved by compressing frames', 'mode')
+        self.broadcast_seconds = m.histogram('game_broadcast_seconds',
+                                             'Time to build, encode & send one snapshot broadcast')
+        self.queue_depths = m.histogram('game_queue_depth',
+                                        'Outbound queue depth of every connection, every tick',
+                                        stats.DEPTH_BUCKETS)
+        self.collision_seconds = m.histogram('game_collision_seconds',
+                                             'Time to resolve the collisions of one room')
+        self.collision_moves = m.counter('game_collision_moves_total',
+                                         'Players pushed by collisions')
+        self.ticks = m.counter('game_ticks_total', 'Ticks run')
+        self.skipped_ticks = m.counter('game_ticks_skipped_total',
+                                       'Ticks skipped because the event loop fell behind')
+        self.rate_limited = m.counter('game_rate_limited_total',
+                                      'Messages coalesced, reads paused & datagrams dropped by '
+                                      'the per-connection rate limits', 'limit')
+        self.flood_disconnects = m.counter('game_flood_disconnects_total',
+                                           'Connections closed for exceeding the rate limits')
+        self.sessions_resumed = m.counter('game_sessions_resumed_total',
+                                          'Players taken back by a reconnecting client')
+        self.sessions_expired = m.counter('game_sessions_expired_total',
+                                          'Dropped players removed after the grace period')
+
+        m.gauge('game_connections', 'Open game connections', self.connection_count)
+        m.gauge('game_players', 'Players in the game',
+                lambda: sum(len(room.players) for room in self.rooms.values()))
+        m.gauge('game_rooms', 'Open rooms', lambda: len(self.rooms))
+        m.gauge('game_suspended_players', 'Dropped players waiting for their client to resume',
+                lambda: len(self.suspended))
+        m.gauge('game_queued_frames', 'Frames in outbound queues',
+                lambda: sum(op.queue_depth for op in self.all_players()))
+        m.gauge('game_queued_bytes', 'Bytes in outbound queues',
+                lambda: sum(op.queued_bytes for op in self.all_players()))
+        m.gauge('game_dropped_frames_total', 'Stale snapshots dropped from outbound queues',
+                lambda: self.dropped_frames, kind='counter')
+        m.gauge('game_evicted_clients_total', 'Clients disconnected for not reading',
+                lambda: self.evicted_clients, kind='counter')
+
+
+    def serve_stats(self, address):
+        '''
+        Serve the metrics & the sampling profiler over HTTP from the event loop, see
+        stats.StatsServer
+
+        :param address: (ip, port)
+        :return: None
+        '''
+        self.stats_server = stats.StatsServer(self.selector, address, self.metrics,
+                                              stats.SamplingProfiler())
+
+
+    def record(self, path):
+        '''
+        Record the traffic to a binary log, see recording.Recorder
+
+        :param path: log file
+        :return: None
+        '''
+        self.recorder = recording.Recorder(path)
+
+
+    def close(self):
+        '''
+        Close every connection and the listening socket
+
+        :return: None
+        '''
+        if self.stats_server is not None:
+            self.stats_server.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+        for key in list(self.selector.get_map().values()):
+            if isinstance(key.data, OnlinePlayer):
+                key.data.c.close()
+        self.selector.close()
+
+        self.s.close()
+        if self.udp is not None:
+            self.udp.close()
+        if self.unix is not None:
+            self.unix.close()
+
+
+    def accept_connections(self, listen_socket):
+        '''
+        Accept the connections waiting in the listen backlog, at most ACCEPT_BATCH at a time. The
+        rest stay in the backlog until the next pass of the event loop, so the ticks keep running
+        while a burst of clients reconnects.
+
+        :param listen_socket: listening TCP or Unix socket
+        :return: None
+        '''
+        for _ in range(ACCEPT_BATCH):
+            try:
+                c, addr = listen_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                ## Out of file descriptors etc, leave the rest in the backlog for now
+                print(f'accept() failed: {e!r}')
+                return
+
+            if listen_socket is self.unix:
+                ## Unix socket peers have no address, number them by file descriptor
+                addr = ('unix', c.fileno())
+            print(f'Got connection from {addr[0]}:{addr[1]}')
+
+            c.setblocking(False)
+            online_player = OnlinePlayer(c, addr)
+            self.selector.register(c, selectors.EVENT_READ, online_player)
+            if self.recorder is not None:
+                self.recorder.opened(online_player)
+
+
+    def read_data(self, online_player):
+        '''
+        Reads the available data from a particular connection and handles every complete message
+
+        :param online_player: OnlinePlayer
+        :return: None
+        '''
+        received = online_player.decoder.bytes_received
+        try:
+            frames = online_player.decoder.recv_from(online_player.c)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (ConnectionResetError, ConnectionAbortedError):
+            self.disconnect(online_player, '(ConnectionResetError)', resumable=True)
             return
+        except ValueError as e:
+            self.disconnect(online_player, f'(invalid frame: {e})')
+            return
+
+        op = online_player
+        now = time.monotonic()
+        n = op.decoder.bytes_received - received
+        self.bytes_received.inc(n, op.transport)
+        self.messages_received.inc(len(frames), op.transport)
+
+        if not op.byte_bucket.charge(n, now):
+            ## Stop reading until the budget refilled, TCP flow control slows the client down
+            self.flag(op, 'bytes')
+            op.throttled = True
+            self.update_events(op)
+
+        for binary, payload in frames:
+            if self.recorder is not None:
+                self.recorder.received(op, binary, payload)
+            try:
+                msg = pysockets.decode_frame(binary, payload)
+            except (ValueError, KeyError, TypeError, struct.error):
+                self.flag(op, 'invalid')
+                continue
+
+            if not op.msg_bucket.take(1, now):
+                self.flag(op, 'messages')
+                self.coalesce(op, msg)
+            elif not self.handle_client_msg(op, msg):
+                return
+
+
+    def read_datagrams(self):
+        '''
+        Read every datagram waiting on the UDP socket. A datagram without frames registers the
+        address it came from for the connection of its token & is answered with an empty
+        datagram, so the client knows UDP gets through. Only inputs & acknowledgements are
+        accepted over UDP.
+
+        :return: None
+        '''
+        while True:
+            try:
+                data, addr = self.udp.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                ## E.g. ICMP port unreachable for an earlier datagram
+                continue
+
+            self.bytes_received.inc(len(data), 'udp')
+            try:
+                token, seq, frames = pysockets.split_datagram(data)
+            except (ValueError, struct.error):
+                continue
+            self.messages_received.inc(len(frames), 'udp')
+
+            op = self.udp_peers.get(token)
+            if op is None or op.closed or not op.udp.accept(seq):
+                continue
+
+            ## Inputs are repeated in every datagram, so dropping some loses nothing
+            now = time.monotonic()
+            if not (op.byte_bucket.take(len(data), now) and op.msg_bucket.take(1, now)):
+                self.flag(op, 'datagrams')
+                continue
+
+            if not frames:
+                op.udp_addr = addr
+                try:
+                    self.udp.sendto(op.udp.pack([]), addr)
+                except OSError:
+                    pass
+                continue
+
+            for binary, payload in frames:
+                if self.recorder is not None:
+                    self.recorder.received(op, binary, payload, udp=True)
+                try:
+                    msg = pysockets.decode_frame(binary, payload)
+                except (ValueError, KeyError, TypeError, struct.error):
+                    continue
+
+                if ('input' in msg or 'ack' in msg) and not self.handle_client_msg(op, msg):
+                    break
+
+
+    def handle_client_msg(self, online_player, msg):
+        '''
+        handle_msg() for a message received from a client. A message that decodes but can't be
+        handled, e.g. with a field of the wrong type, is an invalid frame: the connection is
+        flagged & closed, the server keeps running.
+
+        :param online_player: OnlinePlayer
+        :param msg: message dict
+        :return: False if the connection was closed
+        '''
+        try:
+            return self.handle_msg(online_player, msg)
+        except Exception as e:
+            self.flag(online_player, 'invalid')
+            self.disconnect(online_player, f'(invalid message: {e!r})')
+            return False
+
+
+    def handle_msg(self, online_player, msg):
+        '''
+        Negotiate the codec & record snapshot acknowledgements. Update player info if its
+        in-game, otherwise delete the player. Input commands move the player, the server keeps
+        it inside the world.
+
+        :param online_player: OnlinePlayer
+        :param msg: message dict, see pysockets.JsonCodec
+        :return: False if the connection was closed
+        '''
+        if 'hello' in msg:
+            ## Reply in JSON, the client switches codec once it reads the reply
+            hello = msg['hello'] if isinstance(msg['hello'], dict) else {}
+            online_player.codec = pysockets.negotiate_codec(
+                [] if self.json_only else hello.get('codecs', []))
+            reply = {'codec': online_player.codec.name}
+
+            local = online_player.transport == 'unix'
+            if (self.udp is not None and hello.get('udp') and online_player.udp is None
+                    and not local):
+                token = secrets.randbits(64)
+                while token in self.udp_peers:
+                    token = secrets.randbits(64)
+                online_player.udp = pysockets.DatagramChannel(token)
+                self.udp_peers[token] = online_player
+                reply['udp'] = token
+
+            mode = pysockets.negotiate_compression(hello.get('compression', []))
+            if (self.compression and mode is not None and online_player.compressor is None
+                    and not local):
+                online_player.compressor = pysockets.Compressor(mode, self.compress_threshold)
+                reply['compression'] = mode
+
+            ## A client that reconnects with its session token gets its player back
+            session = hello.get('session')
+            dropped = self.sessions.get(session) if isinstance(session, str) else None
+            if (dropped is not None and dropped is not online_player and dropped.pid is not None
+                    and online_player.room is None):
+                self.resume(online_player, dropped)
+                reply['resumed'] = True
+                reply['player'] = online_player.room.table.record(online_player.slot)
+            elif online_player.room is None and self.join_room(online_player,
+                                                               hello.get('room')) is None:
+                reply['error'] = 'Room full'
+                self.queue_frame(online_player, pysockets.JSON_CODEC.encode({'hello': reply}))
+                self.disconnect(online_player, '(room full)')
+                return False
+
+            if online_player.session is None and self.session_grace > 0:
+                self.start_session(online_player)
+            if online_player.session is not None:
+                reply['session'] = online_player.session
+            reply['room'] = online_player.room.name
+            self.queue_frame(online_player, pysockets.JSON_CODEC.encode({'hello': reply}))
+            return True
+
+        if 'ack' in msg:
+            if isinstance(msg['ack'], int):
+                online_player.ack = msg['ack']
+            return True
+
+        op = online_player
+        if 'input' in msg:
+            seq, dx, dy, t = msg['input']
+            if op.slot is None or seq <= op.input_seq:
+                return True
+            op.input_seq, op.input_time = seq, t
+
+            ## Move in place, clients split longer movements into several inputs
+            dx = max(-constants.MAX_INPUT_MOVE, min(dx, constants.MAX_INPUT_MOVE))
+            dy = max(-constants.MAX_INPUT_MOVE, min(dy, constants.MAX_INPUT_MOVE))
+            table = op.room.table
+            x, y = table.position(op.slot)
+            new_x, new_y = player.clamp_position(x + dx, y + dy)
+            if new_x != x or new_y != y:
+                table.set_position(op.slot, new_x, new_y)
+                op.room.dirty = True
+                if op.shared_slot is not None:
+                    self.table.write(op.shared_slot, table.record(op.slot))
+            return True
+
+        if 'player' not in msg:
+            return True
+        pid, x, y, in_game = msg['player']
+        if not in_game:
+            self.disconnect(op)
+            return False
+
+        ## Clients that skip the hello are assigned a room when they join
+        if op.room is None and self.join_room(op) is None:
+            self.disconnect(op, '(room full)')
+            return False
+        room = op.room
+
+        ## The position is only taken when joining, joined players move with inputs
+        if op.slot is None:
+            x, y = player.clamp_position(x, y)
+            op.slot = room.table.add((pid, x, y, 1))
+            room.dirty = True
+        else:
+            x, y = room.table.position(op.slot)
+        record = (pid, x, y, 1)
+        if room.table.record(op.slot) != record:
+            room.table.set(op.slot, record)
+            room.dirty = True
+
+        if op.pid != pid:
+            room.players.remove(op.pid, op)
+            op.pid = pid
+        room.players.add(pid, op)
+
+        if self.table is not None:
+            if op.shared_slot is None:
+                op.shared_slot = self.table.allocate()
+                if op.shared_slot is None:
+                    self.disconnect(op, '(server full)')
+                    return False
+            self.table.write(op.shared_slot, record)
+        return True
+
+
+    def disconnect(self, online_player, reason='', resumable=False):
+        '''
+        Close a connection and remove its player from the game. The player of a connection that
+        dropped stays in the game for the session grace period, see resume().
+
+        :param online_player: OnlinePlayer
+        :param reason: appended to the log message
+        :param resumable: the connection dropped, rather than the client leaving or being kicked
+        :return: None
+        '''
+        if online_player.closed:
+            return
+        online_player.closed = True
+        self.joined_versions = None
+        if self.recorder is not None:
+            self.recorder.closed(online_player, resumable)
+
+        if online_player.events:
+            self.selector.unregister(online_player.c)
+        online_player.c.close()
+        if online_player.udp is not None:
+            del self.udp_peers[online_player.udp.token]
+        online_player.outq.clear()
+        online_player.queued_bytes = 0
+
+        if online_player.pid is not None:
+            print(f'Player #{online_player.pid} disconnected {reason}'.rstrip())
+        else:
+            print(f'{online_player.addr[0]}:{online_player.addr[1]} disconnected {reason}'.rstrip())
+
+        if resumable and online_player.session is not None and online_player.pid is not None:
+            online_player.dropped_at = time.monotonic()
+            self.suspended[online_player.session] = online_player
+            return
+
+        self.end_session(online_player)
 
 
 ## -------------------------------------------------------------------------------------------------
-def broadcast_player_info():
-    '''
-    Broadcast player data to all connections
+class Room:
+    def __init__(self, name, aoi_radius, players=None, table=None, auto=True):
+        '''
+        Players that see each other. Every room has its own players, snapshots & snapshot history,
+        so its broadcast only goes to its members & costs nothing when another room changes.
 
-    :return: None
-    '''
-    try:
-        ## Broadcast updated player data back to clients
-        json_data = json_dumps_players()
+        :param name: room name
+        :param aoi_radius: area of interest radius, 0 sends every player of the room
+        :param players: registry.PlayerRegistry, defaults to a new one
+        :param table: playertable.PlayerTable, defaults to a new one
+        :param auto: clients that don't name a room may be assigned to it
+        '''
+        self.name = name
+        self.auto = auto
+        self.players = players if players is not None else registry.PlayerRegistry()
+        self.table = table if table is not None else playertable.PlayerTable()
+        self.members = set()            # Connections in the room, joined or not
+        self.dirty = False
 
-        for p in list(PLAYERS.values()):
-            pysockets.send_msg(p.c, json_data)
+        ## Numbered snapshot history used as delta baselines
+        self.snapshot_seq = 0
+        self.changed_seq = 0            # Last snapshot that differs from the one before it
+        self.snapshots = collections.OrderedDict()
+
+        ## Player positions indexed for area of interest queries
+        self.grid = spatial.SpatialGrid(aoi_radius) if aoi_radius > 0 else None
 
-    except (ConnectionResetError, ConnectionAbortedError):
-        pass
+
+    def __repr__(self):
+        return f'Room({self.name!r}, {len(self.members)} members)'
 
 
 ## -------------------------------------------------------------------------------------------------
 class OnlinePlayer:
+    __slots__ = ('c', 'pid', 'slot', 'addr', 'decoder', 'ack', 'visible_history', 'codec',
+                 'closed', 'shared_slot', 'input_seq', 'input_time', 'applied_state',
+                 'applied_seq', 'udp', 'udp_addr', 'outq', 'out_offset', 'queued_bytes', 'dropped',
+                 'drained_at', 'writable', 'compressor', 'head_compressed', 'events', 'msg_bucket',
+                 'byte_bucket', 'coalesced', 'flooding', 'strikes', 'throttled', 'room', 'session',
+                 'dropped_at', 'transport')
+
     def __init__(self, connection, address):
         '''
-        Class to correlate player data with a particular connection
+        Class to correlate player data with a particular connection. The player itself is kept
+        in the player table of its room.
 
-        :param connection: TCP connection obj
-        :param address: TCP address
+        :param connection: TCP or Unix socket connection obj
+        :param address: TCP address, ('unix', number) for Unix socket connections
         '''
         self.c = connection
-        self.player_data = None
+        self.transport = 'unix' if address[0] == 'unix' else 'tcp'
+        self.pid = None                 # Player ID once joined
+        self.room = None                # Room once the hello or the first player update arrived
+        self.slot = None                # Slot in the player table of the room once joined
         self.addr = address
+        self.decoder = pysockets.FrameDecoder(RECV_SIZE, max_frame_size=MAX_CLIENT_FRAME_SIZE)
+        self.ack = 0                    # Last snapshot acknowledged by the client
+        self.visible_history = collections.OrderedDict()    # Snapshot seq -> visible player IDs
+        self.codec = pysockets.JSON_CODEC
+        self.closed = False
+        self.shared_slot = None         # Slot in the shared player table of worker processes
+        self.input_seq = 0              # Last input command applied
+        self.input_time = 0             # Client time of that input command
+        self.applied_state = None       # (input seq, player record) last sent as 'applied'
+        self.applied_seq = 0            # Last snapshot sent with an 'applied' message
+        self.udp = None                 # pysockets.DatagramChannel if the client asked for UDP
+        self.udp_addr = None            # Client address of the UDP channel once registered
+
+        ## Outbound queue of (frame, droppable), drained by non-blocking sends
+        self.outq = collections.deque()
+        self.out_offset = 0             # Bytes of the first frame already sent
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.drained_at = time.monotonic()
+        self.writable = False           # Selector watches for writability
+        self.compressor = None          # pysockets.Compressor if the client asked for compression
+        self.head_compressed = False    # First queued frame is compressed
+        self.events = selectors.EVENT_READ  # Selector events watched, 0 when not registered
+
+        ## Rate limits, see GameServer.check_limits()
+        self.msg_bucket = ratelimit.TokenBucket(MSG_RATE, MSG_BURST)
+        self.byte_bucket = ratelimit.TokenBucket(BYTE_RATE, BYTE_BURST)
+        self.coalesced = None           # Message kind -> message held for the next tick
+        self.flooding = False           # Went over a limit since the last tick
+        self.strikes = 0
+        self.throttled = False          # Reading paused until the byte budget refills
+
+        self.session = None             # Session token, see GameServer.resume()
+        self.dropped_at = None          # Time the connection dropped, while the session is kept
+
+
+    @property
+    def queue_depth(self):
+        '''
+        Number of frames waiting in the outbound queue
+
+        :return: int
+        '''
+        return len(self.outq)
+
+
+    @property
+    def player_data(self):
+        '''
+        Copy of the player as Player, None before joining
+
+        :return: Player
+        '''
+        if self.slot is None:
+            return None
+
+        return player.player_from_record(self.room.table.record(self.slot))
 
 
     def __repr__(self):
@@ -0,0 +1,231 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import mmap
+import os
+import signal
+import socket
+import struct
+import traceback
+
+import player
+
+## =================================================================================================
+SLOTS_PER_WORKER    = 16384     # Players each worker process can host
+READ_RETRIES        = 100       # Attempts to read a region while its worker is writing it
+
+## Region header: version (odd while the worker is writing), number of slots in use
+REGION_HEADER       = struct.Struct('<QI')
+EMPTY_RECORD        = (0, 0, 0, False)
+
+## =================================================================================================
+def reuseport_supported():
+    '''
+    Check if several sockets can listen on the same port
+
+    :return: True/False
+    '''
+    return hasattr(socket, 'SO_REUSEPORT') and hasattr(os, 'fork')
+
+
+## -------------------------------------------------------------------------------------------------
+def run_workers(listen_sockets, table, serve):
+    '''
+    Fork one worker process per listening socket. The sockets are bound to the same port with
+    SO_REUSEPORT, so the kernel spreads new connections over the workers. Returns once every
+    worker exited.
+
+    :param listen_sockets: list of listening sockets
+    :param table: SharedPlayerTable, created before forking so every worker maps the same memory
+    :param serve: function running a server on a listening socket
+    :return: None
+    '''
+    pids = {}
+    for worker, s in enumerate(listen_sockets):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                for other in listen_sockets:
+                    if other is not s:
+                        other.close()
+                table.attach(worker)
+                serve(s)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+
+        pids[pid] = worker
+        print(f'Started worker {worker} (pid {pid})')
+
+    ## Connections are only accepted by the workers
+    for s in listen_sockets:
+        s.close()
+
+    while pids:
+        try:
+            pid, status = os.wait()
+        except KeyboardInterrupt:
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+            continue
+
+        ## Players of a dead worker would stay in the game forever
+        worker = pids.pop(pid, None)
+        if worker is not None:
+            table.clear(worker)
+            print(f'Worker {worker} (pid {pid}) exited')
+
+
+## -------------------------------------------------------------------------------------------------
+class SharedPlayerTable:
+    def __init__(self, workers, slots_per_worker=SLOTS_PER_WORKER):
+        '''
+        Player table in shared memory. Every worker owns a region of slots holding the players of
+        its connections & is the only one writing to it. Every worker reads all regions to build
+        complete snapshots.
+
+        Regions are guarded by a sequence lock: the writer makes the region version odd, writes,
+        then makes it even again. A reader copies the region & retries if the version changed
+        while copying. The version also tells readers whether a region changed at all.
+
+        :param workers: number of worker processes
+        :param slots_per_worker: players per worker
+        '''
+        self.workers = workers
+        self.slots_per_worker = slots_per_worker
+        self.region_size = REGION_HEADER.size + slots_per_worker * player.RECORD.size
+
+        ## Anonymous shared mapping, inherited by forked workers
+        self.mm = mmap.mmap(-1, workers * self.region_size)
+
+        ## Owned region, set in the worker by attach()
+        self.worker = None
+        self.version = 0
+        self.used = 0
+        self.free_slots = []
+
+        ## Last consistent copy & version of every region
+        self.seen_versions = [None] * workers
+        self.region_data = [b''] * workers
+
+
+    def attach(self, worker):
+        '''
+        Take ownership of a region, called in the worker process
+
+        :param worker: worker number
+        :return: None
+        '''
+        self.worker = worker
+
+
+    def allocate(self):
+        '''
+        Reserve a slot in the owned region
+
+        :return: slot number, None if the region is full
+        '''
+        if self.free_slots:
+            return self.free_slots.pop()
+        if self.used == self.slots_per_worker:
+            return None
+
+        self.used += 1
+        self.write(self.used - 1, EMPTY_RECORD)
+        return self.used - 1
+
+
+    def release(self, slot):
+        '''
+        Empty a slot of the owned region
+
+        :param slot: slot number
+        :return: None
+        '''
+        self.write(slot, EMPTY_RECORD)
+        self.free_slots.append(slot)
+
+
+    def write(self, slot, record):
+        '''
+        Write a player record to a slot of the owned region
+
+        :param slot: slot number
+        :param record: (id, x, y, in_game)
+        :return: None
+        '''
+        offset = self.worker * self.region_size
+        REGION_HEADER.pack_into(self.mm, offset, self.version + 1, self.used)
+        player.RECORD.pack_into(self.mm, offset + REGION_HEADER.size + slot * player.RECORD.size,
+                                *record)
+        self.version += 2
+        REGION_HEADER.pack_into(self.mm, offset, self.version, self.used)
+
+
+    def clear(self, worker):
+        '''
+        Empty the region of a worker that exited, called in the parent process
+
+        :param worker: worker number
+        :return: None
+        '''
+        offset = worker * self.region_size
+        version = REGION_HEADER.unpack_from(self.mm, offset)[0]
+        REGION_HEADER.pack_into(self.mm, offset, (version | 1) + 1, 0)
+
+
+    def changed(self):
+        '''
+        Check if any region changed since the last snapshot()
+
+        :return: True/False
+        '''
+        for worker in range(self.workers):
+            version = REGION_HEADER.unpack_from(self.mm, worker * self.region_size)[0]
+            if version != self.seen_versions[worker]:
+                return True
+
+        return False
+
+
+    def snapshot(self):
+        '''
+        Get every player in the table
+
+        :return: dict of player ID -> player record
+        '''
+        snapshot = {}
+        for worker in range(self.workers):
+            self.read_region(worker)
+            for record in player.RECORD.iter_unpack(self.region_data[worker]):
+                if record[3]:
+                    snapshot[record[0]] = record
+
+        return snapshot
+
+
+    def read_region(self, worker):
+        '''
+        Copy a region if it changed. If the worker keeps writing while it is copied, the previous
+        copy is kept until the next snapshot.
+
+        :param worker: worker number
+        :return: None
+        '''
+        offset = worker * self.region_size
+        for attempt in range(READ_RETRIES):
+            version, used = REGION_HEADER.unpack_from(self.mm, offset)
+            if version == self.seen_versions[worker]:
+                return
+            if version & 1:
+                continue
+
+            start = offset + REGION_HEADER.size
+            data = self.mm[start:start + used * player.RECORD.size]
+            if REGION_HEADER.unpack_from(self.mm, offset)[0] == version:
+                self.region_data[worker] = data
+                self.seen_versions[worker] = version
+                return
@@ -0,0 +1,101 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import collections
+
+## =================================================================================================
+class SpatialGrid:
+    def __init__(self, cell_size):
+        '''
+        Uniform grid (spatial hash) of player positions. Only the cells that hold players are
+        stored, so the grid covers a world of any size. Moving a player only touches its old & new
+        cell.
+
+        :param cell_size: cell width & height, queries are cheapest with a radius of one cell
+        '''
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(set)   # (cell x, cell y) -> player IDs
+        self.positions = {}                         # Player ID -> (x, y, cell)
+
+
+    def __len__(self):
+        return len(self.positions)
+
+
+    def cell(self, x, y):
+        '''
+        Get the cell holding a position
+
+        :param x: x position
+        :param y: y position
+        :return: (cell x, cell y)
+        '''
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+
+    def update(self, pid, x, y):
+        '''
+        Insert or move a player
+
+        :param pid: player ID
+        :param x: x position
+        :param y: y position
+        :return: None
+        '''
+        cell = self.cell(x, y)
+        old = self.positions.get(pid)
+        if old is None or old[2] != cell:
+            if old is not None:
+                self.remove_from_cell(pid, old[2])
+            self.cells[cell].add(pid)
+
+        self.positions[pid] = (x, y, cell)
+
+
+    def remove(self, pid):
+        '''
+        Remove a player, if it is in the grid
+
+        :param pid: player ID
+        :return: None
+        '''
+        old = self.positions.pop(pid, None)
+        if old is not None:
+            self.remove_from_cell(pid, old[2])
+
+
+    def remove_from_cell(self, pid, cell):
+        '''
+        Remove a player from a cell & drop the cell once it is empty
+
+        :param pid: player ID
+        :param cell: (cell x, cell y)
+        :return: None
+        '''
+        players = self.cells[cell]
+        players.discard(pid)
+        if not players:
+            del self.cells[cell]
+
+
+    def query(self, x, y, radius):
+        '''
+        Find the players within a radius of a position
+
+        :param x: x position
+        :param y: y position
+        :param radius: search radius
+        :return: set of player IDs
+        '''
+        found = set()
+        r2 = radius * radius
+        min_cx, min_cy = self.cell(x - radius, y - radius)
+        max_cx, max_cy = self.cell(x + radius, y + radius)
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                for pid in self.cells.get((cx, cy), ()):
+                    px, py, _ = self.positions[pid]
+                    if (px - x) * (px - x) + (py - y) * (py - y) <= r2:
+                        found.add(pid)
+
+        return found
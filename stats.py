@@ -0,0 +1,422 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import bisect
+import collections
+import selectors
+import signal
+import socket
+
+## =================================================================================================
+## Histogram buckets in seconds
+TIME_BUCKETS    = (0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+## Histogram buckets for outbound queue depths in frames
+DEPTH_BUCKETS   = (0, 1, 2, 4, 8, 16)
+
+MAX_REQUEST_SIZE    = 8192      # Bytes of an HTTP request header
+PROFILE_INTERVAL    = 0.005     # Seconds of CPU time between profiler samples
+PROFILE_DEPTH       = 32        # Stack frames kept per sample
+
+## =================================================================================================
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None):
+        '''
+        Monotonic counter, optionally split by the value of one label
+
+        :param name: metric name
+        :param help: description
+        :param label: label name, None for an unlabeled counter
+        '''
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = collections.defaultdict(int)
+
+
+    def inc(self, amount=1, label_value=''):
+        '''
+        Increase the counter
+
+        :param amount: increment
+        :param label_value: value of the label
+        :return: None
+        '''
+        self.values[label_value] += amount
+
+
+    def samples(self):
+        '''
+        :return: list of (name suffix, labels dict, value)
+        '''
+        if not self.values and self.label is None:
+            return [('', {}, 0)]
+
+        return [('', {self.label: v} if self.label else {}, value)
+                for v, value in sorted(self.values.items())]
+
+
+## -------------------------------------------------------------------------------------------------
+class Gauge:
+    def __init__(self, name, help, function, kind='gauge'):
+        '''
+        Value read when the metrics are rendered
+
+        :param name: metric name
+        :param help: description
+        :param function: function returning the current value
+        :param kind: 'counter' for totals kept elsewhere
+        '''
+        self.name = name
+        self.help = help
+        self.function = function
+        self.kind = kind
+
+
+    def samples(self):
+        return [('', {}, self.function())]
+
+
+## -------------------------------------------------------------------------------------------------
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS, label=None):
+        '''
+        Distribution of observed values in cumulative buckets, optionally split by the value of
+        one label
+
+        :param name: metric name
+        :param help: description
+        :param buckets: sorted upper bounds of the buckets
+        :param label: label name, None for an unlabeled histogram
+        '''
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        ## Label value -> [count per bucket + overflow, sum, count]
+        self.values = {}
+
+
+    def observe(self, value, label_value=''):
+        '''
+        Record a value
+
+        :param value: observed value
+        :param label_value: value of the label
+        :return: None
+        '''
+        data = self.values.get(label_value)
+        if data is None:
+            data = self.values[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+
+    def samples(self):
+        samples = []
+        for v, (counts, total, count) in sorted(self.values.items()):
+            labels = {self.label: v} if self.label else {}
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                samples.append(('_bucket', dict(labels, le=repr(float(bound))), cumulative))
+            samples.append(('_bucket', dict(labels, le='+Inf'), count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+
+        return samples
+
+
+## -------------------------------------------------------------------------------------------------
+class Registry:
+    def __init__(self):
+        '''
+        Set of metrics rendered together in the Prometheus text format
+        '''
+        self.metrics = []
+
+
+    def counter(self, name, help, label=None):
+        return self.register(Counter(name, help, label))
+
+
+    def gauge(self, name, help, function, kind='gauge'):
+        return self.register(Gauge(name, help, function, kind))
+
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS, label=None):
+        return self.register(Histogram(name, help, buckets, label))
+
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+
+    def render(self):
+        '''
+        Render every metric
+
+        :return: string in the Prometheus text exposition format
+        '''
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                    lines.append(f'{metric.name}{suffix}{{{label_text}}} {value}')
+                else:
+                    lines.append(f'{metric.name}{suffix} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+## -------------------------------------------------------------------------------------------------
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        '''
+        Statistical profiler for the main thread. A SIGPROF timer interrupts the process after
+        every interval of CPU time & the interrupted stack is counted. Costs nothing while
+        stopped, so it can be started & stopped on a running server. Only available where
+        signal.setitimer() is (not on Windows).
+
+        :param interval: seconds of CPU time between samples
+        '''
+        self.interval = interval
+        self.stacks = collections.Counter()     # 'outer;...;inner' -> samples
+        self.running = False
+
+
+    @staticmethod
+    def supported():
+        return hasattr(signal, 'setitimer')
+
+
+    def start(self):
+        '''
+        Start sampling, keeping the samples taken before
+
+        :return: None
+        '''
+        if self.running:
+            return
+
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+
+    def stop(self):
+        '''
+        Stop sampling
+
+        :return: None
+        '''
+        if not self.running:
+            return
+
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.running = False
+
+
+    def reset(self):
+        self.stacks.clear()
+
+
+    def sample(self, signum, frame):
+        names = []
+        while frame is not None and len(names) < PROFILE_DEPTH:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(names))] += 1
+
+
+    def report(self):
+        '''
+        Get the samples in the collapsed stack format read by flame graph tools
+
+        :return: string, one 'stack count' line per stack
+        '''
+        return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+
+## -------------------------------------------------------------------------------------------------
+class StatsServer:
+    def __init__(self, selector, address, registry, profiler=None):
+        '''
+        Minimal HTTP server for the metrics & the profiler, run by the game server's selector.
+        Every request is answered & the connection closed.
+
+            GET /metrics            metrics in the Prometheus text format
+            GET /profile            profiler samples in the collapsed stack format
+            GET /profile/start      start the profiler
+            GET /profile/stop       stop the profiler
+            GET /profile/reset      drop the samples
+
+        Sockets are registered with a callback as selector data, see handle_event().
+
+        :param selector: selector of the game server's event loop
+        :param address: (ip, port) to listen on, should be local
+        :param registry: Registry
+        :param profiler: SamplingProfiler, None disables the profile paths
+        '''
+        self.selector = selector
+        self.registry = registry
+        self.profiler = profiler
+
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.s.bind(address)
+        self.s.listen()
+        self.s.setblocking(False)
+        self.address = self.s.getsockname()
+        self.selector.register(self.s, selectors.EVENT_READ, self.handle_event)
+
+        ## Connection -> [received request bytes, response bytes or None]
+        self.connections = {}
+
+
+    def handle_event(self, sock, mask):
+        '''
+        Handle a selector event of the listening socket or a connection
+
+        :param sock: socket
+        :param mask: selector event mask
+        :return: None
+        '''
+        if sock is self.s:
+            self.accept()
+        elif mask & selectors.EVENT_READ:
+            self.read(sock)
+        elif mask & selectors.EVENT_WRITE:
+            self.write(sock)
+
+
+    def accept(self):
+        while True:
+            try:
+                c, _ = self.s.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+            c.setblocking(False)
+            self.connections[c] = [b'', None]
+            self.selector.register(c, selectors.EVENT_READ, self.handle_event)
+
+
+    def read(self, c):
+        try:
+            data = c.recv(MAX_REQUEST_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self.close(c)
+            return
+
+        request = self.connections[c][0] + data
+        self.connections[c][0] = request
+        if b'\r\n\r\n' not in request and len(request) < MAX_REQUEST_SIZE:
+            return
+
+        try:
+            method, path = request.split(b' ', 2)[:2]
+            method, path = method.decode('ascii'), path.decode('ascii')
+        except (ValueError, UnicodeDecodeError):
+            method, path = None, None
+
+        if method is None:
+            status, body, content_type = '400 Bad Request', 'Bad request\n', 'text/plain'
+        else:
+            status, body, content_type = self.respond(method, path)
+
+        body = body.encode('utf-8')
+        self.connections[c][1] = (f'HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n'
+                                  f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                                  ).encode('ascii') + body
+        self.selector.modify(c, selectors.EVENT_WRITE, self.handle_event)
+        self.write(c)
+
+
+    def write(self, c):
+        response = self.connections[c][1]
+        try:
+            n = c.send(response)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close(c)
+            return
+
+        self.connections[c][1] = response[n:]
+        if n == len(response):
+            self.close(c)
+
+
+    def respond(self, method, path):
+        '''
+        Answer a request
+
+        :param method: HTTP method
+        :param path: request path
+        :return: (status, body, content type)
+        '''
+        if method != 'GET':
+            return '405 Method Not Allowed', 'Only GET is supported\n', 'text/plain'
+
+        path = path.split('?', 1)[0].rstrip('/')
+        if path == '/metrics':
+            return '200 OK', self.registry.render(), 'text/plain; version=0.0.4'
+
+        if path.startswith('/profile'):
+            if self.profiler is None or not self.profiler.supported():
+                return '404 Not Found', 'Profiler not available\n', 'text/plain'
+            if path == '/profile':
+                return '200 OK', self.profiler.report(), 'text/plain'
+            if path == '/profile/start':
+                try:
+                    self.profiler.start()
+                except ValueError as e:
+                    ## Signal handlers can only be set in the main thread
+                    return '409 Conflict', f'Profiler not started: {e}\n', 'text/plain'
+                return '200 OK', 'Profiler started\n', 'text/plain'
+            if path == '/profile/stop':
+                self.profiler.stop()
+                return '200 OK', 'Profiler stopped\n', 'text/plain'
+            if path == '/profile/reset':
+                self.profiler.reset()
+                return '200 OK', 'Profiler reset\n', 'text/plain'
+
+        return '404 Not Found', 'Not found\n', 'text/plain'
+
+
+    def close(self, c=None):
+        '''
+        Close a connection, or the server with every connection
+
+        :param c: connection, None closes the server
+        :return: None
+        '''
+        for conn in ([c] if c is not None else list(self.connections)):
+            self.selector.unregister(conn)
+            conn.close()
+            del self.connections[conn]
+
+        if c is None:
+            if self.profiler is not None:
+                self.profiler.stop()
+            self.selector.unregister(self.s)
+            self.s.close()
@@ -0,0 +1,222 @@
+## =================================================================================================
+## Python 3.6+
+## =================================================================================================
+import selectors
+import socket
+
+import pytest
+
+import constants
+import pysockets
+import server
+
+## Messages that decode, or used to, but can't be handled
+MALFORMED = (
+    b'"hello"',
+    b'"ack"',
+    b'"player"',
+    b'[1, 2]',
+    b'{"hello": {"codecs": 5}}',
+    b'{"hello": {"codecs": [[1]]}}',
+    b'{"hello": 5}',
+)
+
+
+## =================================================================================================
+@pytest.fixture
+def game_server():
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.bind(('127.0.0.1', 0))
+    listen_socket.listen()
+    game_server = server.GameServer(listen_socket, session_grace=0)
+    yield game_server
+    game_server.close()
+
+
+def connect(game_server):
+    '''
+    :return: (OnlinePlayer registered with the server, client end of its connection)
+    '''
+    c, client = socket.socketpair()
+    c.setblocking(False)
+    op = server.OnlinePlayer(c, ('127.0.0.1', c.fileno()))
+    game_server.selector.register(c, selectors.EVENT_READ, op)
+    return op, client
+
+
+## -------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('payload', [b'"hello"', b'[1, 2]', b'5', b'null'])
+def test_json_decode_rejects_non_dict(payload):
+    with pytest.raises(ValueError):
+        pysockets.JSON_CODEC.decode(payload)
+
+
+@pytest.mark.parametrize('offered', [5, None, 'json', [[1]], [{}], [5, 'json']])
+def test_negotiate_codec_ignores_invalid_offers(offered):
+    assert pysockets.negotiate_codec(offered) is pysockets.JSON_CODEC
+
+
+@pytest.mark.parametrize('msg', [
+    {'hello': {'codecs': 5}},
+    {'hello': {'codecs': [[1]]}},
+    {'hello': {'compression': {}, 'room': [1]}},
+])
+def test_handle_msg_survives_bad_hello(game_server, msg):
+    op, client = connect(game_server)
+    assert game_server.handle_client_msg(op, msg)
+    assert op.codec is pysockets.JSON_CODEC
+    game_server.disconnect(op)
+    client.close()
+
+
+@pytest.mark.parametrize('msg', [
+    {'player': (1, 2)},
+    {'input': 5},
+    {'player': None},
+])
+def test_handle_msg_exception_closes_connection(game_server, msg):
+    op, client = connect(game_server)
+    assert not game_server.handle_client_msg(op, msg)
+    assert op.closed
+    client.close()
+
+
+@pytest.mark.parametrize('payload', MALFORMED)
+def test_malformed_frame_keeps_server_running(game_server, payload):
+    op, client = connect(game_server)
+    client.sendall(pysockets.frame_text(str(payload, 'utf-8')))
+    game_server.read_data(op)
+
+    ## The server goes on handling the other connections
+    other, other_client = connect(game_server)
+    other_client.sendall(pysockets.JSON_CODEC.encode({'hello': {'codecs': ['json']}}))
+    game_server.read_data(other)
+    assert not other.closed and other.room is not None
+
+    for op, client in ((op, client), (other, other_client)):
+        game_server.disconnect(op)
+        client.close()
+
+
+def test_coalesced_malformed_message_closes_connection(game_server):
+    op, client = connect(game_server)
+    game_server.coalesce(op, {'player': None})
+    game_server.limited.add(op)
+    game_server.check_limits()
+    assert op.closed
+    client.close()
+
+
+def test_area_of_interest_delta_against_dropped_snapshot(game_server):
+    op, client = connect(game_server)
+    client.setblocking(False)
+    assert game_server.handle_client_msg(op, {'player': (1, 100, 100, True)})
+
+    ## The client keeps acknowledging the first snapshot until it leaves the history
+    room = game_server.default_room
+    for i in range(constants.SNAPSHOT_HISTORY + 2):
+        assert game_server.handle_client_msg(op, {'player': (1, 100 + i, 100, True)})
+        game_server.broadcast_player_info(room)
+        op.ack = 1
+        try:
+            while client.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    game_server.disconnect(op)
+    client.close()
+
+
+def test_udp_resend_survives_disconnect(game_server):
+    game_server.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    game_server.udp.bind(('127.0.0.1', 0))
+    room = game_server.default_room
+
+    ## Enough players that a snapshot doesn't fit in a datagram & goes over TCP
+    connections = []
+    for pid in range(1, 151):
+        op, client = connect(game_server)
+        assert game_server.handle_client_msg(op, {'player': (pid, 100, 100, True)})
+        connections.append((op, client))
+
+    ## UDP clients waiting for the latest snapshot drop their connections
+    for pid in (151, 152):
+        op, client = connect(game_server)
+        assert game_server.handle_client_msg(op, {'hello': {'udp': True}})
+        assert game_server.handle_client_msg(op, {'player': (pid, 100, 100, True)})
+        op.udp_addr = game_server.udp.getsockname()
+        connections.append((op, client))
+
+    game_server.broadcast_player_info(room)
+    room.dirty = False
+    for op, client in connections[-2:]:
+        client.close()
+    game_server.tick()
+    assert not game_server.udp_peers
+
+    for op, client in connections:
+        game_server.disconnect(op)
+        client.close()
+    game_server.udp.close()
+
+
+def test_all_players_reused_until_registry_changes(game_server):
+    op, client = connect(game_server)
+    assert game_server.handle_client_msg(op, {'player': (1, 100, 100, True)})
+    version = game_server.default_room.players.version
+    players = game_server.all_players()
+    assert players == [op] and game_server.all_players() is players
+
+    other, other_client = connect(game_server)
+    assert game_server.handle_client_msg(other, {'player': (2, 100, 100, True)})
+    assert game_server.default_room.players.version > version
+    assert game_server.all_players() == [op, other]
+
+    game_server.disconnect(op)
+    assert game_server.all_players() == [other]
+
+    game_server.disconnect(other)
+    for c in (client, other_client):
+        c.close()
+
+
+def test_joined_player_only_moves_with_inputs(game_server):
+    op, client = connect(game_server)
+    table = game_server.default_room.table
+    assert game_server.handle_client_msg(op, {'player': (1, 100, 100, True)})
+    assert table.position(op.slot) == (100, 100)
+
+    ## Positions sent after joining are ignored
+    assert game_server.handle_client_msg(op, {'player': (1, 900, 900, True)})
+    assert table.position(op.slot) == (100, 100)
+
+    ## Inputs move at most MAX_INPUT_MOVE per axis
+    assert game_server.handle_client_msg(op, {'input': (1, 30000, -30000, 0)})
+    assert table.position(op.slot) == (100 + constants.MAX_INPUT_MOVE,
+                                       100 - constants.MAX_INPUT_MOVE)
+
+    game_server.disconnect(op)
+    client.close()
+
+
+def test_stalled_client_queue_stays_bounded(game_server):
+    op, client = connect(game_server)
+    assert game_server.handle_client_msg(op, {'player': (1, 100, 100, True)})
+
+    ## Fill the socket buffers, the client stops reading
+    try:
+        while True:
+            op.c.send(bytes(65536))
+    except BlockingIOError:
+        pass
+
+    ## Every snapshot is preceded by a new applied input
+    room = game_server.default_room
+    for seq in range(1, 4 * server.MAX_QUEUED_FRAMES):
+        assert game_server.handle_client_msg(op, {'input': (seq, 1, 0, 0)})
+        game_server.broadcast_player_info(room)
+        assert len(op.outq) <= server.MAX_QUEUED_FRAMES
+
+    game_server.disconnect(op)
+    client.close()